@@ -0,0 +1,102 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+
+log = logging.getLogger("mandelbrot.agent.batcher")
+
+class EvaluationBatch(object):
+    """
+    A group of check evaluations which are submitted together.
+    """
+    def __init__(self, check_evaluations):
+        """
+        :param check_evaluations: The evaluations contained in the batch
+        :type check_evaluations: list[mandelbrot.agent.evaluator.CheckEvaluation]
+        """
+        self.check_evaluations = check_evaluations
+
+    def __len__(self):
+        return len(self.check_evaluations)
+
+class Batcher(object):
+    """
+    The Batcher gathers check evaluations into batches.  A batch is released
+    when it holds batch_size evaluations, or when batch_window seconds have
+    elapsed since the first evaluation was added to it, whichever comes
+    first.
+    """
+    def __init__(self, event_loop, batch_size, batch_window):
+        """
+        :param event_loop:
+        :type event_loop: asyncio.AbstractEventLoop
+        :param batch_size: The maximum number of evaluations in a batch
+        :type batch_size: int
+        :param batch_window: The maximum number of seconds to wait before
+          releasing an incomplete batch
+        :type batch_window: float
+        """
+        self.event_loop = event_loop
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.current = []
+        self.handle = None
+        self.queue = asyncio.Queue(loop=event_loop)
+
+    def append(self, check_evaluation):
+        """
+        Add the check evaluation to the current batch.
+
+        :param check_evaluation:
+        :type check_evaluation: mandelbrot.agent.evaluator.CheckEvaluation
+        """
+        self.current.append(check_evaluation)
+        if len(self.current) >= self.batch_size:
+            self.flush()
+        elif self.handle is None:
+            self.handle = self.event_loop.call_later(self.batch_window, self.flush)
+
+    def flush(self):
+        """
+        Release the current batch, if it is not empty.
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if len(self.current) > 0:
+            log.debug("releasing batch of %d evaluations", len(self.current))
+            self.queue.put_nowait(EvaluationBatch(self.current))
+            self.current = []
+
+    def next_batch(self):
+        """
+        Yields until the next batch is available.
+
+        :returns: A coroutine which yields the next EvaluationBatch.
+        :rtype: asyncio.coroutine
+        """
+        return self.queue.get()
+
+    def cancel(self):
+        """
+        Discard the current batch without releasing it.
+        """
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        self.current = []
@@ -0,0 +1,112 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import logging
+
+log = logging.getLogger("mandelbrot.agent.coalescer")
+
+from mandelbrot.stats import get_stats
+
+class CoalescingQueue(object):
+    """
+    A queue of check evaluations which holds only the freshest evaluation
+    for each check.  When an evaluation is added while an older evaluation
+    for the same check is still queued, the older evaluation is replaced,
+    unless the health differs, in which case both are kept so that every
+    health transition reaches the consumer.  Checks are dequeued in
+    round-robin order, so a flapping check cannot starve the others.
+    """
+    def __init__(self, event_loop, max_transitions=16):
+        """
+        :param event_loop:
+        :type event_loop: asyncio.AbstractEventLoop
+        :param max_transitions: The maximum number of evaluations queued for
+          a single check, after which the oldest transition is dropped
+        :type max_transitions: int
+        """
+        self.event_loop = event_loop
+        self.max_transitions = max_transitions
+        self.pending = collections.OrderedDict()
+        self.size = 0
+        self.ready_event = asyncio.Event(loop=event_loop)
+        self.stats = get_stats('mandelbrot.agent.coalescer')
+
+    def qsize(self):
+        return self.size
+
+    def empty(self):
+        return self.size == 0
+
+    def put_nowait(self, check_evaluation):
+        """
+        Add the check evaluation to the queue, coalescing it with any queued
+        evaluation for the same check which has the same health.
+
+        :param check_evaluation:
+        :type check_evaluation: mandelbrot.agent.evaluator.CheckEvaluation
+        """
+        check_id = check_evaluation.check_id
+        health = check_evaluation.evaluation.get_health()
+        queued = self.pending.get(check_id)
+        if queued is None:
+            queued = self.pending[check_id] = collections.deque()
+        if len(queued) > 0 and queued[-1].evaluation.get_health() == health:
+            log.debug("coalescing evaluation for check %s", check_id)
+            queued[-1] = check_evaluation
+            self.stats.increment('coalesced evaluations')
+        else:
+            if len(queued) >= self.max_transitions:
+                log.warning("dropping oldest transition for check %s", check_id)
+                queued.popleft()
+                self.size -= 1
+                self.stats.increment('dropped transitions')
+            queued.append(check_evaluation)
+            self.size += 1
+        self.stats.set_gauge('queued evaluations', self.size)
+        self.ready_event.set()
+
+    def get_nowait(self):
+        """
+        Remove and return the oldest evaluation of the next check.
+
+        :rtype: mandelbrot.agent.evaluator.CheckEvaluation
+        :raises asyncio.QueueEmpty: If no evaluations are queued.
+        """
+        if self.size == 0:
+            raise asyncio.QueueEmpty()
+        check_id,queued = self.pending.popitem(last=False)
+        check_evaluation = queued.popleft()
+        if len(queued) > 0:
+            self.pending[check_id] = queued
+        self.size -= 1
+        if self.size == 0:
+            self.ready_event.clear()
+        self.stats.set_gauge('queued evaluations', self.size)
+        return check_evaluation
+
+    @asyncio.coroutine
+    def get(self):
+        """
+        Wait until an evaluation is queued, then remove and return it.
+
+        :rtype: mandelbrot.agent.evaluator.CheckEvaluation
+        """
+        while self.size == 0:
+            yield from self.ready_event.wait()
+        return self.get_nowait()
@@ -0,0 +1,117 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+log = logging.getLogger("mandelbrot.agent.credits")
+
+from mandelbrot.stats import get_stats
+
+# the capacity used when neither the transport nor the settings bound it
+default_capacity = 16
+
+class SubmitCredits(object):
+    """
+    Credit-based flow control for submissions.  Each submission in flight
+    holds one credit, and there are capacity credits in total, so the
+    number of outstanding requests never exceeds what the transport can
+    carry.  If credits were exhausted and evaluations are still waiting
+    when a submission completes, then the stretch factor is doubled, up to
+    max_stretch; once the backlog clears and fewer than half the credits
+    are in use, the stretch is halved back towards 1.0.  The stretch is
+    applied to the check intervals, so the agent produces evaluations no
+    faster than the endpoint accepts them.
+    """
+    def __init__(self, capacity, max_stretch=8.0):
+        """
+        :param capacity: The maximum number of submissions in flight
+        :type capacity: int
+        :param max_stretch: The maximum interval multiplier
+        :type max_stretch: float
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be greater than 0")
+        self.capacity = capacity
+        self.max_stretch = max_stretch
+        self.in_flight = 0
+        self.stretch = 1.0
+        self.stats = get_stats('mandelbrot.agent.credits')
+        self.stats.set_gauge('capacity', capacity)
+        self.stats.set_gauge('in flight', 0)
+        self.stats.set_gauge('stretch', self.stretch)
+
+    def available(self):
+        """
+        :returns: The number of credits which are not in use.
+        :rtype: int
+        """
+        return self.capacity - self.in_flight
+
+    def acquire(self):
+        """
+        Take a credit for a submission.
+
+        :returns: True if a credit was taken, False if none are available.
+        :rtype: bool
+        """
+        if self.in_flight >= self.capacity:
+            return False
+        self.in_flight += 1
+        if self.in_flight == self.capacity:
+            self.stats.increment('exhausted')
+        self.stats.set_gauge('in flight', self.in_flight)
+        return True
+
+    def release(self, backlog=0):
+        """
+        Return the credit held by a completed submission, and adjust the
+        stretch according to the number of evaluations still waiting.
+
+        :param backlog: The number of evaluations waiting to be submitted
+        :type backlog: int
+        """
+        exhausted = self.in_flight >= self.capacity
+        self.in_flight = max(0, self.in_flight - 1)
+        self.stats.set_gauge('in flight', self.in_flight)
+        if exhausted and backlog > 0:
+            stretch = min(self.stretch * 2.0, self.max_stretch)
+        elif backlog == 0 and self.in_flight * 2 < self.capacity:
+            stretch = max(self.stretch / 2.0, 1.0)
+        else:
+            stretch = self.stretch
+        if stretch != self.stretch:
+            log.info("submit backlog is %d evaluations, stretching check intervals by %.1f",
+                backlog, stretch)
+            self.stretch = stretch
+            self.stats.set_gauge('stretch', stretch)
+
+def size_submit_credits(transport_capacity=None, max_in_flight=None):
+    """
+    Return the number of submit credits, which is the smaller of the
+    transport capacity and max_in_flight, or default_capacity if neither
+    is specified.
+
+    :param transport_capacity:
+    :type transport_capacity: int
+    :param max_in_flight:
+    :type max_in_flight: int
+    :rtype: int
+    """
+    bounds = [bound for bound in (transport_capacity, max_in_flight) if bound is not None]
+    if len(bounds) == 0:
+        return default_capacity
+    return min(bounds)
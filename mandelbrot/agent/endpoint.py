@@ -23,20 +23,46 @@ import logging
 log = logging.getLogger("mandelbrot.agent.endpoint")
 
 import mandelbrot.transport
-from mandelbrot.transport import RetryLater
+from mandelbrot.transport import RetryLater, BadRequest, Conflict, NotImplemented, ResourceNotFound
+from mandelbrot.transport.retry import RetryingTransport
 from mandelbrot.model.agent_metadata import AgentMetadata
 from mandelbrot.model.registration import Registration
+from mandelbrot.model.metric_schema import make_metric_schemas
+from mandelbrot.model.fingerprint import make_fingerprint, list_sections
+from mandelbrot.model.timestamp import now
 from mandelbrot.model import construct
+from mandelbrot.stats import get_stats
+
+# the endpoint rejected a patch, so the full registration must be sent
+patch_exceptions = (BadRequest, Conflict, NotImplemented, ResourceNotFound)
 
 class Endpoint(object):
     """
+    If positional_metrics is True, then once the agent is registered, the
+    metrics of each evaluation are submitted as a vector ordered by the
+    metric schema of the check, instead of keyed by metric name.  An
+    evaluation containing any metric which was not registered is submitted
+    with named metrics.
     """
-    def __init__(self, transport):
+    def __init__(self, transport, positional_metrics=False):
         """
         :param transport:
         :type transport: mandelbrot.transport.Transport
+        :param positional_metrics:
+        :type positional_metrics: bool
         """
         self.transport = transport
+        self.positional_metrics = positional_metrics
+        self.metric_schemas = {}
+        self.stats = get_stats('mandelbrot.agent.endpoint')
+
+    def get_capacity(self):
+        """
+        :returns: The number of requests the transport can have outstanding
+          at once, or None if the capacity is unbounded.
+        :rtype: int
+        """
+        return self.transport.get_capacity()
 
     @asyncio.coroutine
     def get_agent(self, agent_id):
@@ -58,6 +84,7 @@ class Endpoint(object):
         """
         item = registration.destructure()
         agent_metadata = yield from self.transport.create_item('v2/agents', item)
+        self.metric_schemas = make_metric_schemas(registration)
         return construct(AgentMetadata, agent_metadata)
 
     @asyncio.coroutine
@@ -70,8 +97,92 @@ class Endpoint(object):
         """
         path = 'v2/agents/' + str(agent_id)
         agent_metadata = yield from self.transport.replace_item(path, registration.destructure())
+        self.metric_schemas = make_metric_schemas(registration)
         return construct(AgentMetadata, agent_metadata)
 
+    @asyncio.coroutine
+    def patch_agent(self, agent_id, registration, fields, constraints):
+        """
+        Replace the specified fields of the agent registration, if all
+        constraints hold.  Each field is named by its section of the
+        registration (see mandelbrot.model.fingerprint), and a field whose
+        value is None is removed.
+
+        :param agent_id:
+        :type agent_id: cifparser.Path
+        :param registration: The registration after the patch is applied
+        :type registration: mandelbrot.model.registration.Registration
+        :param fields:
+        :type fields: dict[str,object]
+        :param constraints:
+        :type constraints: dict
+        :returns: The agent metadata, or None if the endpoint returned none.
+        :rtype: mandelbrot.model.agent_metadata.AgentMetadata
+        """
+        path = 'v2/agents/' + str(agent_id)
+        agent_metadata = yield from self.transport.patch_item(path, fields, constraints)
+        self.metric_schemas = make_metric_schemas(registration)
+        if agent_metadata is None:
+            return None
+        return construct(AgentMetadata, agent_metadata)
+
+    @asyncio.coroutine
+    def synchronize_agent(self, agent_id, registration, accepted=None):
+        """
+        Bring the endpoint up to date with the registration.  If accepted
+        is the fingerprint of the registration the endpoint last accepted
+        and the registration has not expired, then nothing is sent if the
+        registration is unchanged, otherwise only the changed sections are
+        patched.  If there is no accepted fingerprint or the endpoint
+        rejects the patch, then the agent is registered, or updated if it
+        is already registered.
+
+        :param agent_id:
+        :type agent_id: cifparser.Path
+        :param registration:
+        :type registration: mandelbrot.model.registration.Registration
+        :param accepted:
+        :type accepted: mandelbrot.model.fingerprint.RegistrationFingerprint
+        :returns: The fingerprint of the registration the endpoint accepted.
+        :rtype: mandelbrot.model.fingerprint.RegistrationFingerprint
+        """
+        fingerprint = make_fingerprint(registration)
+        if accepted is not None and (accepted.get_expires() is None
+                or accepted.get_expires() > now().destructure()):
+            changed,removed = fingerprint.diff(accepted)
+            if not changed and not removed:
+                log.debug("registration for %s is unchanged", agent_id)
+                self.metric_schemas = make_metric_schemas(registration)
+                self.stats.increment('skipped registrations')
+                fingerprint.generation = accepted.generation
+                fingerprint.expires = accepted.expires
+                return fingerprint
+            if 'agentId' not in changed:
+                sections = list_sections(registration.destructure())
+                fields = {name: sections[name] for name in changed}
+                fields.update({name: None for name in removed})
+                constraints = {}
+                if accepted.get_generation() is not None:
+                    constraints['generation'] = accepted.get_generation()
+                try:
+                    log.debug("patching %d sections of registration for %s",
+                        len(fields), agent_id)
+                    agent_metadata = yield from self.patch_agent(agent_id,
+                        registration, fields, constraints)
+                except patch_exceptions as e:
+                    log.debug("failed to patch registration for %s: %s", agent_id, repr(e))
+                else:
+                    self.stats.increment('patched registrations')
+                    return update_fingerprint(fingerprint, agent_metadata)
+        try:
+            log.debug("registering %s with endpoint", agent_id)
+            agent_metadata = yield from self.register_agent(registration)
+        except Conflict:
+            log.debug("agent %s exists, updating endpoint", agent_id)
+            agent_metadata = yield from self.update_agent(agent_id, registration)
+        self.stats.increment('full registrations')
+        return update_fingerprint(fingerprint, agent_metadata)
+
     @asyncio.coroutine
     def unregister_agent(self, agent_id):
         """
@@ -92,11 +203,83 @@ class Endpoint(object):
         :type evaluation: mandelbrot.model.evaluation.Evaluation
         """
         path = 'v2/agents/' + str(agent_id) + '/checks/' + str(check_id)
-        yield from self.transport.create_item(path, evaluation.destructure())
+        yield from self.transport.create_item(path, self.destructure_evaluation(check_id, evaluation))
         return None
 
+    def destructure_evaluation(self, check_id, evaluation):
+        """
+        :param check_id:
+        :type check_id: cifparser.Path
+        :param evaluation:
+        :type evaluation: mandelbrot.model.evaluation.Evaluation
+        :rtype: dict
+        """
+        structure = evaluation.destructure()
+        if not self.positional_metrics or 'metrics' not in structure:
+            return structure
+        metric_schema = self.metric_schemas.get(str(check_id))
+        if metric_schema is None:
+            return structure
+        vector = metric_schema.pack(structure['metrics'])
+        if vector is None:
+            log.debug("check %s has unregistered metrics, submitting metrics by name", check_id)
+            return structure
+        del structure['metrics']
+        structure['metricSchema'] = metric_schema.version
+        structure['metricVector'] = vector
+        return structure
+
+    @asyncio.coroutine
+    def submit_evaluations(self, agent_id, evaluations):
+        """
+        Submit multiple evaluations in a single request.  The result for
+        each evaluation is reported separately, so a failure to accept one
+        evaluation does not affect the others in the batch.
+
+        :param agent_id:
+        :type agent_id: cifparser.Path
+        :param evaluations:
+        :type evaluations: list[(cifparser.Path,mandelbrot.model.evaluation.Evaluation)]
+        :returns: A list of (check_id, result) pairs, where result is None
+          if the evaluation was accepted, otherwise the TransportException.
+        :rtype: list[(cifparser.Path,mandelbrot.transport.TransportException)]
+        """
+        path = 'v2/agents/' + str(agent_id) + '/evaluations'
+        items = []
+        for check_id,evaluation in evaluations:
+            item = self.destructure_evaluation(check_id, evaluation)
+            item['checkId'] = str(check_id)
+            items.append(item)
+        results = yield from self.transport.create_items(path, items)
+        check_results = []
+        for (check_id,_),result in zip(evaluations, results):
+            if isinstance(result, mandelbrot.transport.TransportException):
+                check_results.append((check_id, result))
+            else:
+                check_results.append((check_id, None))
+        return check_results
+
+def update_fingerprint(fingerprint, agent_metadata):
+    """
+    Record the generation and expiry of the accepted registration in the
+    fingerprint.
+
+    :param fingerprint:
+    :type fingerprint: mandelbrot.model.fingerprint.RegistrationFingerprint
+    :param agent_metadata:
+    :type agent_metadata: mandelbrot.model.agent_metadata.AgentMetadata
+    :rtype: mandelbrot.model.fingerprint.RegistrationFingerprint
+    """
+    if agent_metadata is not None:
+        if agent_metadata.get_generation() is not None:
+            fingerprint.set_generation(agent_metadata.get_generation())
+        if agent_metadata.get_expires() is not None:
+            fingerprint.set_expires(agent_metadata.get_expires().destructure())
+    return fingerprint
+
 @contextlib.contextmanager
-def make_endpoint(event_loop, endpoint_url, registry, transport_workers):
+def make_endpoint(event_loop, endpoint_url, registry, transport_workers, retry_policy=None,
+                  positional_metrics=False, transport_options=None):
     """
     Create the transport and construct the agent endpoint.
 
@@ -106,15 +289,28 @@ def make_endpoint(event_loop, endpoint_url, registry, transport_workers):
     :type endpoint_url: urllib.parse.ParseResult
     :param registry:
     :type registry: mandelbrot.registry.Registry
-    :param num_workers:
-    :type num_workers: int
+    :param transport_workers:
+    :type transport_workers: int
+    :param retry_policy: If specified, then retryable requests are retried
+      according to the policy
+    :type retry_policy: mandelbrot.transport.retry.RetryPolicy
+    :param positional_metrics: If True, then submit registered metrics as
+      a positional vector
+    :type positional_metrics: bool
+    :param transport_options: Keyword arguments passed to the transport
+    :type transport_options: dict
     :return:
     """
     transport_factory = registry.lookup_factory(mandelbrot.transport.entry_point_type,
         endpoint_url.scheme, mandelbrot.transport.Transport)
     transport_executor = concurrent.futures.ThreadPoolExecutor(transport_workers)
-    transport = transport_factory(endpoint_url, event_loop, transport_executor)
+    if transport_options is None:
+        transport_options = {}
+    transport = transport_factory(endpoint_url, event_loop, transport_executor,
+        workers=transport_workers, **transport_options)
     log.debug("instantiating %s transport for %s", endpoint_url.scheme, endpoint_url)
-    yield Endpoint(transport)
+    if retry_policy is not None:
+        transport = RetryingTransport(transport, retry_policy)
+    yield Endpoint(transport, positional_metrics)
     transport.close()
     transport_executor.shutdown()
@@ -23,10 +23,17 @@ import logging
 
 log = logging.getLogger("mandelbrot.agent.evaluator")
 
-from mandelbrot.model.evaluation import Evaluation
-from mandelbrot.model.timestamp import now
+from mandelbrot.model.evaluation import Evaluation, UNKNOWN
+from mandelbrot.model import construct
+from mandelbrot.model.timestamp import Timestamp, now
 from mandelbrot.agent.scheduled_check import ScheduledCheck, make_scheduled_check
 from mandelbrot.agent.scheduler import Scheduler
+from mandelbrot.agent.worker import WorkerPool
+from mandelbrot.agent.threads import ThreadPool
+from mandelbrot.agent.pools import size_check_pools
+from mandelbrot.agent.coalescer import CoalescingQueue
+from mandelbrot.stats import get_stats
+from mandelbrot.check import EXECUTION_INLINE, EXECUTION_THREAD, EXECUTION_PROCESS
 
 class CheckEvaluation(object):
     """
@@ -39,22 +46,60 @@ class CheckEvaluation(object):
 class Evaluator(object):
     """
     The Evaluator takes a list of checks and invokes them according to
-    the given schedule.  The checks are executed asynchronously on the
-    specified executor.
+    the given schedule.  Each check is routed by its execution class: inline
+    checks are executed directly on the event loop, and the others are
+    executed asynchronously on the executor for their class.
+
+    A check which runs longer than its timeout is abandoned and evaluated
+    as UNKNOWN.  If the check is running in a worker process, then the
+    worker is killed and replaced.  A thread cannot be killed, so the check
+    is not run again until the abandoned thread returns, and if the thread
+    belongs to a ThreadPool then a new thread takes its place in the pool.
+
+    Checks may be added and removed while the evaluator is running, without
+    disturbing the other checks.  A check which is removed while it is
+    running is retired when the invocation completes.
     """
-    def __init__(self, event_loop, scheduled_checks, executor):
+    def __init__(self, event_loop, scheduled_checks, executor, pool_sizes=None):
         """
         :param event_loop: The event loop to use for scheduling and executing checks
         :type event_loop: asyncio.AbstractEventLoop
         :param scheduled_checks: The list of checks to evaluate
         :type scheduled_checks: list[ScheduledCheck]
-        :param executor: The executor which asynchronously executes checks
-        :type executor: concurrent.futures.Executor
+        :param executor: The executor which asynchronously executes checks, or
+          a dict mapping execution class to executor
+        :type executor: concurrent.futures.Executor | dict[str,concurrent.futures.Executor]
+        :param pool_sizes: The number of workers for each execution class,
+          used to report pool saturation
+        :type pool_sizes: dict[str,int]
         """
         self.event_loop = event_loop
         self.scheduled_checks = scheduled_checks
-        self.executor = executor
-        self.queue = asyncio.Queue(loop=event_loop)
+        # the scheduled check with each check id
+        self.checks_by_id = {check.check_id: check for check in scheduled_checks}
+        if isinstance(executor, dict):
+            self.executors = dict(executor)
+        else:
+            self.executors = {EXECUTION_THREAD: executor, EXECUTION_PROCESS: executor}
+        self.pool_sizes = pool_sizes if pool_sizes is not None else {}
+        self.num_running = {}
+        self.stats = get_stats('mandelbrot.agent.evaluator')
+        for execution,pool_size in self.pool_sizes.items():
+            self.stats.set_gauge(execution + ' workers', pool_size)
+        self.queue = CoalescingQueue(event_loop)
+        self.stretch = 1.0
+        self.scheduler = None
+        self.abandoned = {}
+        # holds the context between invocations for each check
+        self.check_contexts = {}
+        # scheduled checks that are currently running on an executor
+        self.checks_running = set()
+        # the execution class of each check
+        self.check_executions = {}
+        # removed checks which are still running
+        self.retiring = {}
+        # checks which replace a retiring check once it is retired
+        self.deferred = {}
 
     @asyncio.coroutine
     def run_until_signaled(self, signal):
@@ -71,18 +116,13 @@ class Evaluator(object):
         shutdown_signal = self.event_loop.create_task(signal.wait())
         pending.add(shutdown_signal)
 
-        # holds the context between invocations for each check
-        check_contexts = {}
-        # scheduled checks that are currently running on an executor
-        checks_running = set()
-
         # schedule each check and run its init method
         scheduler = Scheduler(self.event_loop)
+        scheduler.set_stretch(self.stretch)
+        self.scheduler = scheduler
         for check in self.scheduled_checks:
-            context = check.check.init()
-            scheduler.schedule_task(check, check.delay, check.offset, check.jitter)
-            check_contexts[check.check_id] = context
-        pending.add(scheduler.next_task())
+            yield from self.start_check(check)
+        pending.add(scheduler.next_batch())
 
         # loop executing each check according to its schedule
         while True:
@@ -98,59 +138,373 @@ class Evaluator(object):
             # otherwise process the result of all completed futures
             done = [r.result() for r in done]
             for result in done:
-                # scheduled check is blocked
-                if isinstance(result, ScheduledCheck) and result.check_id in checks_running:
-                    log.warning("skipping check %s: previous invocation is still running",
-                        result.check_id)
-                    pending.add(scheduler.next_task())
-                # scheduled check is ready to be run
-                elif isinstance(result, ScheduledCheck):
-                    check_id = result.check_id
-                    check = result.check
-                    context = check_contexts[check_id]
-                    check_eval_ctx = EvaluationContext(check_id, check, context)
-                    log.debug("submitting check %s to executor with context %s", check_id, context)
-                    execute_check = self.event_loop.run_in_executor(self.executor, check_eval_ctx.execute)
-                    checks_running.add(check_id)
-                    pending.add(execute_check)
-                    pending.add(scheduler.next_task())
+                # a batch of scheduled checks is ready to be run
+                if isinstance(result, list):
+                    for scheduled_check in result:
+                        check_id = scheduled_check.check_id
+                        # scheduled check was abandoned, but it has not returned yet
+                        if check_id in self.abandoned:
+                            log.debug("skipping check %s: abandoned invocation is still running",
+                                check_id)
+                            self.stats.increment('skipped checks')
+                            scheduler.task_done(scheduled_check, completed=False)
+                            continue
+                        # scheduled check is blocked
+                        if check_id in self.checks_running:
+                            log.warning("skipping check %s: previous invocation is still running",
+                                check_id)
+                            self.stats.increment('skipped checks')
+                            scheduler.task_done(scheduled_check, completed=False)
+                            continue
+                        check = scheduled_check.check
+                        context = self.check_contexts[check_id]
+                        check_eval_ctx = EvaluationContext(check_id, check, context)
+                        # a run which catches up a missed interval is stamped with its interval
+                        if scheduled_check.catch_up:
+                            check_eval_ctx.timestamp = construct(Timestamp,
+                                int(scheduler.get_scheduled_time(scheduled_check) * 1000.0))
+                        execute_check = self.execute_check(scheduled_check, check_eval_ctx)
+                        self.checks_running.add(check_id)
+                        self.update_running(scheduled_check.execution, 1)
+                        pending.add(execute_check)
+                    pending.add(scheduler.next_batch())
                 # scheduled check has completed, queue it for processing
                 elif isinstance(result, EvaluationContext):
-                    try:
-                        check_id = result.check_id
-                        evaluation = result.evaluation
-                        context = result.context
-                        checks_running.remove(check_id)
+                    check_id = result.check_id
+                    evaluation = result.evaluation
+                    context = result.context
+                    self.checks_running.remove(check_id)
+                    self.update_running(self.check_executions[check_id], -1)
+                    self.check_contexts[check_id] = context
+                    self.task_done(check_id)
+                    # the evaluation of a removed check is dropped, unless the check was replaced
+                    if check_id not in self.retiring or check_id in self.deferred:
                         self.queue.put_nowait(CheckEvaluation(check_id, evaluation))
-                        check_contexts[check_id] = context
                         log.debug("enqueuing evaluation for check %s", result.check_id)
-                    except asyncio.QueueFull:
-                        log.error("dropped evaluation for check %s, queue is full", result.check_id)
+                    if check_id in self.retiring:
+                        yield from self.retire_check(check_id)
                 # a scheduled check returns an error
                 elif isinstance(result, EvaluationException):
                     log.error("check %s failed: %s", result.check_id, str(result.cause))
-                    checks_running.remove(result.check_id)
+                    self.checks_running.remove(result.check_id)
+                    self.update_running(self.check_executions[result.check_id], -1)
+                    self.task_done(result.check_id)
+                    if result.check_id in self.retiring:
+                        yield from self.retire_check(result.check_id)
                 # any exception not wrapped in EvaluationException stops the evaluator
                 elif isinstance(result, Exception):
                     raise result
 
         # unscheduled all scheduled checks
         scheduler.unschedule_all()
+        self.scheduler = None
 
         # cancel all pending futures
         for f in pending:
             log.debug("cancelling pending future %s", f)
             f.cancel()
 
-        # run each check cleanup method
-        for check in self.scheduled_checks:
-            context = check_contexts[check.check_id]
-            del check_contexts[check.check_id]
+        # run each check cleanup method, except for checks which never started
+        for check in self.scheduled_checks + list(self.retiring.values()):
+            if self.deferred.get(check.check_id) is not check:
+                yield from self.stop_check(check)
+        self.checks_running.clear()
+        self.retiring.clear()
+        self.deferred.clear()
+
+    @asyncio.coroutine
+    def start_check(self, scheduled_check):
+        """
+        Run the init method of the check and schedule it.
+        """
+        check = scheduled_check
+        context = check.check.init()
+        executor = self.get_executor(check.execution)
+        if isinstance(executor, WorkerPool):
+            yield from executor.assign(check.check_id, check.check, context)
+        self.scheduler.schedule_task(check, check.delay, check.offset, check.jitter,
+            check.aligned, check.catch_up)
+        self.check_contexts[check.check_id] = context
+        self.check_executions[check.check_id] = check.execution
+
+    @asyncio.coroutine
+    def stop_check(self, scheduled_check):
+        """
+        Run the cleanup method of the check, which must not be scheduled.
+        If the check is still running in a worker process, then the worker
+        is replaced, so a hung check cannot hold up shutdown.  If the check
+        was abandoned on a thread, then the cleanup method is run once the
+        thread returns.
+        """
+        check = scheduled_check
+        context = self.check_contexts.pop(check.check_id)
+        del self.check_executions[check.check_id]
+        executor = self.get_executor(check.execution)
+        abandoned = self.abandoned.get(check.check_id)
+        if isinstance(executor, WorkerPool):
+            try:
+                yield from executor.release(check.check_id, check.timeout)
+            except Exception as e:
+                log.error("check %s cleanup failed: %s", check.check_id, str(e))
+        elif abandoned is not None:
+            log.debug("check %s is abandoned, deferring cleanup until the thread returns",
+                check.check_id)
+            abandoned.add_done_callback(lambda _: check.check.fini(context))
+        else:
             check.check.fini(context)
 
+    @asyncio.coroutine
+    def retire_check(self, check_id):
+        """
+        Clean up a removed check once its invocation has completed, and
+        start the check which replaces it, if any.
+        """
+        yield from self.stop_check(self.retiring.pop(check_id))
+        log.debug("retired check %s", check_id)
+        if check_id in self.deferred:
+            yield from self.start_check(self.deferred.pop(check_id))
+            log.debug("started check %s", check_id)
+
+    @asyncio.coroutine
+    def add_check(self, scheduled_check):
+        """
+        Add the check to the evaluator.  If the evaluator is running, then
+        the check is initialized and scheduled immediately, unless a removed
+        check with the same id is still running, in which case the check is
+        started once the removed check is retired.
+
+        :param scheduled_check:
+        :type scheduled_check: ScheduledCheck
+        :raises KeyError: A check with the same id was already added.
+        """
+        check_id = scheduled_check.check_id
+        if check_id in self.checks_by_id:
+            raise KeyError("{} is already added".format(check_id))
+        self.scheduled_checks.append(scheduled_check)
+        self.checks_by_id[check_id] = scheduled_check
+        self.stats.increment('added checks')
+        if self.scheduler is None:
+            return
+        if check_id in self.retiring:
+            self.deferred[check_id] = scheduled_check
+            log.debug("deferring check %s until the removed check is retired", check_id)
+        else:
+            yield from self.start_check(scheduled_check)
+            log.debug("started check %s", check_id)
+
+    @asyncio.coroutine
+    def remove_check(self, check_id):
+        """
+        Remove the check from the evaluator.  If the evaluator is running,
+        then the check is unscheduled immediately, and its cleanup method is
+        run once any running invocation completes.
+
+        :param check_id:
+        :type check_id: cifparser.Path
+        :raises KeyError: There is no check with the specified id.
+        """
+        if check_id not in self.checks_by_id:
+            raise KeyError("{} is not added".format(check_id))
+        scheduled_check = self.checks_by_id.pop(check_id)
+        self.scheduled_checks.remove(scheduled_check)
+        self.stats.increment('removed checks')
+        if self.scheduler is None:
+            return
+        if self.deferred.pop(check_id, None) is not None:
+            return
+        self.scheduler.unschedule_task(scheduled_check)
+        if check_id in self.checks_running:
+            self.retiring[check_id] = scheduled_check
+            log.debug("retiring check %s once its invocation completes", check_id)
+        else:
+            yield from self.stop_check(scheduled_check)
+            log.debug("stopped check %s", check_id)
+
+    def task_done(self, check_id):
+        """
+        Report to the scheduler that the invocation of the check is done,
+        so a check which is catching up can run its next missed interval.
+        """
+        scheduled_check = self.checks_by_id.get(check_id)
+        if scheduled_check is not None:
+            self.scheduler.task_done(scheduled_check)
+
+    def can_execute(self, execution):
+        """
+        :param execution:
+        :type execution: str
+        :returns: True if the evaluator has an executor for the execution
+          class.  Executors are created when the evaluator is made, so a
+          check added later may need an executor which does not exist.
+        :rtype: bool
+        """
+        return execution == EXECUTION_INLINE or self.get_executor(execution) is not None
+
+    def set_stretch(self, stretch):
+        """
+        Stretch the interval of every check by the specified factor, which
+        is used to shed load when evaluations cannot be submitted as fast
+        as they are produced.
+
+        :param stretch: The interval multiplier, at least 1.0
+        :type stretch: float
+        """
+        self.stretch = stretch
+        if self.scheduler is not None:
+            self.scheduler.set_stretch(stretch)
+
+    def update_running(self, execution, delta):
+        """
+        Update the number of running checks in the execution class, and
+        report the saturation of its pool, which is the fraction of the
+        pool workers which are busy.
+
+        :param execution:
+        :type execution: str
+        :param delta:
+        :type delta: int
+        """
+        if execution is None:
+            execution = EXECUTION_PROCESS
+        if execution == EXECUTION_INLINE:
+            return
+        num_running = self.num_running.get(execution, 0) + delta
+        self.num_running[execution] = num_running
+        self.stats.set_gauge(execution + ' running', num_running)
+        pool_size = self.pool_sizes.get(execution)
+        if pool_size:
+            saturation = min(num_running, pool_size) / pool_size
+            self.stats.set_gauge(execution + ' saturation', saturation)
+            if num_running >= pool_size:
+                self.stats.increment(execution + ' saturated')
+
+    def get_executor(self, execution):
+        """
+        Return the executor for the execution class, or None if the check
+        should be executed inline.  If there is no executor for the class,
+        then the most isolated available executor is used instead.
+
+        :param execution:
+        :type execution: str
+        :rtype: concurrent.futures.Executor
+        """
+        if execution == EXECUTION_INLINE:
+            return None
+        if execution in self.executors:
+            return self.executors[execution]
+        for execution in (EXECUTION_PROCESS, EXECUTION_THREAD):
+            if execution in self.executors:
+                return self.executors[execution]
+        return None
+
+    def execute_check(self, scheduled_check, check_eval_ctx):
+        """
+        Execute the check using the executor for its execution class.
+
+        :param scheduled_check:
+        :type scheduled_check: ScheduledCheck
+        :param check_eval_ctx:
+        :type check_eval_ctx: EvaluationContext
+        :returns: A future which completes with the result of the execution.
+        :rtype: asyncio.Future
+        """
+        executor = self.get_executor(scheduled_check.execution)
+        if isinstance(executor, WorkerPool):
+            log.debug("submitting check %s to worker", check_eval_ctx.check_id)
+            return self.event_loop.create_task(self.execute_on_worker(executor,
+                check_eval_ctx, scheduled_check.timeout))
+        if executor is None:
+            log.debug("executing check %s inline with context %s",
+                check_eval_ctx.check_id, check_eval_ctx.context)
+            f = asyncio.Future(loop=self.event_loop)
+            f.set_result(check_eval_ctx.execute())
+            return f
+        log.debug("submitting check %s to executor with context %s",
+            check_eval_ctx.check_id, check_eval_ctx.context)
+        f = executor.submit(check_eval_ctx.execute)
+        if scheduled_check.timeout is None:
+            return asyncio.wrap_future(f, loop=self.event_loop)
+        return self.event_loop.create_task(self.execute_with_timeout(f,
+            check_eval_ctx, scheduled_check.timeout, executor))
+
+    @asyncio.coroutine
+    def execute_with_timeout(self, f, check_eval_ctx, timeout, executor=None):
+        """
+        Wait for the check executing on a thread to complete.  If it does
+        not complete within timeout seconds, then the check is abandoned
+        until the thread returns, and if the executor is a ThreadPool then
+        the abandoned thread is replaced.
+
+        :param f: The future for the check execution
+        :type f: concurrent.futures.Future
+        :param check_eval_ctx:
+        :type check_eval_ctx: EvaluationContext
+        :param timeout:
+        :type timeout: float
+        :param executor: The executor which is running the check
+        :type executor: concurrent.futures.Executor
+        :returns: The EvaluationContext or an EvaluationException
+        """
+        try:
+            return (yield from asyncio.wait_for(asyncio.shield(
+                asyncio.wrap_future(f, loop=self.event_loop), loop=self.event_loop),
+                timeout, loop=self.event_loop))
+        except asyncio.TimeoutError:
+            check_id = check_eval_ctx.check_id
+            log.error("check %s timed out after %.1f seconds, abandoning thread",
+                check_id, timeout)
+            self.stats.increment('timed out checks')
+            # the callbacks run on the abandoned thread when it returns, which
+            # may be after the event loop is closed
+            self.abandoned[check_id] = f
+            f.add_done_callback(lambda _: self.abandoned.pop(check_id, None))
+            if isinstance(executor, ThreadPool):
+                executor.replace_thread()
+                self.stats.increment('replaced threads')
+            # the thread still holds check_eval_ctx, so return a new context
+            return make_timeout_context(check_eval_ctx, timeout)
+
+    @asyncio.coroutine
+    def execute_on_worker(self, worker_pool, check_eval_ctx, timeout=None):
+        """
+        Execute the check on the worker which holds it.  The check context
+        stays in the worker, so only the evaluation is returned.  If the
+        check does not complete within timeout seconds, then the worker is
+        replaced.
+
+        :param worker_pool:
+        :type worker_pool: mandelbrot.agent.worker.WorkerPool
+        :param check_eval_ctx:
+        :type check_eval_ctx: EvaluationContext
+        :param timeout:
+        :type timeout: float
+        :returns: The EvaluationContext or an EvaluationException
+        """
+        check_id = check_eval_ctx.check_id
+        try:
+            check_eval_ctx.evaluation = yield from asyncio.wait_for(
+                worker_pool.execute(check_id), timeout, loop=self.event_loop)
+            if check_eval_ctx.timestamp is not None:
+                check_eval_ctx.evaluation.set_timestamp(check_eval_ctx.timestamp)
+            return check_eval_ctx
+        except asyncio.TimeoutError:
+            log.error("check %s timed out after %.1f seconds, replacing worker",
+                check_id, timeout)
+            self.stats.increment('timed out checks')
+            try:
+                yield from worker_pool.replace(check_id)
+                self.stats.increment('replaced workers')
+            except Exception as e:
+                return EvaluationException(check_id, e)
+            return make_timeout_context(check_eval_ctx, timeout)
+        except Exception as e:
+            return EvaluationException(check_id, e)
+
     def next_evaluation(self):
         """
-        Yields until the next check evaluation is available.
+        Yields until the next check evaluation is available.  If the
+        consumer lags, then only the freshest evaluation and any health
+        transitions are kept for each check.
 
         :returns: A coroutine which yields the next check evaluation.
         :rtype: asyncio.coroutine
@@ -158,22 +512,38 @@ class Evaluator(object):
         return self.queue.get()
 
 @contextlib.contextmanager
-def make_evaluator(event_loop, scheduled_checks, check_workers):
+def make_evaluator(event_loop, scheduled_checks, check_workers=None):
     """
     Create the evaluator within a context, and clean up associated
-    resources when finished.
+    resources when finished.  Only the executors needed by the execution
+    classes of the scheduled checks are created.  Checks in the process
+    execution class are assigned to a WorkerPool of long-lived processes,
+    and checks in the thread execution class run on a ThreadPool, which
+    is shut down without waiting for threads stuck in abandoned checks.
 
     :param event_loop: The event loop to use for scheduling and executing checks
     :type event_loop: asyncio.AbstractEventLoop
     :param scheduled_checks: The list of checks to evaluate
     :type scheduled_checks: list[ScheduledCheck]
-    :param num_workers: The number of worker processes to create
-    :type num_workers: int
+    :param check_workers: The number of workers to create for each executor,
+      or None to size each executor automatically
+    :type check_workers: int
     :returns: The Evaluator constructed from the specified scheduled checks
     """
-    check_executor = concurrent.futures.ProcessPoolExecutor(check_workers)
-    yield Evaluator(event_loop, scheduled_checks, check_executor)
-    check_executor.shutdown()
+    pool_sizes = size_check_pools(scheduled_checks, check_workers)
+    check_executors = {}
+    if EXECUTION_THREAD in pool_sizes:
+        check_executors[EXECUTION_THREAD] = ThreadPool(pool_sizes[EXECUTION_THREAD])
+    if EXECUTION_PROCESS in pool_sizes:
+        check_executors[EXECUTION_PROCESS] = WorkerPool(event_loop, pool_sizes[EXECUTION_PROCESS])
+    log.debug("created executors %s", ", ".join(["{} ({} workers)".format(execution, pool_sizes[execution])
+        for execution in sorted(check_executors)]))
+    yield Evaluator(event_loop, scheduled_checks, check_executors, pool_sizes)
+    for check_executor in check_executors.values():
+        if isinstance(check_executor, ThreadPool):
+            check_executor.shutdown(wait=False)
+        else:
+            check_executor.shutdown()
 
 class EvaluationContext(object):
     """
@@ -194,6 +564,8 @@ class EvaluationContext(object):
         self.check_id = check_id
         self.context = context
         self.evaluation = None
+        # the timestamp of the evaluation, or None to use the current time
+        self.timestamp = None
 
     def execute(self):
         """
@@ -205,12 +577,31 @@ class EvaluationContext(object):
         """
         try:
             self.evaluation = Evaluation()
-            self.evaluation.set_timestamp(now())
+            self.evaluation.set_timestamp(self.timestamp if self.timestamp is not None else now())
             self._check.execute(self.evaluation, self.context)
             return self
         except Exception as e:
             return EvaluationException(self.check_id, e)
 
+def make_timeout_context(check_eval_ctx, timeout):
+    """
+    Return a new EvaluationContext for a check which timed out, containing
+    an UNKNOWN evaluation and the context the check was executed with.
+
+    :param check_eval_ctx:
+    :type check_eval_ctx: EvaluationContext
+    :param timeout:
+    :type timeout: float
+    :rtype: EvaluationContext
+    """
+    timeout_ctx = EvaluationContext(check_eval_ctx.check_id, None, check_eval_ctx.context)
+    timeout_ctx.evaluation = Evaluation()
+    timeout_ctx.evaluation.set_timestamp(check_eval_ctx.timestamp
+        if check_eval_ctx.timestamp is not None else now())
+    timeout_ctx.evaluation.set_health(UNKNOWN)
+    timeout_ctx.evaluation.set_summary("check timed out after {:.1f} seconds".format(timeout))
+    return timeout_ctx
+
 class EvaluationException(Exception):
     """
     Wraps any exception which is raised during check execution.
@@ -0,0 +1,106 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import logging
+
+log = logging.getLogger("mandelbrot.agent.pools")
+
+from mandelbrot.check import EXECUTION_INLINE, EXECUTION_THREAD, EXECUTION_PROCESS
+
+# the maximum number of workers chosen automatically for a pool
+max_auto_workers = 32
+
+def parse_pool_size(value):
+    """
+    Parse a pool size setting, which is either a positive integer or
+    'auto'.
+
+    :param value:
+    :type value: str
+    :returns: The number of workers, or None if the pool should be sized
+      automatically.
+    :rtype: int
+    """
+    value = value.strip().lower()
+    if value == 'auto':
+        return None
+    try:
+        num_workers = int(value)
+    except ValueError:
+        raise ValueError("invalid pool size '{}'".format(value))
+    if num_workers < 1:
+        raise ValueError("pool size must be greater than 0")
+    return num_workers
+
+def get_cpu_count():
+    """
+    :rtype: int
+    """
+    return os.cpu_count() or 1
+
+def size_check_pools(scheduled_checks, check_workers=None, cpu_count=None):
+    """
+    Return the number of workers for each execution class needed by the
+    scheduled checks.  If check_workers is None, then the process pool is
+    sized to the number of CPUs, since process checks are assumed to be
+    CPU bound, and the thread pool is sized to twice the number of CPUs,
+    since thread checks are assumed to block on I/O.  Neither pool is ever
+    larger than the number of checks it executes.
+
+    :param scheduled_checks:
+    :type scheduled_checks: list[mandelbrot.agent.scheduled_check.ScheduledCheck]
+    :param check_workers: The number of workers in each pool, or None to
+      size the pools automatically
+    :type check_workers: int
+    :param cpu_count:
+    :type cpu_count: int
+    :rtype: dict[str,int]
+    """
+    num_checks = {}
+    for check in scheduled_checks:
+        execution = check.execution if check.execution is not None else EXECUTION_PROCESS
+        num_checks[execution] = num_checks.get(execution, 0) + 1
+    num_checks.pop(EXECUTION_INLINE, None)
+    if check_workers is not None:
+        return dict([(execution, check_workers) for execution in num_checks])
+    if cpu_count is None:
+        cpu_count = get_cpu_count()
+    pool_sizes = {}
+    if EXECUTION_PROCESS in num_checks:
+        pool_sizes[EXECUTION_PROCESS] = min(cpu_count, num_checks[EXECUTION_PROCESS], max_auto_workers)
+    if EXECUTION_THREAD in num_checks:
+        pool_sizes[EXECUTION_THREAD] = min(2 * cpu_count, num_checks[EXECUTION_THREAD], max_auto_workers)
+    return pool_sizes
+
+def size_transport_pool(transport_workers=None, cpu_count=None):
+    """
+    Return the number of transport workers.  If transport_workers is None,
+    then the pool is sized to the number of CPUs plus 4, since transport
+    workers spend most of their time waiting on the network.
+
+    :param transport_workers:
+    :type transport_workers: int
+    :param cpu_count:
+    :type cpu_count: int
+    :rtype: int
+    """
+    if transport_workers is not None:
+        return transport_workers
+    if cpu_count is None:
+        cpu_count = get_cpu_count()
+    return min(cpu_count + 4, max_auto_workers)
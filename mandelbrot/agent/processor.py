@@ -22,15 +22,24 @@ import logging
 
 log = logging.getLogger("mandelbrot.agent.processor")
 
+from mandelbrot.instance import diff_instance_checks
 from mandelbrot.agent.endpoint import make_endpoint
 from mandelbrot.agent.registration import make_registration
 from mandelbrot.agent.evaluator import make_scheduled_check, make_evaluator, CheckEvaluation
-from mandelbrot.transport import TransportException, Conflict
+from mandelbrot.agent.batcher import Batcher, EvaluationBatch
+from mandelbrot.agent.spool import Spool, retryable_exceptions
+from mandelbrot.agent.pools import parse_pool_size, size_transport_pool
+from mandelbrot.agent.credits import SubmitCredits, size_submit_credits
+from mandelbrot.transport import TransportException
+from mandelbrot.transport.retry import RetryPolicy
+from mandelbrot.transport.codec import parse_codecs
+from mandelbrot.stats import log_stats
 
 default_join_timeout = datetime.timedelta(minutes=5)
 default_probe_timeout = datetime.timedelta(minutes=1)
 default_alert_timeout = datetime.timedelta(minutes=2)
 default_retirement_age = datetime.timedelta(days=1)
+default_flush_timeout = datetime.timedelta(seconds=10)
 
 class Processor(object):
     """
@@ -50,60 +59,276 @@ class Processor(object):
         self.instance = instance
         self.registry = registry
         self.settings = settings
+        self.agent_id = None
+        self.endpoint_url = None
+        self.instance_checks = {}
+        self.scheduled_checks = {}
+
+    def load_instance(self):
+        """
+        :returns: The agent id, endpoint url, checks ordered by check id,
+          and metadata of the instance.
+        """
+        with self.instance.lock():
+            snapshot = self.instance.load_snapshot()
+        log.debug("loading instance %s generation %d", snapshot.agent_id, snapshot.generation)
+        return snapshot.agent_id, snapshot.endpoint_url, snapshot.checks, snapshot.metadata
+
+    def make_scheduled_checks(self, instance_checks):
+        """
+        :param instance_checks:
+        :type instance_checks: list[mandelbrot.instance.InstanceCheck]
+        :returns: The scheduled checks keyed by check id.  Checks whose type
+          is not registered are left out.
+        :rtype: dict[cifparser.Path,mandelbrot.agent.scheduled_check.ScheduledCheck]
+        """
+        scheduled_checks = {}
+        for instance_check in instance_checks:
+            try:
+                scheduled_check = make_scheduled_check(instance_check, self.registry)
+                scheduled_checks[instance_check.check_id] = scheduled_check
+            except Exception as e:
+                log.warn("no check registered for type %s", instance_check.check_type)
+        return scheduled_checks
 
     @asyncio.coroutine
-    def run_until_signaled(self, signal):
+    def synchronize(self, endpoint, registration, incremental=True):
         """
-        Run the Processor until the specified signal is set.
+        Register the agent with the endpoint.  If incremental is True, then
+        only the changes since the registration the endpoint last accepted
+        are sent.  Otherwise the full registration is sent, which is done
+        when the processor starts, since the endpoint may have lost the
+        agent while it was stopped.
+
+        :param endpoint:
+        :type endpoint: mandelbrot.agent.endpoint.Endpoint
+        :param registration:
+        :type registration: mandelbrot.model.registration.Registration
+        :param incremental:
+        :type incremental: bool
+        """
+        accepted = None
+        if incremental:
+            with self.instance.lock():
+                accepted = self.instance.get_registration_fingerprint(self.endpoint_url)
+        fingerprint = yield from endpoint.synchronize_agent(self.agent_id, registration, accepted)
+        with self.instance.lock():
+            self.instance.set_registration_fingerprint(self.endpoint_url, fingerprint)
+
+    @asyncio.coroutine
+    def run_until_signaled(self, signal, reload_signal=None):
+        """
+        Run the Processor until the specified signal is set.  If reload_signal
+        is specified, then each time it is set the checks are reloaded from
+        the instance while the processor keeps running.
 
         :param signal:
         :type signal: asyncio.Event
+        :param reload_signal:
+        :type reload_signal: asyncio.Event
         """
 
         # load configuration from the instance
-        with self.instance.lock():
-            agent_id = self.instance.get_agent_id()
-            endpoint_url = self.instance.get_endpoint_url()
-            checks = sorted(self.instance.list_checks(), key=lambda check: check.check_id)
-            metadata = list(self.instance.list_metadata())
-        log.debug("loading instance %s", agent_id)
+        agent_id, endpoint_url, checks, metadata = self.load_instance()
+        self.agent_id = agent_id
+        self.endpoint_url = endpoint_url
+        self.instance_checks = {check.check_id: check for check in checks}
 
         # build the list of scheduled checks
-        scheduled_checks = []
-        for instance_check in checks:
-            try:
-                scheduled_check = make_scheduled_check(instance_check, self.registry)
-                scheduled_checks.append(scheduled_check)
-            except Exception as e:
-                log.warn("no check registered for type %s", instance_check.check_type)
+        self.scheduled_checks = self.make_scheduled_checks(checks)
+        scheduled_checks = [self.scheduled_checks[check.check_id] for check in checks
+            if check.check_id in self.scheduled_checks]
 
         # construct the registration
         registration = make_registration(agent_id, metadata, scheduled_checks)
 
+        # size the check and transport pools, automatically unless specified
+        check_workers = parse_pool_size(self.settings.get_str_or_default(
+            'mandelbrot.agent', 'pool workers', 'auto'))
+        transport_workers = size_transport_pool(parse_pool_size(self.settings.get_str_or_default(
+            'mandelbrot.agent', 'transport workers', 'auto')))
+
+        # a batch size of 1 submits each evaluation as soon as it is available
+        batch_size = self.settings.get_int_or_default('mandelbrot.agent', 'batch size', 1)
+        batch_window = self.settings.get_float_or_default('mandelbrot.agent', 'batch window', 1.0)
+
+        # evaluations which fail to submit are written to the spool
+        spool_size = self.settings.get_size_or_default('mandelbrot.agent', 'spool size', 64 * 1024 * 1024)
+        spool = Spool(self.event_loop, self.instance.path / 'spool', spool_size)
+
+        # limit the number of submissions in flight, automatically unless specified
+        max_in_flight = parse_pool_size(self.settings.get_str_or_default(
+            'mandelbrot.agent', 'max in flight', 'auto'))
+
+        # retry failed requests before falling back to the spool
+        retry_attempts = self.settings.get_int_or_default('mandelbrot.agent', 'retry attempts', 3)
+        retry_policy = RetryPolicy(max_attempts=retry_attempts) if retry_attempts > 1 else None
+
+        # submit registered metrics as a positional vector instead of by name
+        positional_metrics = self.settings.get_bool_or_default('mandelbrot.agent',
+            'positional metrics', False)
+
+        # compress request bodies which are at least the threshold size
+        transport_options = {
+            'compression': self.settings.get_str_or_default('mandelbrot.agent',
+                'request compression', 'none'),
+            'compression_threshold': self.settings.get_size_or_default('mandelbrot.agent',
+                'compression threshold', 1024),
+            }
+
+        # offer only the named codecs, or every available codec if 'auto'
+        codecs = parse_codecs(self.settings.get_str_or_default('mandelbrot.agent',
+            'request codecs', 'auto'))
+        if codecs is not None:
+            transport_options['codecs'] = codecs
+
+        # periodically log agent stats
+        stats_interval = self.settings.get_float_or_default('mandelbrot.agent', 'stats interval', 300.0)
+        stats_task = self.event_loop.create_task(report_stats_until_signaled(
+            self.event_loop, signal, stats_interval))
+
         # construct the endpoint
         log.debug("constructing endpoint %s", endpoint_url)
-        with make_endpoint(self.event_loop, endpoint_url, self.registry, 10) as endpoint:
+        with make_endpoint(self.event_loop, endpoint_url, self.registry,
+                transport_workers, retry_policy, positional_metrics, transport_options) as endpoint:
 
             # register agent with the endpoint
-            try:
-                log.debug("registering %s with endpoint", agent_id)
-                yield from endpoint.register_agent(registration)
-            except Conflict:
-                log.debug("agent %s exists, updating endpoint", agent_id)
-                yield from endpoint.update_agent(agent_id, registration)
+            yield from self.synchronize(endpoint, registration, incremental=False)
+
+            # the transport advertises how many requests it can carry at once
+            credits = SubmitCredits(size_submit_credits(endpoint.get_capacity(), max_in_flight))
+            log.debug("limiting submissions to %d in flight", credits.capacity)
 
             # construct the evaluator
-            with make_evaluator(self.event_loop, scheduled_checks, 10) as evaluator:
+            with make_evaluator(self.event_loop, scheduled_checks, check_workers) as evaluator:
 
                 # run until processor_task completes
                 processor_task = process_evaluations(self.event_loop,
-                    evaluator, agent_id, endpoint, signal)
+                    evaluator, agent_id, endpoint, signal, batch_size, batch_window, spool, credits)
+                if reload_signal is not None:
+                    reload_task = self.event_loop.create_task(self.reload_until_signaled(
+                        evaluator, endpoint, signal, reload_signal))
                 yield from asyncio.wait_for(processor_task, None, loop=self.event_loop)
+                if reload_signal is not None:
+                    yield from asyncio.wait_for(reload_task, None, loop=self.event_loop)
+
+        yield from asyncio.wait_for(stats_task, None, loop=self.event_loop)
+
+    @asyncio.coroutine
+    def reload_until_signaled(self, evaluator, endpoint, signal, reload_signal):
+        """
+        Reload the checks each time reload_signal is set, until signal is set.
+
+        :param evaluator:
+        :type evaluator: mandelbrot.agent.evaluator.Evaluator
+        :param endpoint:
+        :type endpoint: mandelbrot.agent.endpoint.Endpoint
+        :param signal:
+        :type signal: asyncio.Event
+        :param reload_signal:
+        :type reload_signal: asyncio.Event
+        """
+        while True:
+            signaled = [self.event_loop.create_task(signal.wait()),
+                self.event_loop.create_task(reload_signal.wait())]
+            yield from asyncio.wait(signaled, loop=self.event_loop,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in signaled:
+                f.cancel()
+            if signal.is_set():
+                return
+            reload_signal.clear()
+            try:
+                yield from self.reload_checks(evaluator, endpoint, signal)
+            except Exception as e:
+                log.exception("failed to reload checks: %s", e)
+
+    @asyncio.coroutine
+    def reload_checks(self, evaluator, endpoint, signal):
+        """
+        Reload the checks from the instance, and start or stop only the
+        checks which were added, removed or changed; the other checks keep
+        running with their contexts intact.  If the agent id or the endpoint
+        changed, or an added check needs an executor which the evaluator
+        lacks, then signal is set so the processor is restarted instead.
+
+        :param evaluator:
+        :type evaluator: mandelbrot.agent.evaluator.Evaluator
+        :param endpoint:
+        :type endpoint: mandelbrot.agent.endpoint.Endpoint
+        :param signal:
+        :type signal: asyncio.Event
+        """
+        agent_id, endpoint_url, checks, metadata = self.load_instance()
+        if agent_id != self.agent_id or endpoint_url != self.endpoint_url:
+            log.info("agent id or endpoint changed, restarting processor")
+            signal.set()
+            return
+        loaded = {check.check_id: check for check in checks}
+        added,removed,changed = diff_instance_checks(self.instance_checks, loaded)
+
+        # instantiate the checks which were added or changed
+        started = self.make_scheduled_checks([loaded[check_id] for check_id in added + changed])
+        for scheduled_check in started.values():
+            if not evaluator.can_execute(scheduled_check.execution):
+                log.info("check %s needs a new executor, restarting processor",
+                    scheduled_check.check_id)
+                signal.set()
+                return
+        scheduled_checks = dict(self.scheduled_checks)
+        for check_id in removed + changed:
+            scheduled_checks.pop(check_id, None)
+        scheduled_checks.update(started)
+
+        # update the registration first, so evaluations of added checks are accepted
+        registration = make_registration(agent_id, metadata,
+            [scheduled_checks[check_id] for check_id in sorted(scheduled_checks)])
+        yield from self.synchronize(endpoint, registration)
+
+        for check_id in removed + changed:
+            if check_id in self.scheduled_checks:
+                yield from evaluator.remove_check(check_id)
+        for check_id in sorted(started):
+            yield from evaluator.add_check(started[check_id])
+        self.instance_checks = loaded
+        self.scheduled_checks = scheduled_checks
+        log.info("reloaded checks: %d added, %d removed, %d changed",
+            len(added), len(removed), len(changed))
 
 @asyncio.coroutine
-def process_evaluations(event_loop, evaluator, agent_id, endpoint, signal):
+def report_stats_until_signaled(event_loop, signal, interval):
     """
-    Process evaluations until the specified signal is set.
+    Log agent stats every interval seconds until the specified signal is
+    set, then log them one final time.
+
+    :param event_loop:
+    :type event_loop: asyncio.AbstractEventLoop
+    :param signal:
+    :type signal: asyncio.Event
+    :param interval:
+    :type interval: float
+    """
+    while not signal.is_set():
+        try:
+            yield from asyncio.wait_for(signal.wait(), interval, loop=event_loop)
+        except asyncio.TimeoutError:
+            log_stats()
+    log_stats()
+
+@asyncio.coroutine
+def process_evaluations(event_loop, evaluator, agent_id, endpoint, signal,
+                        batch_size=1, batch_window=1.0, spool=None, credits=None):
+    """
+    Process evaluations until the specified signal is set.  If batch_size
+    is greater than 1, then evaluations are gathered into batches and each
+    batch is submitted to the endpoint in a single request.  If a spool is
+    specified, then evaluations which fail with a retryable error are
+    appended to the spool and replayed in order when the endpoint recovers.
+
+    Each submission in flight holds a credit.  While no credits are
+    available, no more evaluations are taken from the evaluator, so they
+    are coalesced in its queue, and the check intervals are stretched
+    until the endpoint catches up.
 
     :param event_loop:
     :type event_loop: asyncio.AbstractEventLoop
@@ -115,20 +340,67 @@ def process_evaluations(event_loop, evaluator, agent_id, endpoint, signal):
     :type endpoint: mandelbrot.agent.endpoint.Endpoint
     :param signal:
     :type signal: asyncio.Event
+    :param batch_size: The maximum number of evaluations in a batch
+    :type batch_size: int
+    :param batch_window: The maximum number of seconds to wait before
+      submitting an incomplete batch
+    :type batch_window: float
+    :param spool:
+    :type spool: mandelbrot.agent.spool.Spool
+    :param credits: Limits the submissions in flight, if not specified then
+      the limit is derived from the endpoint capacity
+    :type credits: mandelbrot.agent.credits.SubmitCredits
     """
+    if credits is None:
+        credits = SubmitCredits(size_submit_credits(endpoint.get_capacity()))
+
     # pending contains all the futures we are waiting for
     pending = set()
+    # submissions contains the pending futures which hold a credit
+    submissions = set()
 
     # create a future to wait for the shutdown signal
     shutdown_signal = event_loop.create_task(signal.wait())
     pending.add(shutdown_signal)
 
-    # start the evaluator and wait for the first evaluation
+    # start the evaluator
     evaluator_task = event_loop.create_task(evaluator.run_until_signaled(signal))
-    pending.add(evaluator.next_evaluation())
+    next_evaluation = None
+
+    # if batching is enabled, then batches are taken from the batcher
+    batcher = None
+    next_batch = None
+    if batch_size > 1:
+        batcher = Batcher(event_loop, batch_size, batch_window)
+
+    # start replaying any evaluations left in the spool
+    replay_task = None
+    if spool is not None:
+        @asyncio.coroutine
+        def replay(evaluations):
+            if batch_size > 1:
+                results = yield from endpoint.submit_evaluations(agent_id, evaluations)
+                return [result for _,result in results]
+            check_id, evaluation = evaluations[0]
+            try:
+                yield from endpoint.submit_evaluation(agent_id, check_id, evaluation)
+                return [None]
+            except TransportException as e:
+                return [e]
+        replay_task = event_loop.create_task(spool.replay_until_signaled(replay,
+            signal, batch_size=batch_size))
 
     # loop until we receive the shutdown signal
     while True:
+        # only take more work while there are credits to submit it
+        if credits.available() > 0:
+            if next_evaluation is None:
+                next_evaluation = event_loop.create_task(evaluator.next_evaluation())
+                pending.add(next_evaluation)
+            if batcher is not None and next_batch is None:
+                next_batch = event_loop.create_task(batcher.next_batch())
+                pending.add(next_batch)
+
         done,pending = yield from asyncio.wait(pending, loop=event_loop,
             return_when=concurrent.futures.FIRST_COMPLETED)
         log.debug("done=%s, pending=%s", done, pending)
@@ -140,6 +412,14 @@ def process_evaluations(event_loop, evaluator, agent_id, endpoint, signal):
         # otherwise process the result of all completed futures
         results = []
         for f in done:
+            if f is next_evaluation:
+                next_evaluation = None
+            elif f is next_batch:
+                next_batch = None
+            elif f in submissions:
+                submissions.remove(f)
+                credits.release(evaluator.queue.qsize())
+                evaluator.set_stretch(credits.stretch)
             try:
                 results.append(f.result())
             except Exception as e:
@@ -148,9 +428,27 @@ def process_evaluations(event_loop, evaluator, agent_id, endpoint, signal):
             if isinstance(result, CheckEvaluation):
                 check_id = result.check_id
                 evaluation = result.evaluation
-                log.debug("check %s submits evaluation %s", check_id, evaluation)
-                pending.add(endpoint.submit_evaluation(agent_id, check_id, evaluation))
-                pending.add(evaluator.next_evaluation())
+                # preserve ordering by spooling while older evaluations remain
+                if spool is not None and not spool.is_empty():
+                    log.debug("check %s spools evaluation %s", check_id, evaluation)
+                    spool.append(check_id, evaluation)
+                elif batcher is not None:
+                    log.debug("check %s adds evaluation %s to batch", check_id, evaluation)
+                    batcher.append(result)
+                else:
+                    log.debug("check %s submits evaluation %s", check_id, evaluation)
+                    credits.acquire()
+                    submission = event_loop.create_task(
+                        submit_evaluation(endpoint, agent_id, result, spool))
+                    submissions.add(submission)
+                    pending.add(submission)
+            elif isinstance(result, EvaluationBatch):
+                log.debug("submitting batch of %d evaluations", len(result))
+                credits.acquire()
+                submission = event_loop.create_task(
+                    submit_batch(endpoint, agent_id, result, spool))
+                submissions.add(submission)
+                pending.add(submission)
             elif isinstance(result, TransportException):
                 log.error("endpoint responds %s", result)
             elif isinstance(result, Exception):
@@ -158,10 +456,142 @@ def process_evaluations(event_loop, evaluator, agent_id, endpoint, signal):
             elif result is None:
                 log.debug("endpoint accepted evaluation")
 
-    # cancel all pending futures
+    # gather the evaluations which were taken when the signal arrived, and
+    # the partial batch, so they are not lost
+    check_evaluations = []
+    for f in done:
+        if f is shutdown_signal or f in submissions or f.cancelled() or f.exception() is not None:
+            continue
+        result = f.result()
+        if isinstance(result, CheckEvaluation):
+            check_evaluations.append(result)
+        elif isinstance(result, EvaluationBatch):
+            check_evaluations.extend(result.check_evaluations)
+    if batcher is not None:
+        batcher.flush()
+        while not batcher.queue.empty():
+            check_evaluations.extend(batcher.queue.get_nowait().check_evaluations)
+
+    # cancel all pending futures, except for submissions in flight
     for f in pending:
-        log.debug("cancelling pending future %s", f)
-        f.cancel()
+        if f not in submissions:
+            log.debug("cancelling pending future %s", f)
+            f.cancel()
+
+    # submit the remaining evaluations, or spool them if they cannot be submitted in time
+    flush_task = None
+    if len(check_evaluations) > 0:
+        log.debug("flushing %d evaluations", len(check_evaluations))
+        flush_task = event_loop.create_task(flush_evaluations(endpoint, agent_id,
+            check_evaluations, spool, batch_size > 1))
+        submissions.add(flush_task)
+    if len(submissions) > 0:
+        done,pending = yield from asyncio.wait(submissions, loop=event_loop,
+            timeout=default_flush_timeout.total_seconds())
+        for f in done:
+            if f.exception() is not None:
+                log.error("endpoint raises %s", f.exception())
+        for f in pending:
+            log.warning("cancelling submission which did not complete before shutdown")
+            f.cancel()
+        if flush_task in pending and spool is not None:
+            for check_evaluation in check_evaluations:
+                spool.append(check_evaluation.check_id, check_evaluation.evaluation)
 
     # wait for evaluator to finish cleaning up
     yield from asyncio.wait_for(evaluator_task, None, loop=event_loop)
+
+    # wait for the spool to finish replaying and writing
+    if spool is not None:
+        yield from asyncio.wait_for(replay_task, None, loop=event_loop)
+        yield from spool.close()
+
+@asyncio.coroutine
+def flush_evaluations(endpoint, agent_id, check_evaluations, spool=None, batched=False):
+    """
+    Submit the evaluations which remain when the processor is shutting down.
+    If older evaluations are still in the spool, then the evaluations are
+    appended to the spool to preserve ordering.
+
+    :param endpoint:
+    :type endpoint: mandelbrot.agent.endpoint.Endpoint
+    :param agent_id:
+    :type agent_id: cifparser.Path
+    :param check_evaluations:
+    :type check_evaluations: list[mandelbrot.agent.evaluator.CheckEvaluation]
+    :param spool:
+    :type spool: mandelbrot.agent.spool.Spool
+    :param batched: If True, then submit the evaluations in a single batch
+    :type batched: bool
+    """
+    if spool is not None and not spool.is_empty():
+        for check_evaluation in check_evaluations:
+            spool.append(check_evaluation.check_id, check_evaluation.evaluation)
+        return None
+    try:
+        if batched:
+            yield from submit_batch(endpoint, agent_id, EvaluationBatch(check_evaluations), spool)
+        else:
+            for check_evaluation in check_evaluations:
+                yield from submit_evaluation(endpoint, agent_id, check_evaluation, spool)
+    except Exception as e:
+        log.error("endpoint raises %s", e)
+    return None
+
+@asyncio.coroutine
+def submit_evaluation(endpoint, agent_id, check_evaluation, spool=None):
+    """
+    Submit the evaluation to the endpoint.  If the submission fails with a
+    retryable error and a spool is specified, then the evaluation is
+    appended to the spool.
+
+    :param endpoint:
+    :type endpoint: mandelbrot.agent.endpoint.Endpoint
+    :param agent_id:
+    :type agent_id: cifparser.Path
+    :param check_evaluation:
+    :type check_evaluation: mandelbrot.agent.evaluator.CheckEvaluation
+    :param spool:
+    :type spool: mandelbrot.agent.spool.Spool
+    """
+    check_id = check_evaluation.check_id
+    evaluation = check_evaluation.evaluation
+    try:
+        yield from endpoint.submit_evaluation(agent_id, check_id, evaluation)
+    except retryable_exceptions as e:
+        if spool is None:
+            raise
+        log.info("endpoint responds %s, spooling evaluation for check %s", repr(e), check_id)
+        spool.append(check_id, evaluation)
+    return None
+
+@asyncio.coroutine
+def submit_batch(endpoint, agent_id, batch, spool=None):
+    """
+    Submit the batch of evaluations to the endpoint, and log each evaluation
+    which the endpoint did not accept.  If a spool is specified, then each
+    evaluation which fails with a retryable error is appended to the spool.
+
+    :param endpoint:
+    :type endpoint: mandelbrot.agent.endpoint.Endpoint
+    :param agent_id:
+    :type agent_id: cifparser.Path
+    :param batch:
+    :type batch: mandelbrot.agent.batcher.EvaluationBatch
+    :param spool:
+    :type spool: mandelbrot.agent.spool.Spool
+    """
+    evaluations = [(r.check_id, r.evaluation) for r in batch.check_evaluations]
+    try:
+        results = yield from endpoint.submit_evaluations(agent_id, evaluations)
+    except retryable_exceptions as e:
+        if spool is None:
+            raise
+        results = [(check_id, e) for check_id,_ in evaluations]
+    for (check_id,result),(_,evaluation) in zip(results, evaluations):
+        if isinstance(result, retryable_exceptions) and spool is not None:
+            log.info("endpoint responds %s, spooling evaluation for check %s", repr(result), check_id)
+            spool.append(check_id, evaluation)
+        elif result is not None:
+            log.error("endpoint rejects evaluation for check %s: %s", check_id, repr(result))
+    return None
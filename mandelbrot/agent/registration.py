@@ -24,6 +24,7 @@ log = logging.getLogger("mandelbrot.agent.registration")
 
 from mandelbrot.model.registration import Registration
 from mandelbrot.model.check import Check
+from mandelbrot.model.metric_schema import MetricSchema
 
 default_join_timeout = datetime.timedelta(minutes=5)
 default_check_timeout = datetime.timedelta(minutes=1)
@@ -70,6 +71,16 @@ def make_registration(agent_id, metadata, scheduled_checks):
         check.set_check_timeout(check_timeout)
         retirement_age = or_default(default_retirement_age, scheduled_check.check.get_retirement_age)
         check.set_retirement_age(retirement_age)
+        # register declared metrics, so values can be submitted positionally
+        metrics = scheduled_check.check.get_metrics()
+        for metric_name,metric in metrics.items():
+            if metric.get_step() is None:
+                metric.set_step(datetime.timedelta(seconds=scheduled_check.delay))
+            if metric.get_heartbeat() is None:
+                metric.set_heartbeat(datetime.timedelta(seconds=scheduled_check.delay * 2))
+            registration.set_metric(check_id, metric_name, metric)
+        if len(metrics) > 0:
+            check.set_metric_schema(MetricSchema(metrics).version)
         registration.set_check(check_id, check)
 
     s = pprint.pformat(registration.destructure(), indent=4, width=120, compact=False)
@@ -15,17 +15,23 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
+import zlib
 import logging
 
 log = logging.getLogger("mandelbrot.agent.scheduled_check")
 
+import cifparser
+from cifparser import or_default
+
 import mandelbrot.check
 import mandelbrot.registry
+from mandelbrot.agent.registration import default_check_timeout
 
 class ScheduledCheck(object):
     """
     """
-    def __init__(self, check_id, check, delay, offset, jitter):
+    def __init__(self, check_id, check, delay, offset, jitter, aligned=False,
+                 catch_up=False, execution=None, timeout=None):
         """
         :param check_id:
         :type check_id: str
@@ -37,12 +43,28 @@ class ScheduledCheck(object):
         :type offset: float
         :param jitter:
         :type jitter: float
+        :param aligned:
+        :type aligned: bool
+        :param catch_up:
+        :type catch_up: bool
+        :param execution: The execution class, or None to use the default executor
+        :type execution: str
+        :param timeout: The number of seconds the check may execute before it
+          is abandoned, or None to never abandon it
+        :type timeout: float
         """
         self.check_id = check_id
         self.check = check
         self.delay = delay
         self.offset = offset
         self.jitter = jitter
+        self.aligned = aligned
+        self.catch_up = catch_up
+        self.execution = execution
+        self.timeout = timeout
+
+    def __str__(self):
+        return str(self.check_id)
 
 def make_scheduled_check(instance_check, registry):
     """
@@ -58,9 +80,38 @@ def make_scheduled_check(instance_check, registry):
         requirement = mandelbrot.registry.require_mandelbrot
     check_factory = registry.lookup_factory(mandelbrot.check.entry_point_type,
         factory_name, mandelbrot.check.Check, requirement)
-    check = check_factory(instance_check.check_params)
+    check_params = instance_check.check_params
+    check = check_factory(check_params)
     log.debug("instantiating check %s with requirement '%s'",
         instance_check.check_id, instance_check.check_type)
+    # an aligned check runs on the wall clock grid, shifted by a jitter
+    # which is derived from the check id so it is the same on every restart
+    aligned = check_params.get_bool_or_default(cifparser.ROOT_PATH, 'aligned', False)
+    missed_intervals = check_params.get_str_or_default(cifparser.ROOT_PATH,
+        'missed intervals', 'skip')
+    if missed_intervals not in ('skip', 'catch up'):
+        raise ValueError("invalid missed intervals policy '{}'".format(missed_intervals))
+    jitter = instance_check.jitter
+    if aligned:
+        jitter = fixed_jitter(instance_check.check_id, jitter)
+    # the check timeout which is registered with the server is also
+    # enforced locally, so a hung check cannot hold its worker forever
+    check_timeout = or_default(default_check_timeout, check.get_check_timeout)
     scheduled_check = ScheduledCheck(instance_check.check_id, check,
-        instance_check.delay, instance_check.offset, instance_check.jitter)
+        instance_check.delay, instance_check.offset, jitter,
+        aligned, missed_intervals == 'catch up', check.get_execution_class(),
+        check_timeout.total_seconds())
     return scheduled_check
+
+def fixed_jitter(check_id, jitter):
+    """
+    Return a jitter between 0 and the specified maximum which depends
+    only on the check id.
+
+    :param check_id:
+    :type check_id: cifparser.Path
+    :param jitter:
+    :type jitter: float
+    :rtype: float
+    """
+    return (zlib.crc32(str(check_id).encode('utf-8')) / 2**32) * jitter
@@ -16,13 +16,43 @@
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import collections
+import heapq
+import math
 import random
+import time
 import logging
 
 log = logging.getLogger("mandelbrot.agent.scheduler")
 
+from mandelbrot.stats import get_stats, Histogram
+
+# the maximum number of consecutive missed intervals a task may catch up
+max_catch_up = 10
+
 class Scheduler(object):
     """
+    Schedules any number of tasks using a single event loop timer.  The
+    tasks are kept in a heap ordered by their next scheduled time, and the
+    timer is armed for the task at the top of the heap.  When the timer
+    fires, every task which is due is moved into the ready set, where it
+    waits until it is consumed by next_task() or next_batch().  A task
+    appears in the ready set at most once, so a consumer which falls
+    behind never causes the ready set to grow without bound.
+
+    An aligned task is scheduled on the wall clock grid offset + k * delay,
+    shifted by a fixed jitter, so every agent running the check with the
+    same schedule runs it at the same instants.  Intervals which are missed
+    are either skipped, or run to catch up, up to max_catch_up intervals.
+    A task which is catching up is handed out once, and its next owed run
+    is not ready until the consumer reports the run is done by calling
+    task_done().  The lateness of every task is recorded in a
+    histogram, which is reported in the 'mandelbrot.agent.lateness' stats
+    under the name of the task.
+
+    When the consumer cannot keep up, the intervals of every task may be
+    stretched by a factor.  Aligned tasks are stretched by a whole number
+    of intervals, so they stay on their grid.
     """
     def __init__(self, event_loop):
         """
@@ -31,9 +61,34 @@ class Scheduler(object):
         """
         self.event_loop = event_loop
         self.task_list = {}
-        self.queue = asyncio.Queue(loop=event_loop)
+        self.heap = []
+        # the scheduled times of the runs of each ready task
+        self.ready = collections.OrderedDict()
+        # the runs owed by catch up tasks which were handed out and not done
+        self.owing = {}
+        # the scheduled time of the run of each task most recently handed out
+        self.handed_out = {}
+        self.ready_event = asyncio.Event(loop=event_loop)
+        self.handle = None
+        self.handle_time = None
+        self.sequence = 0
+        self.stretch = 1.0
+        self.stats = get_stats('mandelbrot.agent.scheduler')
+        self.lateness_stats = get_stats('mandelbrot.agent.lateness')
+
+    def current_time(self):
+        """
+        :rtype: float
+        """
+        return self.event_loop.time()
+
+    def wall_time(self):
+        """
+        :rtype: float
+        """
+        return time.time()
 
-    def schedule_task(self, f, delay, offset, jitter):
+    def schedule_task(self, f, delay, offset, jitter, aligned=False, catch_up=False):
         """
         :param f:
         :type f: callable
@@ -41,13 +96,50 @@ class Scheduler(object):
         :type delay: float
         :param offset:
         :type offset: float
-        :param jitter:
+        :param jitter: The maximum random jitter, or if aligned is True, the
+          fixed jitter added to each grid boundary
         :type jitter: float
+        :param aligned: If True, schedule on the wall clock grid
+        :type aligned: bool
+        :param catch_up: If True, run missed intervals instead of skipping them
+        :type catch_up: bool
         """
         if f in self.task_list:
             raise KeyError("{} is already scheduled".format(f))
-        task = ScheduledTask(self.event_loop, self.queue, f, delay, offset, jitter)
-        self.task_list[task.f] = task
+        if delay <= 0:
+            raise ValueError("delay must be greater than 0")
+        if aligned:
+            task = ScheduledTask(f, delay, offset, jitter, aligned, catch_up)
+            # find the next grid boundary, then convert it to loop time
+            wall_time = self.wall_time()
+            phase = task.offset + task.jitter
+            boundary = phase + math.ceil((wall_time - phase) / delay) * delay
+            task.next_scheduled_time = self.current_time() + (boundary - wall_time)
+        else:
+            task = ScheduledTask(f, delay, offset, random.random() * jitter, aligned, catch_up)
+            task.next_scheduled_time = self.current_time() + task.offset + task.jitter
+        self.task_list[f] = task
+        self.lateness_stats.set_histogram(str(f), task.lateness)
+        self._push(task)
+        self._arm()
+        self.stats.set_gauge('scheduled tasks', len(self.task_list))
+        log.debug("scheduling %s at %s (%.3fs offset %.3fs jitter)",
+            f, task.next_scheduled_time, task.offset, task.jitter)
+
+    def set_stretch(self, stretch):
+        """
+        Multiply the interval of every task by stretch, starting from the
+        next time each task runs.
+
+        :param stretch: The interval multiplier, at least 1.0
+        :type stretch: float
+        """
+        if stretch < 1.0:
+            raise ValueError("stretch must be at least 1.0")
+        if stretch != self.stretch:
+            log.debug("stretching task intervals by %.1f", stretch)
+        self.stretch = stretch
+        self.stats.set_gauge('stretch', stretch)
 
     def unschedule_task(self, f):
         """
@@ -55,35 +147,193 @@ class Scheduler(object):
         :type f: callable
         """
         try:
-            task = self.task_list[f]
-            task.cancel()
-            del self.task_list[f]
-        except:
+            task = self.task_list.pop(f)
+        except KeyError:
             raise KeyError("{} is not scheduled".format(f))
+        task.cancel()
+        self.lateness_stats.remove_histogram(str(f))
+        self.ready.pop(f, None)
+        self.owing.pop(f, None)
+        self.handed_out.pop(f, None)
+        if len(self.ready) == 0:
+            self.ready_event.clear()
+        self.stats.set_gauge('scheduled tasks', len(self.task_list))
 
+    @asyncio.coroutine
     def next_task(self):
         """
         :returns: The next scheduled task function.
         :rtype: callable
         """
-        return self.queue.get()
+        batch = yield from self.next_batch(1)
+        return batch[0]
+
+    @asyncio.coroutine
+    def next_batch(self, max_size=None):
+        """
+        Wait until at least one task is ready, then return the ready tasks
+        in the order they were scheduled.  Each task is handed out once per
+        batch; the other runs owed by a catch up task are ready once the
+        consumer calls task_done().
+
+        :param max_size: The maximum number of tasks to return, or None
+          to return all ready tasks.
+        :type max_size: int
+        :returns: The list of ready task functions.
+        :rtype: list[callable]
+        """
+        while len(self.ready) == 0:
+            yield from self.ready_event.wait()
+        batch = []
+        while len(self.ready) > 0 and (max_size is None or len(batch) < max_size):
+            f,runs = self.ready.popitem(last=False)
+            batch.append(f)
+            self.handed_out[f] = runs[0]
+            if self.task_list[f].catch_up:
+                self.owing[f] = runs[1:]
+        if len(self.ready) == 0:
+            self.ready_event.clear()
+        return batch
+
+    def task_done(self, f, completed=True):
+        """
+        Report that the run of the task which was handed out is done.  If
+        the task is catching up, then its next owed run is made ready, or
+        if completed is False, then the owed runs are dropped.
+
+        :param f:
+        :type f: callable
+        :param completed: False if the run was skipped
+        :type completed: bool
+        """
+        runs = self.owing.pop(f, None)
+        if not runs or f not in self.task_list:
+            return
+        if not completed:
+            log.debug("dropping %d owed runs for %s", len(runs), f)
+            self.stats.increment('dropped runs', len(runs))
+            return
+        self.ready[f] = runs
+        self.ready_event.set()
+
+    def get_scheduled_time(self, f):
+        """
+        :param f:
+        :type f: callable
+        :returns: The wall clock time the run of the task which was most
+          recently handed out was scheduled for.
+        :rtype: float
+        """
+        try:
+            scheduled_time = self.handed_out[f]
+        except KeyError:
+            raise KeyError("{} was not handed out".format(f))
+        return self.wall_time() - (self.current_time() - scheduled_time)
+
+    def get_lateness(self, f):
+        """
+        :param f:
+        :type f: callable
+        :returns: The histogram of lateness in seconds for the task.
+        :rtype: mandelbrot.stats.Histogram
+        """
+        try:
+            return self.task_list[f].lateness
+        except KeyError:
+            raise KeyError("{} is not scheduled".format(f))
 
     def unschedule_all(self):
         """
         """
         for task in self.task_list.values():
             task.cancel()
+            self.lateness_stats.remove_histogram(str(task.f))
         self.task_list = {}
+        self.heap = []
+        self.ready.clear()
+        self.owing = {}
+        self.handed_out = {}
+        self.ready_event.clear()
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+            self.handle_time = None
+        self.stats.set_gauge('scheduled tasks', 0)
+
+    def _push(self, task):
+        # the sequence number breaks ties, so tasks are never compared
+        self.sequence += 1
+        heapq.heappush(self.heap, (task.next_scheduled_time, self.sequence, task))
+
+    def _arm(self):
+        # discard cancelled tasks from the top of the heap
+        while len(self.heap) > 0 and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        if len(self.heap) == 0:
+            return
+        next_time = self.heap[0][0]
+        if self.handle is not None:
+            if self.handle_time <= next_time:
+                return
+            self.handle.cancel()
+        self.handle = self.event_loop.call_at(next_time, self._fire)
+        self.handle_time = next_time
+
+    def _fire(self):
+        # the timer may fire within the clock resolution before handle_time,
+        # so anything scheduled up to handle_time is due
+        current_time = self.current_time()
+        now = max(current_time, self.handle_time)
+        self.handle = None
+        self.handle_time = None
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            scheduled_time,_,task = heapq.heappop(self.heap)
+            if task.cancelled:
+                continue
+            lateness = max(0.0, current_time - scheduled_time)
+            task.lateness.observe(lateness)
+            self.stats.observe('lateness', lateness)
+            # compute the next time from the scheduled time, not the
+            # current time, so the interval does not drift
+            if task.aligned:
+                interval = task.delay * math.ceil(self.stretch)
+            else:
+                interval = task.delay * self.stretch
+            next_scheduled_time = scheduled_time + interval
+            missed = 0
+            if next_scheduled_time <= now:
+                missed = int(math.floor((now - next_scheduled_time) / interval)) + 1
+                next_scheduled_time += missed * interval
+            # a task which is catching up owes a run for each missed interval,
+            # which waits behind the run which is in progress, if any
+            if task.catch_up:
+                runs = [scheduled_time + n * interval for n in range(missed + 1)]
+                if task.f in self.owing:
+                    runs = self.owing[task.f] + runs
+                    self.owing[task.f] = runs[-max_catch_up:]
+                else:
+                    runs = self.ready.get(task.f, []) + runs
+                    self.ready[task.f] = runs[-(max_catch_up + 1):]
+            else:
+                if task.f in self.ready:
+                    log.debug("skipping %s: task is already ready", task.f)
+                    self.stats.increment('overruns')
+                self.ready[task.f] = [scheduled_time]
+            if missed > 0:
+                if not task.catch_up:
+                    log.debug("skipping %d missed intervals for %s", missed, task.f)
+                self.stats.increment('missed intervals', missed)
+            task.next_scheduled_time = next_scheduled_time
+            self._push(task)
+        if len(self.ready) > 0:
+            self.ready_event.set()
+        self._arm()
 
 class ScheduledTask(object):
     """
     """
-    def __init__(self, event_loop, queue, f, delay, offset, jitter):
+    def __init__(self, f, delay, offset, jitter, aligned=False, catch_up=False):
         """
-        :param event_loop:
-        :type event_loop: asyncio.AbstractEventLoop
-        :param queue:
-        :type queue: asyncio.Queue
         :param f:
         :type f: callable
         :param delay:
@@ -92,37 +342,25 @@ class ScheduledTask(object):
         :type offset: float
         :param jitter:
         :type jitter: float
+        :param aligned:
+        :type aligned: bool
+        :param catch_up:
+        :type catch_up: bool
         """
-        self.event_loop = event_loop
-        self.queue = queue
         self.f = f
         self.delay = delay
         self.offset = offset
-        self.jitter = random.random() * jitter
-        self.next_scheduled_time = self.current_time() + self.offset + self.jitter
-        self.handle = self.event_loop.call_at(self.next_scheduled_time, self._enqueue)
-        log.debug("scheduling %s at %s (%.3fs offset %.3fs jitter)", self.f, self.next_scheduled_time, self.offset, self.jitter)
-
-    def current_time(self):
-        """
-        :rtype: float
-        """
-        return self.event_loop.time()
-
-    def _enqueue(self):
-        try:
-            self.queue.put_nowait(self.f)
-        except asyncio.QueueFull:
-            log.error("failed to enqueue scheduled task, queue is full")
-        self.next_scheduled_time = self.current_time() + self.delay
-        self.handle = self.event_loop.call_at(self.next_scheduled_time, self._enqueue)
-        log.debug("scheduling %s at %s (%.3fs delay)", self.f, self.next_scheduled_time, self.delay)
+        self.jitter = jitter
+        self.aligned = aligned
+        self.catch_up = catch_up
+        self.lateness = Histogram()
+        self.next_scheduled_time = None
+        self.cancelled = False
 
     def is_running(self):
-        return self.handle is not None
+        return not self.cancelled
 
     def cancel(self):
         if self.is_running():
             log.debug("cancelled %s", self.f)
-            self.handle.cancel()
-            self.handle = None
+            self.cancelled = True
@@ -0,0 +1,369 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import concurrent.futures
+import functools
+import json
+import os
+import logging
+import cifparser
+
+log = logging.getLogger("mandelbrot.agent.spool")
+
+from mandelbrot.model import construct
+from mandelbrot.model.evaluation import Evaluation
+from mandelbrot.transport import retryable_exceptions
+
+default_max_size = 64 * 1024 * 1024
+default_segment_size = 4 * 1024 * 1024
+default_commit_delay = 0.1
+default_min_backoff = 1.0
+default_max_backoff = 60.0
+
+class Spool(object):
+    """
+    The Spool is an on-disk write-ahead log of evaluations which could not
+    be submitted to the endpoint.  Evaluations are appended to the spool
+    and replayed in order once the endpoint is available again.
+
+    The spool is a directory of append-only segment files plus a cursor
+    file which records the position of the next evaluation to replay.
+    Appended evaluations are buffered and written together, with a single
+    fsync for each group of writes; all file I/O runs on the default
+    executor so the event loop never blocks on the disk.  When the spool
+    grows beyond max_size the oldest segments are discarded.
+    """
+    def __init__(self, event_loop, path, max_size=default_max_size,
+                 segment_size=default_segment_size, commit_delay=default_commit_delay):
+        """
+        :param event_loop:
+        :type event_loop: asyncio.AbstractEventLoop
+        :param path: The spool directory, which is created if it doesn't exist
+        :type path: pathlib.Path
+        :param max_size: The maximum size of the spool in bytes
+        :type max_size: int
+        :param segment_size: The size in bytes at which a new segment is started
+        :type segment_size: int
+        :param commit_delay: The number of seconds to gather appended
+          evaluations before writing them
+        :type commit_delay: float
+        """
+        self.event_loop = event_loop
+        self.path = path
+        self.max_size = max_size
+        self.segment_size = min(segment_size, max(max_size // 4, 1))
+        self.commit_delay = commit_delay
+        self.buffer = []
+        self.commit_handle = None
+        self.committing = None
+        self.available = asyncio.Event(loop=event_loop)
+        self.num_dropped_bytes = 0
+        # maps segment sequence number to segment size in bytes
+        self.segments = {}
+        # the position (segment, offset) of the next record to replay
+        self.cursor = None
+        self._load()
+
+    def _segment_path(self, segment):
+        return self.path / '{:016d}.log'.format(segment)
+
+    def _load(self):
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+        for segment_path in self.path.glob('*.log'):
+            self.segments[int(segment_path.stem)] = segment_path.stat().st_size
+        try:
+            with (self.path / 'cursor').open('r') as f:
+                segment, offset = f.read().split()
+                self.cursor = (int(segment), int(offset))
+        except (OSError, ValueError):
+            self.cursor = None
+        if len(self.segments) == 0:
+            self.segments[0] = 0
+        first = min(self.segments)
+        if self.cursor is None or self.cursor[0] < first:
+            self.cursor = (first, 0)
+        if not self.is_empty():
+            log.info("spool %s contains unsubmitted evaluations", self.path)
+            self.available.set()
+
+    def tail(self):
+        """
+        :returns: The position (segment, offset) following the last record.
+        :rtype: (int,int)
+        """
+        last = max(self.segments)
+        return (last, self.segments[last])
+
+    def size(self):
+        """
+        :returns: The size of the spool in bytes, excluding buffered records.
+        :rtype: int
+        """
+        return sum(self.segments.values())
+
+    def is_empty(self):
+        """
+        :returns: True if there are no evaluations waiting to be replayed.
+        :rtype: bool
+        """
+        return len(self.buffer) == 0 and self.committing is None and self.cursor >= self.tail()
+
+    def append(self, check_id, evaluation):
+        """
+        Append the evaluation to the spool.  The evaluation is written to
+        disk asynchronously, together with any other evaluations appended
+        within commit_delay seconds.
+
+        :param check_id:
+        :type check_id: cifparser.Path
+        :param evaluation:
+        :type evaluation: mandelbrot.model.evaluation.Evaluation
+        """
+        record = {'checkId': str(check_id), 'evaluation': evaluation.destructure()}
+        self.buffer.append((json.dumps(record) + '\n').encode('utf-8'))
+        if self.commit_handle is None and self.committing is None:
+            self.commit_handle = self.event_loop.call_later(self.commit_delay, self._commit)
+
+    def _commit(self):
+        self.commit_handle = None
+        records = self.buffer
+        self.buffer = []
+        segment, size = self.tail()
+        if size >= self.segment_size:
+            segment += 1
+        self.committing = self.event_loop.run_in_executor(None,
+            self._write_records, segment, records)
+        self.committing.add_done_callback(functools.partial(self._commit_done, segment, records))
+
+    def _write_records(self, segment, records):
+        """
+        Append the records to the segment and fsync.  Runs on the executor.
+        """
+        segment_path = self._segment_path(segment)
+        is_new = not segment_path.exists()
+        with segment_path.open('ab') as f:
+            for record in records:
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+        # make the new segment durable by syncing the directory entry
+        if is_new:
+            fd = os.open(str(self.path), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        return size
+
+    def _commit_done(self, segment, records, future):
+        self.committing = None
+        try:
+            self.segments[segment] = future.result()
+            log.debug("committed %d evaluations to spool segment %d", len(records), segment)
+        except Exception as e:
+            log.error("failed to write %d evaluations to spool: %s", len(records), e)
+            self.buffer = records + self.buffer
+        self._enforce_max_size()
+        if not self.is_empty():
+            self.available.set()
+        if len(self.buffer) > 0 and self.commit_handle is None:
+            self.commit_handle = self.event_loop.call_later(self.commit_delay, self._commit)
+
+    def _enforce_max_size(self):
+        dropped = []
+        while self.size() > self.max_size and len(self.segments) > 1:
+            first = min(self.segments)
+            self.num_dropped_bytes += self.segments.pop(first)
+            dropped.append(first)
+        if len(dropped) > 0:
+            log.warning("spool exceeds %d bytes, discarded %d oldest segments",
+                self.max_size, len(dropped))
+            first = min(self.segments)
+            if self.cursor[0] < first:
+                self.cursor = (first, 0)
+            self.event_loop.run_in_executor(None, self._remove_segments, dropped)
+
+    def _remove_segments(self, segments):
+        """
+        Delete the segment files.  Runs on the executor.
+        """
+        for segment in segments:
+            try:
+                self._segment_path(segment).unlink()
+            except OSError as e:
+                log.error("failed to remove spool segment %d: %s", segment, e)
+
+    def _read_records(self, cursor, segments, count):
+        """
+        Read up to count records starting at cursor.  Runs on the executor.
+
+        :returns: A list of (record, position) pairs, where position is the
+          cursor following the record.
+        """
+        segment, offset = cursor
+        records = []
+        while len(records) < count:
+            try:
+                with self._segment_path(segment).open('rb') as f:
+                    f.seek(offset)
+                    while len(records) < count:
+                        line = f.readline()
+                        # a missing newline means the record is incomplete
+                        if not line.endswith(b'\n'):
+                            break
+                        offset += len(line)
+                        try:
+                            records.append((json.loads(line.decode('utf-8')), (segment, offset)))
+                        except ValueError:
+                            log.error("discarding corrupt spool record in segment %d", segment)
+            except FileNotFoundError:
+                pass
+            later = [s for s in segments if s > segment]
+            if len(records) < count and len(later) > 0:
+                segment, offset = min(later), 0
+            else:
+                break
+        # position the cursor at a later segment if the current one is finished
+        if len(records) == 0 and (segment, offset) != cursor:
+            records.append((None, (segment, offset)))
+        return records
+
+    def _write_cursor(self, cursor):
+        """
+        Atomically replace the cursor file.  Runs on the executor.
+        """
+        cursor_path = self.path / 'cursor'
+        temp_path = self.path / 'cursor.tmp'
+        with temp_path.open('w') as f:
+            f.write("{} {}\n".format(*cursor))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(str(temp_path), str(cursor_path))
+
+    def _advance(self, cursor):
+        self.cursor = cursor
+        finished = [s for s in self.segments if s < cursor[0]]
+        for segment in finished:
+            del self.segments[segment]
+        write_cursor = self.event_loop.run_in_executor(None, self._write_cursor, cursor)
+        if len(finished) > 0:
+            self.event_loop.run_in_executor(None, self._remove_segments, finished)
+        return write_cursor
+
+    @asyncio.coroutine
+    def replay_until_signaled(self, submit, signal, batch_size=1,
+                              min_backoff=default_min_backoff, max_backoff=default_max_backoff):
+        """
+        Replay spooled evaluations in order until the specified signal is
+        set.  If submitting an evaluation fails with a retryable error, then
+        replay pauses for an exponentially increasing backoff period before
+        trying the same evaluation again.
+
+        :param submit: A coroutine function which takes a list of
+          (check_id, evaluation) pairs and returns a list containing the
+          result of each submission, either None or a TransportException.
+        :type submit: callable
+        :param signal: The signal which indicates termination
+        :type signal: asyncio.Event
+        :param batch_size: The maximum number of evaluations to submit at once
+        :type batch_size: int
+        """
+        shutdown_signal = self.event_loop.create_task(signal.wait())
+        backoff = min_backoff
+        try:
+            while True:
+                # wait until there are evaluations to replay
+                if self.cursor >= self.tail():
+                    self.available.clear()
+                    available = self.event_loop.create_task(self.available.wait())
+                    yield from asyncio.wait([shutdown_signal, available], loop=self.event_loop,
+                        return_when=concurrent.futures.FIRST_COMPLETED)
+                    available.cancel()
+                    if shutdown_signal.done():
+                        break
+                    continue
+                records = yield from self.event_loop.run_in_executor(None,
+                    self._read_records, self.cursor, list(self.segments), batch_size)
+                if len(records) == 0:
+                    # the last record is still being written
+                    yield from asyncio.wait([shutdown_signal], timeout=self.commit_delay,
+                        loop=self.event_loop)
+                    if shutdown_signal.done():
+                        break
+                    continue
+                evaluations = []
+                for record,_ in records:
+                    if record is not None:
+                        check_id = cifparser.make_path(record['checkId'])
+                        evaluations.append((check_id, construct(Evaluation, record['evaluation'])))
+                if len(evaluations) > 0:
+                    try:
+                        results = yield from submit(evaluations)
+                    except Exception as e:
+                        results = [e] * len(evaluations)
+                else:
+                    results = []
+                # advance the cursor past each evaluation which doesn't need retrying
+                cursor = None
+                retry = False
+                results = iter(results)
+                for record,position in records:
+                    if record is not None:
+                        result = next(results)
+                        if isinstance(result, retryable_exceptions):
+                            retry = True
+                            break
+                        if result is not None:
+                            log.error("discarding spooled evaluation for check %s: %s",
+                                record['checkId'], repr(result))
+                    cursor = position
+                if cursor is not None:
+                    yield from self._advance(cursor)
+                if retry:
+                    log.info("endpoint is unavailable, retrying spooled evaluations in %.1f seconds", backoff)
+                    yield from asyncio.wait([shutdown_signal], timeout=backoff, loop=self.event_loop)
+                    if shutdown_signal.done():
+                        break
+                    backoff = min(backoff * 2.0, max_backoff)
+                else:
+                    backoff = min_backoff
+        finally:
+            shutdown_signal.cancel()
+
+    @asyncio.coroutine
+    def close(self):
+        """
+        Write any buffered evaluations and wait for pending writes to finish.
+        """
+        # a commit may already be in progress, so there can be two rounds
+        for _ in range(2):
+            if self.commit_handle is not None:
+                self.commit_handle.cancel()
+                self.commit_handle = None
+            if self.committing is None and len(self.buffer) > 0:
+                self._commit()
+            if self.committing is not None:
+                yield from asyncio.wait([self.committing], loop=self.event_loop)
+        if self.commit_handle is not None:
+            self.commit_handle.cancel()
+            self.commit_handle = None
+        if len(self.buffer) > 0:
+            log.error("discarding %d evaluations which could not be spooled", len(self.buffer))
+            self.buffer = []
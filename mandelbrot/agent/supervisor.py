@@ -48,14 +48,15 @@ class Supervisor(object):
         """
         event_loop = asyncio.get_event_loop()
         shutdown_signal = asyncio.Event(loop=event_loop)
+        reload_signal = asyncio.Event(loop=event_loop)
 
         # add handlers for the signals we are interested in
-        event_loop.add_signal_handler(signal.SIGHUP, self.reload, shutdown_signal)
+        event_loop.add_signal_handler(signal.SIGHUP, self.reload, reload_signal)
         event_loop.add_signal_handler(signal.SIGTERM, self.terminate, shutdown_signal)
         event_loop.add_signal_handler(signal.SIGINT, self.terminate, shutdown_signal)
 
-        # load registry plugins
-        registry = Registry()
+        # load registry plugins, indexing entry points in the instance
+        registry = Registry(self.path / 'registry.index')
 
         # loop forever until is_finished is True
         try:
@@ -68,7 +69,8 @@ class Supervisor(object):
                 # enable signal catching
                 self.ignore_signals = False
                 # wait until the processor completes
-                run_processor_until_signaled = processor.run_until_signaled(shutdown_signal)
+                run_processor_until_signaled = processor.run_until_signaled(shutdown_signal,
+                    reload_signal)
                 try:
                     event_loop.run_until_complete(run_processor_until_signaled)
                 except Exception as e:
@@ -77,18 +79,20 @@ class Supervisor(object):
                     self.ignore_signals = True
                 # release resources
                 instance.close()
-                # reset the shutdown signal event
+                # reset the signal events, a restarted processor loads the instance anyway
                 shutdown_signal.clear()
+                reload_signal.clear()
         finally:
             log.debug("shutting down event loop")
             event_loop.stop()
             event_loop.close()
 
-    def reload(self, shutdown_signal):
+    def reload(self, reload_signal):
+        # the processor reloads only the checks which changed, and restarts
+        # itself if anything else changed
         if not self.ignore_signals:
-            self.ignore_signals = True
-            log.info("--- reloading agent process ---")
-            shutdown_signal.set()
+            log.info("--- reloading agent checks ---")
+            reload_signal.set()
 
     def terminate(self, shutdown_signal):
         if not self.ignore_signals:
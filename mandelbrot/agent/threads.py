@@ -0,0 +1,120 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import concurrent.futures
+import queue
+import threading
+import logging
+
+log = logging.getLogger("mandelbrot.agent.threads")
+
+class ThreadPool(concurrent.futures.Executor):
+    """
+    An executor which runs each call on one of a fixed number of daemon
+    threads.  Unlike ThreadPoolExecutor, the threads are not joined when
+    the interpreter exits, so a thread which is stuck in a call cannot
+    block exit, and shutting down the pool without waiting leaves the
+    stuck thread behind.
+
+    A thread cannot be killed, so a call which is abandoned keeps running
+    until it returns.  Replacing the thread starts a new thread in its
+    place, so the abandoned call does not hold a slot in the pool; once
+    the pool has more threads than workers, the next thread to finish a
+    call exits.
+    """
+    def __init__(self, num_workers):
+        """
+        :param num_workers: The number of worker threads to create
+        :type num_workers: int
+        """
+        self.num_workers = num_workers
+        self.work_queue = queue.Queue()
+        self.threads = set()
+        self.lock = threading.Lock()
+        self.is_shutdown = False
+        for _ in range(num_workers):
+            self.start_thread()
+
+    def start_thread(self):
+        thread = threading.Thread(target=self.run_thread, daemon=True)
+        self.threads.add(thread)
+        thread.start()
+
+    def run_thread(self):
+        while True:
+            work = self.work_queue.get()
+            # a shutdown marker is passed on to the next thread
+            if work is None:
+                self.work_queue.put(None)
+                with self.lock:
+                    self.threads.discard(threading.current_thread())
+                return
+            future, fn, args, kwargs = work
+            if future.set_running_or_notify_cancel():
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            del work, future
+            with self.lock:
+                if len(self.threads) > self.num_workers:
+                    self.threads.discard(threading.current_thread())
+                    return
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedule fn(*args, **kwargs) to run on a worker thread.
+
+        :returns: A future which completes with the result of the call.
+        :rtype: concurrent.futures.Future
+        """
+        with self.lock:
+            if self.is_shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            future = concurrent.futures.Future()
+            self.work_queue.put((future, fn, args, kwargs))
+            return future
+
+    def replace_thread(self):
+        """
+        Start a new thread in place of a thread whose call was abandoned.
+        """
+        with self.lock:
+            if not self.is_shutdown:
+                self.start_thread()
+                log.debug("started replacement thread, pool has %d threads", len(self.threads))
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker threads once the queued calls have run.  If wait
+        is True, then block until every thread has exited, including any
+        thread which is stuck in an abandoned call.
+
+        :param wait:
+        :type wait: bool
+        """
+        with self.lock:
+            if not self.is_shutdown:
+                self.is_shutdown = True
+                self.work_queue.put(None)
+            threads = list(self.threads)
+        if wait:
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,309 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import logging
+
+log = logging.getLogger("mandelbrot.agent.worker")
+
+from mandelbrot.model import construct
+from mandelbrot.model.evaluation import Evaluation
+from mandelbrot.model.timestamp import now
+
+class WorkerException(Exception):
+    """
+    Raised when a worker process exits while requests are outstanding.
+    """
+
+class WorkerPool(object):
+    """
+    A pool of long-lived worker processes.  Each check is assigned to one
+    worker, which holds the check instance and its context for as long as
+    the check is scheduled.  Executing a check sends only the check id to
+    the worker, and the worker returns only the destructured evaluation, so
+    neither the check nor its context is pickled on each execution.
+
+    A worker which is stuck executing a check can be replaced; the stuck
+    process is killed, and every check it held is loaded into the new
+    worker with its initial context.
+    """
+    def __init__(self, event_loop, num_workers):
+        """
+        :param event_loop:
+        :type event_loop: asyncio.AbstractEventLoop
+        :param num_workers: The number of worker processes to create
+        :type num_workers: int
+        """
+        self.event_loop = event_loop
+        self.num_workers = num_workers
+        self.workers = [Worker(event_loop, index) for index in range(num_workers)]
+        self.assignments = {}
+        self.initial_contexts = {}
+
+    @asyncio.coroutine
+    def assign(self, check_id, check, context):
+        """
+        Assign the check to the worker with the fewest checks, and send it
+        the check and its initial context.
+
+        :param check_id:
+        :type check_id: cifparser.Path
+        :param check:
+        :type check: mandelbrot.check.Check
+        :param context:
+        :type context: object
+        """
+        if check_id in self.assignments:
+            raise KeyError("{} is already assigned".format(check_id))
+        worker = min(self.workers, key=lambda w: len(w.checks))
+        yield from worker.request('load', check_id, check, context)
+        worker.checks.add(check_id)
+        self.assignments[check_id] = worker
+        self.initial_contexts[check_id] = (check, context)
+        log.debug("assigned check %s to worker %d", check_id, worker.index)
+
+    @asyncio.coroutine
+    def execute(self, check_id):
+        """
+        Execute the check on its worker.
+
+        :param check_id:
+        :type check_id: cifparser.Path
+        :returns: The evaluation
+        :rtype: mandelbrot.model.evaluation.Evaluation
+        """
+        worker = self.assignments[check_id]
+        structure = yield from worker.request('tick', check_id)
+        return construct(Evaluation, structure)
+
+    @asyncio.coroutine
+    def release(self, check_id, timeout=None):
+        """
+        Run the check cleanup method on its worker and remove the check
+        from the worker.  The cleanup request would wait behind any request
+        the worker is still running, so a busy worker is replaced instead,
+        and the cleanup method is not run.  If the cleanup method does not
+        complete within timeout seconds, then the worker is replaced.
+
+        :param check_id:
+        :type check_id: cifparser.Path
+        :param timeout:
+        :type timeout: float
+        :raises WorkerException: The cleanup method did not run.
+        """
+        worker = self.assignments.pop(check_id)
+        worker.checks.discard(check_id)
+        self.initial_contexts.pop(check_id, None)
+        if worker.requests:
+            yield from self.replace_worker(worker)
+            raise WorkerException("worker {} is busy".format(worker.index))
+        try:
+            yield from asyncio.wait_for(worker.request('fini', check_id),
+                timeout, loop=self.event_loop)
+        except asyncio.TimeoutError:
+            yield from self.replace_worker(worker)
+            raise WorkerException("cleanup timed out after {:.1f} seconds".format(timeout))
+
+    @asyncio.coroutine
+    def replace(self, check_id):
+        """
+        Kill the worker which holds the check, start a new worker in its
+        place, and load each check held by the old worker into the new one.
+        Any requests outstanding on the old worker fail with WorkerException.
+
+        :param check_id:
+        :type check_id: cifparser.Path
+        """
+        yield from self.replace_worker(self.assignments[check_id])
+
+    @asyncio.coroutine
+    def replace_worker(self, old_worker):
+        """
+        Kill the worker, start a new worker in its place, and load each
+        check held by the old worker into the new one.
+
+        :param old_worker:
+        :type old_worker: Worker
+        """
+        old_worker.kill()
+        worker = Worker(self.event_loop, old_worker.index)
+        self.workers[self.workers.index(old_worker)] = worker
+        log.warning("replaced worker %d", worker.index)
+        for held_check_id in sorted(old_worker.checks):
+            check, context = self.initial_contexts[held_check_id]
+            yield from worker.request('load', held_check_id, check, context)
+            worker.checks.add(held_check_id)
+            self.assignments[held_check_id] = worker
+
+    def shutdown(self):
+        """
+        Stop all worker processes.
+        """
+        for worker in self.workers:
+            worker.stop()
+        self.assignments = {}
+
+class Worker(object):
+    """
+    The parent side of a single worker process.  Requests are sent over a
+    pipe, and replies are read when the event loop reports the pipe is
+    readable, so waiting for a reply never blocks the loop.
+    """
+    def __init__(self, event_loop, index):
+        """
+        :param event_loop:
+        :type event_loop: asyncio.AbstractEventLoop
+        :param index:
+        :type index: int
+        """
+        self.event_loop = event_loop
+        self.index = index
+        self.checks = set()
+        self.requests = {}
+        self.sequence = 0
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=run_worker, args=(child_conn,),
+            name="mandelbrot-worker-{}".format(index), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.event_loop.add_reader(self.conn.fileno(), self._read_reply)
+        log.debug("started worker %d with pid %d", index, self.process.pid)
+
+    def request(self, op, check_id, *args):
+        """
+        :returns: A future which completes with the reply from the worker.
+        :rtype: asyncio.Future
+        """
+        f = asyncio.Future(loop=self.event_loop)
+        if self.conn is None:
+            f.set_exception(WorkerException("worker {} is stopped".format(self.index)))
+            return f
+        self.sequence += 1
+        try:
+            self.conn.send((op, self.sequence, check_id) + args)
+        except (EOFError, OSError) as e:
+            f.set_exception(WorkerException("worker {} failed: {}".format(self.index, e)))
+            return f
+        self.requests[self.sequence] = f
+        return f
+
+    def _read_reply(self):
+        try:
+            sequence, success, payload = self.conn.recv()
+        except (EOFError, OSError) as e:
+            log.error("worker %d exited unexpectedly", self.index)
+            self._close(WorkerException("worker {} exited".format(self.index)))
+            return
+        f = self.requests.pop(sequence, None)
+        if f is None or f.cancelled():
+            return
+        if success:
+            f.set_result(payload)
+        else:
+            f.set_exception(payload)
+
+    def _close(self, exception):
+        if self.conn is None:
+            return
+        self.event_loop.remove_reader(self.conn.fileno())
+        self.conn.close()
+        self.conn = None
+        for f in self.requests.values():
+            if not f.done():
+                f.set_exception(exception)
+        self.requests = {}
+
+    def kill(self):
+        """
+        Kill the worker process immediately, without waiting for it to
+        finish the current request.  The process is not joined, since a
+        process blocked in the kernel may not exit right away; it is reaped
+        the next time a worker is started.
+        """
+        self._close(WorkerException("worker {} was killed".format(self.index)))
+        if self.process.is_alive():
+            log.warning("killing worker %d with pid %d", self.index, self.process.pid)
+            try:
+                os.kill(self.process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def stop(self, timeout=5.0):
+        """
+        Ask the worker process to exit, and terminate it if it does not
+        exit within timeout seconds.
+        """
+        if self.conn is not None:
+            try:
+                self.conn.send(('stop', None, None))
+            except (EOFError, OSError):
+                pass
+            self._close(WorkerException("worker {} is stopped".format(self.index)))
+        self.process.join(timeout)
+        if self.process.is_alive():
+            log.warning("terminating worker %d", self.index)
+            self.process.terminate()
+            self.process.join()
+
+def run_worker(conn):
+    """
+    The main loop of a worker process.  Each request is a tuple of
+    (op, sequence, check_id, *args), and each reply is a tuple of
+    (sequence, success, payload).
+
+    :param conn:
+    :type conn: multiprocessing.connection.Connection
+    """
+    # the parent is responsible for handling interrupts
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    checks = {}
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        op, sequence, check_id = request[:3]
+        if op == 'stop':
+            break
+        try:
+            if op == 'load':
+                check, context = request[3:]
+                checks[check_id] = (check, context)
+                reply = (sequence, True, None)
+            elif op == 'tick':
+                check, context = checks[check_id]
+                evaluation = Evaluation()
+                evaluation.set_timestamp(now())
+                check.execute(evaluation, context)
+                reply = (sequence, True, evaluation.destructure())
+            elif op == 'fini':
+                check, context = checks.pop(check_id)
+                check.fini(context)
+                reply = (sequence, True, None)
+            else:
+                raise ValueError("unknown worker op {}".format(op))
+        except Exception as e:
+            reply = (sequence, False, e)
+        try:
+            conn.send(reply)
+        except Exception:
+            # the exception raised by the check may not be picklable
+            conn.send((sequence, False, Exception(str(reply[2]))))
+    conn.close()
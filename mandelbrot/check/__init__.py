@@ -17,11 +17,23 @@
 
 import cifparser
 
+from mandelbrot.model.metric import Metric
+
 entry_point_type = 'mandelbrot.check'
 
+# execution classes, from cheapest to most isolated
+EXECUTION_INLINE = 'inline'
+EXECUTION_THREAD = 'thread'
+EXECUTION_PROCESS = 'process'
+
+execution_classes = (EXECUTION_INLINE, EXECUTION_THREAD, EXECUTION_PROCESS)
+
 class Check(object):
     """
     """
+
+    default_execution_class = EXECUTION_PROCESS
+
     def __init__(self, ns, **kwargs):
         """
         :param ns:
@@ -55,9 +67,30 @@ class Check(object):
     def get_allowed_notifications(self):
         return self.ns.get_str_list_or_default(cifparser.ROOT_PATH, "allowed notifications")
 
+    def get_execution_class(self):
+        """
+        Return the execution class, which determines whether the check is
+        executed inline on the event loop, on a thread pool, or on a process
+        pool.  Checks which are cheap and never block should override
+        default_execution_class with EXECUTION_INLINE.
+
+        :rtype: str
+        """
+        execution_class = self.ns.get_str_or_default(cifparser.ROOT_PATH,
+            "execution class", self.default_execution_class)
+        if execution_class not in execution_classes:
+            raise ValueError("invalid execution class '{}'".format(execution_class))
+        return execution_class
+
     def get_metrics(self):
         """
-        Return the set of metrics to register.
+        Return the metrics to register, keyed by metric name.  Metrics
+        which are registered may be submitted as a positional vector instead
+        of by name.  Use make_metric() to declare each metric; if the step
+        or heartbeat is not specified, then it is derived from the check
+        interval.
+
+        :rtype: dict[str,mandelbrot.model.metric.Metric]
         """
         return {}
 
@@ -96,3 +129,27 @@ class Check(object):
         :rtype: mandelbrot.model.Evaluation
         """
         raise NotImplementedError()
+
+def make_metric(source_type, metric_unit, step=None, heartbeat=None):
+    """
+    Declare a metric returned by Check.get_metrics().
+
+    :param source_type: The source type, one of the SourceType constants
+    :type source_type: str
+    :param metric_unit:
+    :type metric_unit: str
+    :param step: The expected interval between values
+    :type step: datetime.timedelta
+    :param heartbeat: The maximum interval between values before the metric
+      is considered unknown
+    :type heartbeat: datetime.timedelta
+    :rtype: mandelbrot.model.metric.Metric
+    """
+    metric = Metric()
+    metric.set_source_type(source_type)
+    metric.set_metric_unit(metric_unit)
+    if step is not None:
+        metric.set_step(step)
+    if heartbeat is not None:
+        metric.set_heartbeat(heartbeat)
+    return metric
@@ -0,0 +1,152 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import array
+import fnmatch
+import re
+
+from mandelbrot.model.evaluation import HEALTHY, DEGRADED, FAILED
+
+# health in increasing order of severity
+health_severity = {HEALTHY: 0, DEGRADED: 1, FAILED: 2}
+
+def parse_device_patterns(value):
+    """
+    Parse a list of device names or glob patterns separated by commas or
+    whitespace.  The value 'all' or '*' matches every device.
+
+    :param value:
+    :type value: str
+    :returns: The list of patterns, or None to match every device.
+    :rtype: list[str]
+    """
+    patterns = [p for p in re.split(r'[,\s]+', value.strip()) if p != '']
+    if len(patterns) == 0 or 'all' in patterns or '*' in patterns:
+        return None
+    return patterns
+
+def worst_health(healths):
+    """
+    :param healths:
+    :type healths: iterable[str]
+    :returns: The most severe health, or HEALTHY if there are none.
+    :rtype: str
+    """
+    worst = HEALTHY
+    for health in healths:
+        if health_severity[health] > health_severity[worst]:
+            worst = health
+    return worst
+
+class DeviceCounters(object):
+    """
+    Computes per-second rates for a set of counters on many devices at
+    once.  The counters for all selected devices are packed into a single
+    flat array of doubles, so the check context stays compact, and the
+    deltas for every device and field are computed in one pass over the
+    current and previous arrays.
+    """
+    def __init__(self, fields, patterns=None):
+        """
+        :param fields: The names of the counter fields, in packing order
+        :type fields: list[str]
+        :param patterns: The device names or glob patterns to select, or
+          None to select every device
+        :type patterns: list[str]
+        """
+        self.fields = tuple(fields)
+        self.patterns = patterns
+
+    def select(self, counters):
+        """
+        :param counters: Per-device counters, as returned by psutil
+        :type counters: dict[str,object]
+        :returns: The sorted names of the selected devices.
+        :rtype: list[str]
+        """
+        if self.patterns is None:
+            return sorted(counters)
+        return sorted([device for device in counters
+                       if any([fnmatch.fnmatchcase(device, p) for p in self.patterns])])
+
+    def pack(self, devices, counters):
+        """
+        :returns: The counters of each device packed into a flat array.
+        :rtype: array.array
+        """
+        values = array.array('d')
+        for device in devices:
+            device_counters = counters[device]
+            values.extend([getattr(device_counters, field) for field in self.fields])
+        return values
+
+    def make_context(self, counters, timestamp):
+        """
+        :returns: The initial check context.
+        :rtype: dict
+        """
+        devices = self.select(counters)
+        return {'devices': devices, 'values': self.pack(devices, counters), 'timestamp': timestamp}
+
+    def update(self, context, counters, timestamp):
+        """
+        Compute the per-second rate of each counter since the previous
+        update, and store the current counters in the context.  A device
+        which did not exist at the previous update has rates of 0, and a
+        counter which decreased (because it wrapped or the device was
+        reset) has a rate of 0.
+
+        :param context:
+        :type context: dict
+        :param counters: Per-device counters, as returned by psutil
+        :type counters: dict[str,object]
+        :param timestamp:
+        :type timestamp: float
+        :returns: A tuple containing the device names and the flat array of rates.
+        :rtype: (list[str], array.array)
+        """
+        nfields = len(self.fields)
+        devices = self.select(counters)
+        values = self.pack(devices, counters)
+        previous = context['values']
+        if context['devices'] != devices:
+            # realign the previous values with the current devices
+            offsets = dict([(device, n * nfields) for n,device in enumerate(context['devices'])])
+            realigned = array.array('d')
+            for n,device in enumerate(devices):
+                if device in offsets:
+                    offset = offsets[device]
+                    realigned.extend(previous[offset:offset + nfields])
+                else:
+                    realigned.extend(values[n * nfields:(n + 1) * nfields])
+            previous = realigned
+        duration = timestamp - context['timestamp']
+        if duration > 0.0:
+            rates = array.array('d', [max(v - p, 0.0) / duration for v,p in zip(values, previous)])
+        else:
+            rates = array.array('d', bytes(8 * len(values)))
+        context.update(devices=devices, values=values, timestamp=timestamp)
+        return devices, rates
+
+    def iter_rates(self, devices, rates):
+        """
+        :returns: A generator of (device, rates) tuples, where rates is a
+          dict mapping each field to its rate.
+        """
+        nfields = len(self.fields)
+        for n,device in enumerate(devices):
+            yield device, dict(zip(self.fields, rates[n * nfields:(n + 1) * nfields]))
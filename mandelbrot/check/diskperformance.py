@@ -15,37 +15,54 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import time
 import psutil
 import cifparser
 
-from mandelbrot.check import Check
+from mandelbrot.check import Check, EXECUTION_INLINE
+from mandelbrot.check.sampling import sample
+from mandelbrot.check.counters import DeviceCounters, parse_device_patterns, worst_health
 from mandelbrot.model.evaluation import *
 
+# the disk counters which are packed for each device
+disk_fields = ('read_count', 'write_count', 'read_bytes', 'write_bytes', 'read_time', 'write_time')
+
 class DiskPerformance(Check):
     """
-    Check system disk performance.
+    Check system disk performance.  If 'disk devices' is specified as a
+    list of device names or glob patterns, or 'all', then every matching
+    device is checked in a single evaluation, and the health is that of
+    the worst device.
 
     Parameters:
     disk device                   = PATH: path
+    disk devices                  = DEVICES: str
     read rate failed threshold    = USAGE: throughput
     read rate degraded threshold  = USAGE: throughput
     write rate failed threshold   = USAGE: throughput
     write rate degraded threshold = USAGE: throughput
     """
+
+    default_execution_class = EXECUTION_INLINE
+
     def get_behavior_type(self):
         return "io.mandelbrot.core.check.ScalarCheck"
 
     def get_behavior(self):
         return {}
 
-    def _disk_io_counters(self):
+    def _sample_disk_io_counters(self):
         if self.device is not None:
-            return psutil.disk_io_counters(perdisk=True)[self.device]
-        return psutil.disk_io_counters(perdisk=False)
+            counters, timestamp = sample(psutil.disk_io_counters, perdisk=True)
+            return counters[self.device], timestamp
+        return sample(psutil.disk_io_counters, perdisk=False)
 
     def init(self):
         self.device = self.ns.get_str_or_default(cifparser.ROOT_PATH, "disk device")
+        devices = self.ns.get_str_or_default(cifparser.ROOT_PATH, "disk devices")
+        if devices is not None:
+            self.device_counters = DeviceCounters(disk_fields, parse_device_patterns(devices))
+        else:
+            self.device_counters = None
         self.read_rate_degraded = self.ns.get_throughput_or_default(cifparser.ROOT_PATH,
             "read rate degraded threshold")
         self.read_rate_failed = self.ns.get_throughput_or_default(cifparser.ROOT_PATH,
@@ -54,20 +71,71 @@ class DiskPerformance(Check):
             "write rate degraded threshold")
         self.write_rate_failed = self.ns.get_throughput_or_default(cifparser.ROOT_PATH,
             "write rate failed threshold")
-        context = self._disk_io_counters()._asdict()
-        context['timestamp'] = time.time()
+        if self.device_counters is not None:
+            return self.device_counters.make_context(*sample(psutil.disk_io_counters, perdisk=True))
+        # the baseline comes from the sample cache, so it is never newer than
+        # the sample taken by the first execution
+        counters, timestamp = self._sample_disk_io_counters()
+        context = counters._asdict()
+        context['timestamp'] = timestamp
         return context
 
+    def _get_health(self, read_count_s, write_count_s):
+        if self.read_rate_failed is not None and read_count_s > self.read_rate_failed:
+            return FAILED
+        if self.write_rate_failed is not None and write_count_s > self.write_rate_failed:
+            return FAILED
+        if self.read_rate_degraded is not None and read_count_s > self.read_rate_degraded:
+            return DEGRADED
+        if self.write_rate_degraded is not None and write_count_s > self.write_rate_degraded:
+            return DEGRADED
+        return HEALTHY
+
+    def _execute_devices(self, evaluation, context):
+        counters, timestamp = sample(psutil.disk_io_counters, perdisk=True)
+        devices, rates = self.device_counters.update(context, counters, timestamp)
+        healths = []
+        busiest = None
+        for device,rate in self.device_counters.iter_rates(devices, rates):
+            read_pct = rate['read_time'] * 100.0
+            write_pct = rate['write_time'] * 100.0
+            evaluation.set_metric(device + '.read_count', rate['read_count'])
+            evaluation.set_metric(device + '.write_count', rate['write_count'])
+            evaluation.set_metric(device + '.read_bytes', rate['read_bytes'])
+            evaluation.set_metric(device + '.write_bytes', rate['write_bytes'])
+            evaluation.set_metric(device + '.read_time', read_pct)
+            evaluation.set_metric(device + '.write_time', write_pct)
+            healths.append(self._get_health(rate['read_count'], rate['write_count']))
+            if busiest is None or read_pct + write_pct > busiest[1]['read_time'] + busiest[1]['write_time']:
+                busiest = (device, rate)
+        if busiest is None:
+            evaluation.set_summary("no disk devices match")
+            evaluation.set_health(UNKNOWN)
+            return
+        device, rate = busiest
+        evaluation.set_summary(
+            "%i devices, busiest is %s with %.1f%% reads, %i reads/s (%.1f M/s), %.1f%% writes, %i writes/s (%.1f M/s)" % (
+            len(devices), device, rate['read_time'] * 100.0, rate['read_count'], rate['read_bytes'] / 1048576,
+            rate['write_time'] * 100.0, rate['write_count'], rate['write_bytes'] / 1048576))
+        evaluation.set_health(worst_health(healths))
+
     def execute(self, evaluation, context):
-        counters = self._disk_io_counters()._asdict()
-        timestamp = time.time()
+        if self.device_counters is not None:
+            return self._execute_devices(evaluation, context)
+        counters, timestamp = self._sample_disk_io_counters()
+        counters = counters._asdict()
         duration = timestamp - context['timestamp']
-        read_count_s = (counters['read_count'] - context['read_count']) / duration
-        write_count_s = (counters['write_count'] - context['write_count']) / duration
-        read_bytes_s = (counters['read_bytes'] - context['read_bytes']) / duration
-        write_bytes_s = (counters['write_bytes'] - context['write_bytes']) / duration
-        read_pct = ((counters['read_time'] - context['read_time']) * 100.0) / duration
-        write_pct = ((counters['write_time'] - context['write_time']) * 100.0) / duration
+        # without a newer sample there is no interval to compute rates over
+        if duration > 0.0:
+            read_count_s = (counters['read_count'] - context['read_count']) / duration
+            write_count_s = (counters['write_count'] - context['write_count']) / duration
+            read_bytes_s = (counters['read_bytes'] - context['read_bytes']) / duration
+            write_bytes_s = (counters['write_bytes'] - context['write_bytes']) / duration
+            read_pct = ((counters['read_time'] - context['read_time']) * 100.0) / duration
+            write_pct = ((counters['write_time'] - context['write_time']) * 100.0) / duration
+        else:
+            read_count_s = write_count_s = read_bytes_s = write_bytes_s = 0.0
+            read_pct = write_pct = 0.0
         context.update(counters, timestamp=timestamp)
         if self.device is not None:
             evaluation.set_summary(
@@ -78,13 +146,4 @@ class DiskPerformance(Check):
             evaluation.set_summary(
                 "%.1f%% reads, %i reads/s (%.1f M/s), %.1f%% writes, %i writes/s (%.1f M/s) across all devices" % (
                     read_pct, read_count_s, read_bytes_s / 1048576, write_pct, write_count_s, write_bytes_s / 1048576))
-        if self.read_rate_failed is not None and read_count_s > self.read_rate_failed:
-            evaluation.set_health(FAILED)
-        elif self.write_rate_failed is not None and write_count_s > self.write_rate_failed:
-            evaluation.set_health(FAILED)
-        elif self.read_rate_degraded is not None and read_count_s > self.read_rate_degraded:
-            evaluation.set_health(DEGRADED)
-        elif self.write_rate_degraded is not None and write_count_s > self.write_rate_degraded:
-            evaluation.set_health(DEGRADED)
-        else:
-            evaluation.set_health(HEALTHY)
+        evaluation.set_health(self._get_health(read_count_s, write_count_s))
@@ -18,7 +18,7 @@
 import psutil
 import cifparser
 
-from mandelbrot.check import Check
+from mandelbrot.check import Check, EXECUTION_PROCESS
 from mandelbrot.model.evaluation import *
 
 class DiskUtilization(Check):
@@ -30,6 +30,9 @@ class DiskUtilization(Check):
     disk degraded threshold = USAGE: size
     disk failed threshold   = USAGE: size
     """
+
+    default_execution_class = EXECUTION_PROCESS
+
     def get_behavior_type(self):
         return "io.mandelbrot.core.check.ScalarCheck"
 
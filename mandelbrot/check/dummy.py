@@ -15,12 +15,15 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-from mandelbrot.check import Check
+from mandelbrot.check import Check, EXECUTION_INLINE
 from mandelbrot.model.evaluation import HEALTHY
 
 class AlwaysHealthy(Check):
     """
     """
+
+    default_execution_class = EXECUTION_INLINE
+
     def get_behavior_type(self):
         return "io.mandelbrot.core.check.ScalarCheck"
 
@@ -15,37 +15,55 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import time
 import psutil
 import cifparser
 
-from mandelbrot.check import Check
+from mandelbrot.check import Check, EXECUTION_INLINE
+from mandelbrot.check.sampling import sample
+from mandelbrot.check.counters import DeviceCounters, parse_device_patterns, worst_health
 from mandelbrot.model.evaluation import *
 
+# the interface counters which are packed for each device
+net_fields = ('bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv',
+              'errin', 'errout', 'dropin', 'dropout')
+
 class NetPerformance(Check):
     """
-    Check system network performance.
+    Check system network performance.  If 'net devices' is specified as a
+    list of interface names or glob patterns, or 'all', then every matching
+    interface is checked in a single evaluation, and the health is that of
+    the worst interface.
 
     Parameters:
     net device                       = DEVICE: str
+    net devices                      = DEVICES: str
     tx throughput failed threshold   = USAGE: int
     tx throughput degraded threshold = USAGE: int
     rx throughput failed threshold   = USAGE: int
     rx throughput degraded threshold = USAGE: int
     """
+
+    default_execution_class = EXECUTION_INLINE
+
     def get_behavior_type(self):
         return "io.mandelbrot.core.check.ScalarCheck"
 
     def get_behavior(self):
         return {}
 
-    def _net_io_counters(self):
+    def _sample_net_io_counters(self):
         if self.device is not None:
-            return psutil.net_io_counters(pernic=True)[self.device]
-        return psutil.net_io_counters(pernic=False)
+            counters, timestamp = sample(psutil.net_io_counters, pernic=True)
+            return counters[self.device], timestamp
+        return sample(psutil.net_io_counters, pernic=False)
 
     def init(self):
         self.device = self.ns.get_str_or_default(cifparser.ROOT_PATH, "net device")
+        devices = self.ns.get_str_or_default(cifparser.ROOT_PATH, "net devices")
+        if devices is not None:
+            self.device_counters = DeviceCounters(net_fields, parse_device_patterns(devices))
+        else:
+            self.device_counters = None
         self.tx_thru_degraded = self.ns.get_throughput_or_default(cifparser.ROOT_PATH,
             "tx throughput degraded threshold")
         self.tx_thru_failed = self.ns.get_throughput_or_default(cifparser.ROOT_PATH,
@@ -54,22 +72,63 @@ class NetPerformance(Check):
             "rx throughput degraded threshold")
         self.rx_thru_failed = self.ns.get_throughput_or_default(cifparser.ROOT_PATH,
             "rx throughput failed threshold")
-        context = self._net_io_counters()._asdict()
-        context['timestamp'] = time.time()
+        if self.device_counters is not None:
+            return self.device_counters.make_context(*sample(psutil.net_io_counters, pernic=True))
+        # the baseline comes from the sample cache, so it is never newer than
+        # the sample taken by the first execution
+        counters, timestamp = self._sample_net_io_counters()
+        context = counters._asdict()
+        context['timestamp'] = timestamp
         return context
 
+    def _get_health(self, bytes_sent_s, bytes_recv_s):
+        if self.tx_thru_failed is not None and bytes_sent_s > self.tx_thru_failed:
+            return FAILED
+        if self.rx_thru_failed is not None and bytes_recv_s > self.rx_thru_failed:
+            return FAILED
+        if self.tx_thru_degraded is not None and bytes_sent_s > self.tx_thru_degraded:
+            return DEGRADED
+        if self.rx_thru_degraded is not None and bytes_recv_s > self.rx_thru_degraded:
+            return DEGRADED
+        return HEALTHY
+
+    def _execute_devices(self, evaluation, context):
+        counters, timestamp = sample(psutil.net_io_counters, pernic=True)
+        devices, rates = self.device_counters.update(context, counters, timestamp)
+        healths = []
+        busiest = None
+        for device,rate in self.device_counters.iter_rates(devices, rates):
+            for field in net_fields:
+                evaluation.set_metric(device + '.' + field, rate[field])
+            healths.append(self._get_health(rate['bytes_sent'], rate['bytes_recv']))
+            throughput = rate['bytes_sent'] + rate['bytes_recv']
+            if busiest is None or throughput > busiest[1]['bytes_sent'] + busiest[1]['bytes_recv']:
+                busiest = (device, rate)
+        if busiest is None:
+            evaluation.set_summary("no net devices match")
+            evaluation.set_health(UNKNOWN)
+            return
+        device, rate = busiest
+        evaluation.set_summary(
+            "%i devices, busiest is %s with %.1f M/s Tx (%.1f packets/s), %.1f M/s Rx (%.1f packets/s)" % (
+            len(devices), device, rate['bytes_sent'] / 1048576, rate['packets_sent'],
+            rate['bytes_recv'] / 1048576, rate['packets_recv']))
+        evaluation.set_health(worst_health(healths))
+
     def execute(self, evaluation, context):
-        counters = self._net_io_counters()._asdict()
-        timestamp = time.time()
+        if self.device_counters is not None:
+            return self._execute_devices(evaluation, context)
+        counters, timestamp = self._sample_net_io_counters()
+        counters = counters._asdict()
         duration = timestamp - context['timestamp']
-        bytes_sent_s = (counters['bytes_sent'] - context['bytes_sent']) / duration
-        bytes_recv_s = (counters['bytes_recv'] - context['bytes_recv']) / duration
-        packets_sent_s = (counters['packets_sent'] - context['packets_sent']) / duration
-        packets_recv_s = (counters['packets_recv'] - context['packets_recv']) / duration
-        errin_s = (counters['errin'] - context['errin']) / duration
-        errout_s = (counters['errout'] - context['errout']) / duration
-        dropin_s = (counters['dropin'] - context['dropin']) / duration
-        dropout_s = (counters['dropout'] - context['dropout']) / duration
+        # without a newer sample there is no interval to compute rates over
+        if duration > 0.0:
+            bytes_sent_s = (counters['bytes_sent'] - context['bytes_sent']) / duration
+            bytes_recv_s = (counters['bytes_recv'] - context['bytes_recv']) / duration
+            packets_sent_s = (counters['packets_sent'] - context['packets_sent']) / duration
+            packets_recv_s = (counters['packets_recv'] - context['packets_recv']) / duration
+        else:
+            bytes_sent_s = bytes_recv_s = packets_sent_s = packets_recv_s = 0.0
         context.update(counters, timestamp=timestamp)
         if self.device is not None:
             evaluation.set_summary(
@@ -80,13 +139,4 @@ class NetPerformance(Check):
             evaluation.set_summary(
                 "%.1f M/s Tx (%.1f packets/s), %.1f M/s Rx (%.1f packets/s) across all devices" % (
                     bytes_sent_s / 1048576, packets_sent_s, bytes_recv_s / 1048576, packets_recv_s))
-        if self.tx_thru_failed is not None and bytes_sent_s > self.tx_thru_failed:
-            evaluation.set_health(FAILED)
-        elif self.rx_thru_failed is not None and bytes_recv_s > self.rx_thru_failed:
-            evaluation.set_health(FAILED)
-        elif self.tx_thru_degraded is not None and bytes_sent_s > self.tx_thru_degraded:
-            evaluation.set_health(DEGRADED)
-        elif self.rx_thru_degraded is not None and bytes_recv_s > self.rx_thru_degraded:
-            evaluation.set_health(DEGRADED)
-        else:
-            evaluation.set_health(HEALTHY)
+        evaluation.set_health(self._get_health(bytes_sent_s, bytes_recv_s))
@@ -15,11 +15,11 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import re
 import psutil
 import cifparser
 
 from mandelbrot.check import Check
+from mandelbrot.check.processindex import ProcessInfo, ProcessMatcher, process_attrs, get_process_index
 
 class ProcessCheck(Check):
     """
@@ -37,38 +37,31 @@ class ProcessCheck(Check):
     process owner matches     = OWNER: str
     """
     def _matches_process(self, p):
-        if self.namematches is not None and not re.match(self.namematches, p.name()):
-            return False
-        if self.exematches is not None and not re.match(self.exematches, p.exe()):
-            return False
-        if self.cmdlinematches is not None and not re.match(self.cmdlinematches, p.cmdline()):
-            return False
-        if self.ownermatches is not None and not re.match(self.ownermatches, p.username()):
-            return False
-        return True
+        info = ProcessInfo(p, **p.as_dict(attrs=process_attrs, ad_value=None))
+        return self.matcher.matches(info)
 
     def get_process(self, context):
         pid = context.get('pid')
         created = context.get('created')
         # check if the pid from context is the same incarnation
         if pid is not None and created is not None:
-            p = psutil.Process(pid)
-            if p.create_time() == created:
-                return p
+            try:
+                p = psutil.Process(pid)
+                if p.create_time() == created:
+                    return p
+            except psutil.NoSuchProcess:
+                pass
         # if pidfile is specified, then read the pid
         if self.pidfile is not None:
             with open(self.pidfile, 'r') as f:
                 p = psutil.Process(int(f.read().strip()))
             if self._matches_process(p):
                 return p
-        # otherwise iterate through all processes to find a single match
-        process = None
-        for p in psutil.process_iter():
-            if self._matches_process(p):
-                if process is not None:
-                    raise Exception("process is not unique")
-                process = p
-        return process
+        # otherwise find a single match in the shared process index
+        processes = get_process_index().find(self.matcher)
+        if len(processes) > 1:
+            raise Exception("process is not unique")
+        return processes[0] if len(processes) > 0 else None
 
     def init(self):
         self.pidfile = self.ns.get_str_or_default(cifparser.ROOT_PATH, "process pid file")
@@ -84,4 +77,6 @@ class ProcessCheck(Check):
             self.cmdlinematches is None and
             self.ownermatches is None):
             raise Exception("either 'process pid file' or 'process matches' parameter is required")
+        self.matcher = ProcessMatcher(self.namematches, self.exematches,
+            self.cmdlinematches, self.ownermatches)
         return None
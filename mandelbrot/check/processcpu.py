@@ -19,6 +19,7 @@ import time
 import psutil
 import cifparser
 
+from mandelbrot.check import EXECUTION_THREAD
 from mandelbrot.check.process import ProcessCheck
 from mandelbrot.model.evaluation import *
 
@@ -37,6 +38,9 @@ class ProcessCPU(ProcessCheck):
     process cmdline matches   = CMDLINE: str
     process owner matches     = OWNER: str
     """
+
+    default_execution_class = EXECUTION_THREAD
+
     def get_behavior_type(self):
         return "io.mandelbrot.core.check.ScalarCheck"
 
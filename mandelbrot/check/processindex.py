@@ -0,0 +1,187 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import threading
+import time
+import psutil
+
+# the number of seconds between scans of the process table
+default_ttl = 0.25
+
+# the process attributes which may be matched
+process_attrs = ['name', 'exe', 'cmdline', 'username', 'create_time']
+
+class ProcessInfo(object):
+    """
+    The attributes of a single process incarnation, read once when the
+    process is first seen.
+    """
+    def __init__(self, process, name, exe, cmdline, username, create_time):
+        """
+        :param process:
+        :type process: psutil.Process
+        """
+        self.process = process
+        self.name = name or ''
+        self.exe = exe or ''
+        self.cmdline = ' '.join(cmdline or [])
+        self.username = username or ''
+        self.create_time = create_time
+
+    @property
+    def key(self):
+        return (self.process.pid, self.create_time)
+
+class ProcessMatcher(object):
+    """
+    Matches processes using precompiled patterns.  The result for each
+    process incarnation is remembered, so each process is matched against
+    the patterns only once.
+    """
+    def __init__(self, name=None, exe=None, cmdline=None, username=None):
+        """
+        :param name: A regular expression which must match the process name
+        :type name: str
+        :param exe: A regular expression which must match the process executable
+        :type exe: str
+        :param cmdline: A regular expression which must match the process
+          command line, with arguments separated by spaces
+        :type cmdline: str
+        :param username: A regular expression which must match the process owner
+        :type username: str
+        """
+        self.patterns = []
+        for attr,pattern in (('name', name), ('exe', exe), ('cmdline', cmdline), ('username', username)):
+            if pattern is not None:
+                self.patterns.append((attr, re.compile(pattern)))
+        self.results = {}
+
+    def matches(self, info):
+        """
+        :param info:
+        :type info: ProcessInfo
+        :rtype: bool
+        """
+        key = info.key
+        result = self.results.get(key)
+        if result is None:
+            result = all([pattern.match(getattr(info, attr)) is not None
+                          for attr,pattern in self.patterns])
+            self.results[key] = result
+        return result
+
+    def prune(self, keys):
+        """
+        Forget the results for processes which no longer exist.
+
+        :param keys: The keys of the processes which exist
+        :type keys: set
+        """
+        self.results = dict([(k,v) for k,v in self.results.items() if k in keys])
+
+class ProcessIndex(object):
+    """
+    An index of the process table which is shared by all process checks.
+    The index is refreshed at most once every ttl seconds, and each refresh
+    only reads the attributes of pids which were not in the previous scan,
+    or whose create time changed because the pid was reused, so the cost of
+    a refresh is mostly proportional to the number of new processes.
+    """
+    def __init__(self, ttl=default_ttl):
+        """
+        :param ttl:
+        :type ttl: float
+        """
+        self.ttl = ttl
+        self.processes = {}
+        self.expires = None
+        self.lock = threading.Lock()
+
+    def _inspect(self, pid):
+        try:
+            process = psutil.Process(pid)
+            attrs = process.as_dict(attrs=process_attrs, ad_value=None)
+            return ProcessInfo(process, **attrs)
+        except psutil.NoSuchProcess:
+            return None
+
+    def refresh(self):
+        """
+        Scan the process table if the index has expired.
+        """
+        now = time.monotonic()
+        if self.expires is not None and now < self.expires:
+            return
+        pids = psutil.pids()
+        processes = {}
+        for pid in pids:
+            info = self.processes.get(pid)
+            if info is not None:
+                # the pid may have been reused by a new process since the last scan
+                try:
+                    if psutil.Process(pid).create_time() != info.create_time:
+                        info = None
+                except psutil.NoSuchProcess:
+                    continue
+            if info is None:
+                info = self._inspect(pid)
+            if info is not None:
+                processes[pid] = info
+        self.processes = processes
+        self.expires = now + self.ttl
+
+    def find(self, matcher):
+        """
+        Return the processes which match.
+
+        :param matcher:
+        :type matcher: ProcessMatcher
+        :rtype: list[psutil.Process]
+        """
+        with self.lock:
+            self.refresh()
+            matches = []
+            for pid,info in list(self.processes.items()):
+                if not matcher.matches(info):
+                    continue
+                # a pid may have been reused since it was inspected, so
+                # verify the incarnation before returning it
+                try:
+                    if psutil.Process(pid).create_time() != info.create_time:
+                        raise psutil.NoSuchProcess(pid)
+                except psutil.NoSuchProcess:
+                    info = self._inspect(pid)
+                    if info is None:
+                        del self.processes[pid]
+                        continue
+                    self.processes[pid] = info
+                    if not matcher.matches(info):
+                        continue
+                matches.append(info.process)
+            if len(matcher.results) > len(self.processes):
+                matcher.prune(set([info.key for info in self.processes.values()]))
+            return matches
+
+_index = ProcessIndex()
+
+def get_process_index():
+    """
+    :returns: The process index shared by all checks in this process.
+    :rtype: ProcessIndex
+    """
+    return _index
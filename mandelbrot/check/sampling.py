@@ -0,0 +1,85 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+# the number of seconds a sample is shared, which must be shorter than
+# the interval of any check using the sample
+default_ttl = 0.25
+
+class SampleCache(object):
+    """
+    Caches the results of probe functions, such as psutil.cpu_times, so
+    checks which fire in the same scheduling tick share a single snapshot.
+    Samples are keyed by the probe function and its arguments, and expire
+    after ttl seconds.  Concurrent callers of the same probe wait for the
+    first caller, so the probe is called once per tick.  The sampled values
+    are shared, so callers must not modify them.
+    """
+    def __init__(self, ttl=default_ttl):
+        """
+        :param ttl:
+        :type ttl: float
+        """
+        self.ttl = ttl
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def sample(self, probe, *args, **kwargs):
+        """
+        Return the cached result of the probe, calling the probe if there
+        is no cached result or the cached result has expired.
+
+        :param probe:
+        :type probe: callable
+        :returns: A tuple containing the result and the wall clock time
+          when the probe was called.
+        :rtype: (object, float)
+        """
+        key = (probe, args, tuple(sorted(kwargs.items())))
+        with self.lock:
+            now = time.monotonic()
+            sample = self.samples.get(key)
+            if sample is not None and now < sample[0]:
+                return sample[1], sample[2]
+            value = probe(*args, **kwargs)
+            timestamp = time.time()
+            self.samples[key] = (now + self.ttl, value, timestamp)
+            # discard expired samples so probes which are no longer used
+            # do not accumulate
+            for k in [k for k,s in self.samples.items() if s[0] <= now]:
+                del self.samples[k]
+            return value, timestamp
+
+    def clear(self):
+        with self.lock:
+            self.samples = {}
+
+_cache = SampleCache()
+
+def sample(probe, *args, **kwargs):
+    """
+    Return the result of the probe from the shared sample cache.
+
+    :param probe:
+    :type probe: callable
+    :returns: A tuple containing the result and the wall clock time when
+      the probe was called.
+    :rtype: (object, float)
+    """
+    return _cache.sample(probe, *args, **kwargs)
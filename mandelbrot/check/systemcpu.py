@@ -15,11 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
-import time
 import psutil
 import cifparser
 
-from mandelbrot.check import Check
+from mandelbrot.check import Check, EXECUTION_INLINE, make_metric
+from mandelbrot.model.constants import SourceType
+from mandelbrot.check.sampling import sample
 from mandelbrot.model.evaluation import *
 
 class SystemCPU(Check):
@@ -37,12 +38,19 @@ class SystemCPU(Check):
     idle degraded threshold   = IDLE: percentage
     extended summary          = EXTENDED: bool = false
     """
+
+    default_execution_class = EXECUTION_INLINE
+
     def get_behavior_type(self):
         return "io.mandelbrot.core.check.ScalarCheck"
 
     def get_behavior(self):
         return {}
 
+    def get_metrics(self):
+        return dict([(name, make_metric(SourceType.GAUGE, 'percent'))
+            for name in psutil.cpu_times()._fields])
+
     def init(self):
         self.userfailed = self.ns.get_percentage_or_default(cifparser.ROOT_PATH, "user failed threshold")
         self.userdegraded = self.ns.get_percentage_or_default(cifparser.ROOT_PATH, "user degraded threshold")
@@ -53,14 +61,21 @@ class SystemCPU(Check):
         self.idlefailed = self.ns.get_percentage_or_default(cifparser.ROOT_PATH, "idle failed threshold")
         self.idledegraded = self.ns.get_percentage_or_default(cifparser.ROOT_PATH, "idle degraded threshold")
         self.extended = self.ns.get_bool_or_default(cifparser.ROOT_PATH, "extended summary", False)
-        context = psutil.cpu_times()._asdict()
-        context['timestamp'] = time.time()
+        # the baseline comes from the sample cache, so it is never newer than
+        # the sample taken by the first execution
+        times, timestamp = sample(psutil.cpu_times)
+        context = times._asdict()
+        context['timestamp'] = timestamp
         return context
 
     def execute(self, evaluation, context):
-        times = psutil.cpu_times()._asdict()
-        timestamp = time.time()
+        times, timestamp = sample(psutil.cpu_times)
+        times = times._asdict()
         duration = timestamp - context['timestamp']
+        if duration <= 0.0:
+            evaluation.set_summary("CPU utilization is not sampled yet")
+            evaluation.set_health(UNKNOWN)
+            return
         pct = {}
         for key,value in times.items():
             pct[key] = ((value - context[key]) / duration) * 100.0
@@ -19,19 +19,30 @@ import os
 import psutil
 import cifparser
 
-from mandelbrot.check import Check
+from mandelbrot.check import Check, EXECUTION_INLINE, make_metric
+from mandelbrot.model.constants import SourceType
 from mandelbrot.model.evaluation import *
 
 class SystemLoad(Check):
     """
     Check system load.
     """
+
+    default_execution_class = EXECUTION_INLINE
+
     def get_behavior_type(self):
         return "io.mandelbrot.core.check.ScalarCheck"
 
     def get_behavior(self):
         return {}
 
+    def get_metrics(self):
+        return {
+            'load1': make_metric(SourceType.GAUGE, 'load'),
+            'load5': make_metric(SourceType.GAUGE, 'load'),
+            'load15': make_metric(SourceType.GAUGE, 'load'),
+            }
+
     def init(self):
         self.failed_1min = self.ns.get_float_or_default(cifparser.ROOT_PATH, "1min failed threshold")
         self.degraded_1min = self.ns.get_float_or_default(cifparser.ROOT_PATH, "1min degraded threshold")
@@ -18,7 +18,9 @@
 import psutil
 import cifparser
 
-from mandelbrot.check import Check
+from mandelbrot.check import Check, EXECUTION_INLINE, make_metric
+from mandelbrot.model.constants import SourceType
+from mandelbrot.check.sampling import sample
 from mandelbrot.model.evaluation import *
 
 class SystemMemory(Check):
@@ -31,12 +33,25 @@ class SystemMemory(Check):
     swap failed threshold     = USAGE: size
     swap degraded threshold   = USAGE: size
     """
+
+    default_execution_class = EXECUTION_INLINE
+
     def get_behavior_type(self):
         return "io.mandelbrot.core.check.ScalarCheck"
 
     def get_behavior(self):
         return {}
 
+    def get_metrics(self):
+        return {
+            'memavail': make_metric(SourceType.GAUGE, 'bytes'),
+            'memused': make_metric(SourceType.GAUGE, 'percent'),
+            'memtotal': make_metric(SourceType.GAUGE, 'bytes'),
+            'swapavail': make_metric(SourceType.GAUGE, 'bytes'),
+            'swapused': make_metric(SourceType.GAUGE, 'percent'),
+            'swaptotal': make_metric(SourceType.GAUGE, 'bytes'),
+            }
+
     def init(self):
         self.memoryfailed = self.ns.get_size_or_default(cifparser.ROOT_PATH, "memory failed threshold")
         self.memorydegraded = self.ns.get_size_or_default(cifparser.ROOT_PATH, "memory degraded threshold")
@@ -45,11 +60,11 @@ class SystemMemory(Check):
         return None
 
     def execute(self, evaluation, context):
-        memory = psutil.virtual_memory()
+        memory, _ = sample(psutil.virtual_memory)
         memavail = memory.available
         memused = memory.percent
         memtotal = memory.total
-        swap = psutil.swap_memory()
+        swap, _ = sample(psutil.swap_memory)
         swapavail = swap.total - swap.used
         swapused = swap.percent
         swaptotal = swap.total
@@ -0,0 +1,33 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import importlib
+
+def lazy_command(module_name):
+    """
+    Return a function which imports the subcommand module and runs its
+    run_command function.  The module is imported only when the subcommand
+    runs, so each command imports only the dependencies it needs.
+
+    :param module_name: The name of the subcommand module
+    :type module_name: str
+    :rtype: callable
+    """
+    def run_command(ns):
+        module = importlib.import_module(module_name)
+        return module.run_command(ns)
+    return run_command
@@ -19,53 +19,94 @@ import sys
 import argparse
 import traceback
 
-def main():
+from mandelbrot.command import lazy_command
+
+def make_parser():
     """
+    Create the argument parser.  Subcommand modules are not imported until
+    the subcommand runs.
+
+    :rtype: argparse.ArgumentParser
     """
-    try:
-        import mandelbrot.command.agent.init as init
-        import mandelbrot.command.agent.start as start
-        import mandelbrot.command.agent.status as status
-        import mandelbrot.command.agent.stop as stop
+    # create the top-level parser
+    parser = argparse.ArgumentParser(prog='mandelbrot')
+    parser.set_defaults(main=lambda ns: 0)
+    subparsers = parser.add_subparsers()
+
+    init_instance = subparsers.add_parser('init')
+    init_instance.set_defaults(main=lazy_command('mandelbrot.command.agent.init'))
+    init_instance.add_argument('-i', '--agent-id', metavar='NAME', dest='agent_id')
+    init_instance.add_argument('-m', '--manifest', metavar='PATH', dest='manifest_path')
+    init_instance.add_argument('-u', '--endpoint-url', metavar='URL', dest='endpoint_url')
+    init_instance.add_argument('-v', '--verbose', action='store_true')
+    init_instance.add_argument('path', metavar='PATH')
 
-        # create the top-level parser
-        parser = argparse.ArgumentParser(prog='mandelbrot')
-        parser.set_defaults(main=lambda ns: 0)
-        subparsers = parser.add_subparsers()
+    apply_manifest = subparsers.add_parser('apply')
+    apply_manifest.set_defaults(main=lazy_command('mandelbrot.command.agent.apply'))
+    apply_manifest.add_argument('-m', '--manifest', metavar='PATH', dest='manifest_path',
+                                help='Apply the manifest at PATH instead of the current manifest')
+    apply_manifest.add_argument('-n', '--dry-run', action='store_true', dest='dry_run',
+                                help='Report the changes without writing them')
+    apply_manifest.add_argument('--no-reload', action='store_true', dest='no_reload',
+                                help="Don't signal a running agent to reload its checks")
+    apply_manifest.add_argument('-v', '--verbose', action='store_true')
+    apply_manifest.add_argument('path', metavar='PATH')
 
-        init_instance = subparsers.add_parser('init')
-        init_instance.set_defaults(main=init.run_command)
-        init_instance.add_argument('-i', '--agent-id', metavar='NAME', dest='agent_id')
-        init_instance.add_argument('-m', '--manifest', metavar='PATH', dest='manifest_path')
-        init_instance.add_argument('-u', '--endpoint-url', metavar='URL', dest='endpoint_url')
-        init_instance.add_argument('-v', '--verbose', action='store_true')
-        init_instance.add_argument('path', metavar='PATH')
+    start_instance = subparsers.add_parser('start')
+    start_instance.set_defaults(main=lazy_command('mandelbrot.command.agent.start'))
+    start_instance.add_argument('-p', '--pool-workers', metavar='NUM', dest='pool_workers',
+                                default='auto', help="Size of the check worker pools, or 'auto'")
+    start_instance.add_argument('-t', '--transport-workers', metavar='NUM', dest='transport_workers',
+                                default='auto', help="Size of the transport worker pool, or 'auto'")
+    start_instance.add_argument('-b', '--batch-size', metavar='NUM', dest='batch_size',
+                                type=int, default=1, help='Submit evaluations in batches of at most NUM')
+    start_instance.add_argument('-w', '--batch-window', metavar='SECONDS', dest='batch_window',
+                                type=float, default=1.0, help='Submit incomplete batches after SECONDS')
+    start_instance.add_argument('-s', '--spool-size', metavar='SIZE', dest='spool_size',
+                                default='64 megabytes', help='Limit the evaluation spool to SIZE')
+    start_instance.add_argument('-r', '--retry-attempts', metavar='NUM', dest='retry_attempts',
+                                type=int, default=3, help='Attempt each failed request at most NUM times')
+    start_instance.add_argument('--max-in-flight', metavar='NUM', dest='max_in_flight',
+                                default='auto', help="Limit submissions in flight to NUM, or 'auto'")
+    start_instance.add_argument('--positional-metrics', action='store_true', dest='positional_metrics',
+                                help='Submit registered metrics as a positional vector')
+    start_instance.add_argument('--compression', metavar='ENCODING', dest='compression',
+                                choices=['none', 'gzip', 'zstd'], default='none',
+                                help='Compress request bodies using ENCODING')
+    start_instance.add_argument('--compression-threshold', metavar='SIZE', dest='compression_threshold',
+                                default='1 kilobyte', help='Compress request bodies of at least SIZE')
+    start_instance.add_argument('--codecs', metavar='NAMES', dest='codecs', default='auto',
+                                help="Offer the comma separated codecs NAMES to the server, or 'auto'")
+    start_instance.add_argument('--stats-interval', metavar='SECONDS', dest='stats_interval',
+                                type=float, default=300.0, help='Log agent stats every SECONDS')
+    start_instance.add_argument('-l', '--log-file', metavar='PATH', dest='log_file',
+                                help='Log to the specified file')
+    start_instance.add_argument('--log-level', metavar='LEVEL', dest='log_level',
+                                choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'], default='INFO',
+                                help='Log at the specified level')
+    start_instance.add_argument('-f', '--foreground', action='store_true', dest='foreground',
+                                help='Run agent process in the foreground')
+    start_instance.add_argument('-d', '--debug', action='store_true', dest='debug',
+                                help='Log at DEBUG level and write to stdout')
+    start_instance.add_argument('path', metavar='PATH')
 
-        start_instance = subparsers.add_parser('start')
-        start_instance.set_defaults(main=start.run_command)
-        start_instance.add_argument('-p', '--pool-workers', metavar='NUM', dest='pool_workers',
-                                    type=int, default=10, help='Size of the check worker pool')
-        start_instance.add_argument('-l', '--log-file', metavar='PATH', dest='log_file',
-                                    help='Log to the specified file')
-        start_instance.add_argument('--log-level', metavar='LEVEL', dest='log_level',
-                                    choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'], default='INFO',
-                                    help='Log at the specified level')
-        start_instance.add_argument('-f', '--foreground', action='store_true', dest='foreground',
-                                    help='Run agent process in the foreground')
-        start_instance.add_argument('-d', '--debug', action='store_true', dest='debug',
-                                    help='Log at DEBUG level and write to stdout')
-        start_instance.add_argument('path', metavar='PATH')
+    instance_status = subparsers.add_parser('status')
+    instance_status.set_defaults(main=lazy_command('mandelbrot.command.agent.status'))
+    instance_status.add_argument('-v', '--verbose', action='store_true')
+    instance_status.add_argument('path', metavar='PATH')
 
-        instance_status = subparsers.add_parser('status')
-        instance_status.set_defaults(main=status.run_command)
-        instance_status.add_argument('-v', '--verbose', action='store_true')
-        instance_status.add_argument('path', metavar='PATH')
+    stop_instance = subparsers.add_parser('stop')
+    stop_instance.set_defaults(main=lazy_command('mandelbrot.command.agent.stop'))
+    stop_instance.add_argument('-v', '--verbose', action='store_true')
+    stop_instance.add_argument('path', metavar='PATH')
 
-        stop_instance = subparsers.add_parser('stop')
-        stop_instance.set_defaults(main=stop.run_command)
-        stop_instance.add_argument('-v', '--verbose', action='store_true')
-        stop_instance.add_argument('path', metavar='PATH')
+    return parser
 
+def main():
+    """
+    """
+    try:
+        parser = make_parser()
         ns = parser.parse_args()
         return ns.main(ns)
 
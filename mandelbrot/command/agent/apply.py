@@ -0,0 +1,111 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pathlib
+import urllib.parse
+import urllib.request
+import logging
+import psutil
+import signal
+import errno
+
+from mandelbrot.instance import open_instance, diff_instance_checks
+from mandelbrot.manifest import load_manifest
+from mandelbrot.log import utility_format
+
+def run_command(ns):
+    """
+    """
+    if ns.verbose == True:
+        logging.basicConfig(level=logging.DEBUG, format=utility_format)
+    else:
+        logging.basicConfig(level=logging.INFO, format=utility_format)
+    log = logging.getLogger('mandelbrot')
+
+    instance_path = pathlib.Path(ns.path)
+    if not instance_path.is_dir():
+        print("no agent exists at {0}".format(ns.path))
+        return 2
+    instance = open_instance(instance_path)
+
+    with instance.lock():
+
+        # if no manifest is specified, then reread the manifest the instance was created with
+        manifest_path = ns.manifest_path
+        if manifest_path is None:
+            manifest_url = urllib.parse.urlparse(instance.get_manifest_url())
+            if manifest_url.scheme != 'file':
+                print("agent {0} manifest {1} is not a file".format(ns.path, manifest_url.geturl()))
+                return 2
+            manifest_path = urllib.request.url2pathname(manifest_url.path)
+        manifest = load_manifest(manifest_path)
+
+        # compare the manifest with the instance
+        current_checks = {}
+        for instance_check in instance.list_checks():
+            current_checks[instance_check.check_id] = instance_check
+        manifest_checks = {}
+        for instance_check in manifest.checks:
+            manifest_checks[instance_check.check_id] = instance_check
+        added,removed,changed = diff_instance_checks(current_checks, manifest_checks)
+        current_metadata = dict(instance.list_metadata())
+        removed_metadata = sorted([meta_name for meta_name in current_metadata
+            if meta_name not in manifest.metadata])
+        metadata = {}
+        for meta_name,meta_value in manifest.metadata.items():
+            if current_metadata.get(meta_name) != meta_value:
+                metadata[meta_name] = meta_value
+        manifest_url = manifest.manifest_url
+        if manifest_url == instance.get_manifest_url():
+            manifest_url = None
+
+        print("{0} checks added, {1} removed, {2} changed; {3} meta values set, {4} removed".format(
+            len(added), len(removed), len(changed), len(metadata), len(removed_metadata)))
+        for check_id in added:
+            log.debug("add check %s", check_id)
+        for check_id in removed:
+            log.debug("remove check %s", check_id)
+        for check_id in changed:
+            log.debug("change check %s", check_id)
+        if ns.dry_run:
+            return 0
+        if not (added or removed or changed or metadata or removed_metadata or manifest_url):
+            return 0
+
+        # write only the changes, in a single transaction
+        checks = [manifest_checks[check_id] for check_id in added + changed]
+        instance.bulk_update(manifest_url=manifest_url, metadata=metadata, checks=checks,
+            removed_metadata=removed_metadata, removed_checks=removed)
+
+    if ns.no_reload:
+        return 0
+
+    # signal a running agent to reload its checks
+    try:
+        pidfile = os.path.join(ns.path, 'agent.pid')
+        with open(pidfile, 'r') as f:
+            pid = int(f.read())
+        if not psutil.pid_exists(pid):
+            return 0
+        os.kill(pid, signal.SIGHUP)
+        log.debug("sent SIGHUP to pid %s", pid)
+        return 0
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return 0
+        raise
@@ -60,6 +60,17 @@ def run_command(ns):
     values = cifparser.ValueTree()
     values.put_container('mandelbrot.agent')
     values.put_field('mandelbrot.agent', 'pool workers', str(ns.pool_workers))
+    values.put_field('mandelbrot.agent', 'transport workers', str(ns.transport_workers))
+    values.put_field('mandelbrot.agent', 'batch size', str(ns.batch_size))
+    values.put_field('mandelbrot.agent', 'batch window', str(ns.batch_window))
+    values.put_field('mandelbrot.agent', 'spool size', ns.spool_size)
+    values.put_field('mandelbrot.agent', 'retry attempts', str(ns.retry_attempts))
+    values.put_field('mandelbrot.agent', 'max in flight', str(ns.max_in_flight))
+    values.put_field('mandelbrot.agent', 'positional metrics', str(ns.positional_metrics))
+    values.put_field('mandelbrot.agent', 'request compression', ns.compression)
+    values.put_field('mandelbrot.agent', 'compression threshold', ns.compression_threshold)
+    values.put_field('mandelbrot.agent', 'request codecs', ns.codecs)
+    values.put_field('mandelbrot.agent', 'stats interval', str(ns.stats_interval))
     settings = cifparser.Namespace(values)
 
     supervisor = Supervisor(ns.path, settings)
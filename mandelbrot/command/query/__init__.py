@@ -19,84 +19,92 @@ import sys
 import argparse
 import traceback
 
-def main():
+from mandelbrot.command import lazy_command
+
+def make_parser():
     """
+    Create the argument parser.  Subcommand modules are not imported until
+    the subcommand runs.
+
+    :rtype: argparse.ArgumentParser
     """
-    try:
-        import mandelbrot.command.query.condition as condition
-        import mandelbrot.command.query.notifications as notifications
-        import mandelbrot.command.query.metrics as metrics
+    # create the top-level parser
+    parser = argparse.ArgumentParser(prog='mandelbrot-query')
+    parser.set_defaults(main=lambda ns: 0)
+    subparsers = parser.add_subparsers()
 
-        # create the top-level parser
-        parser = argparse.ArgumentParser(prog='mandelbrot-query')
-        parser.set_defaults(main=lambda ns: 0)
-        subparsers = parser.add_subparsers()
+    # query condition
+    query_condition = subparsers.add_parser('condition')
+    query_condition.set_defaults(main=lazy_command('mandelbrot.command.query.condition'))
+    query_condition.add_argument('-i', '--agent-id', metavar='AGENT', dest='agent_id',
+                                 help='Query the specified AGENT')
+    query_condition.add_argument('-t', '--timerange', metavar='TIMERANGE', dest='timerange', default=None,
+                                 help='Request results within the specified TIMERANGE')
+    query_condition.add_argument('-l', '--limit', metavar='LIMIT', dest='limit', type=int, default=100,
+                                 help='Return at most LIMIT results')
+    query_condition.add_argument('-s', '--sort-by', metavar='COLUMNS', dest='sort_columns', default=None,
+                                 help='Sort results using the specified COLUMNS')
+    query_condition.add_argument('-r', '--reverse', dest='reverse', action='store_true',
+                                 help='Return results in descending order')
+    query_condition.add_argument('-u', '--endpoint-url', metavar='URL', dest='endpoint_url',
+                                 help="Query the specified endpoint URL")
+    query_condition.add_argument('-v', '--verbose', action='store_true')
+    query_condition.add_argument('-p', '--pool-workers', metavar='NUM', dest='pool_workers',
+                                type=int, default=10, help='Size of the query worker pool')
+    query_condition.add_argument('--log-level', metavar='LEVEL', dest='log_level',
+                                choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'], default='INFO',
+                                help='Log at the specified level')
+    query_condition.add_argument('check_id', metavar='CHECK')
 
-        # query condition
-        query_condition = subparsers.add_parser('condition')
-        query_condition.set_defaults(main=condition.run_command)
-        query_condition.add_argument('-i', '--agent-id', metavar='AGENT', dest='agent_id',
-                                     help='Query the specified AGENT')
-        query_condition.add_argument('-t', '--timerange', metavar='TIMERANGE', dest='timerange', default=None,
-                                     help='Request results within the specified TIMERANGE')
-        query_condition.add_argument('-l', '--limit', metavar='LIMIT', dest='limit', type=int, default=100,
-                                     help='Return at most LIMIT results')
-        query_condition.add_argument('-s', '--sort-by', metavar='COLUMNS', dest='sort_columns', default=None,
-                                     help='Sort results using the specified COLUMNS')
-        query_condition.add_argument('-r', '--reverse', dest='reverse', action='store_true',
-                                     help='Return results in descending order')
-        query_condition.add_argument('-u', '--endpoint-url', metavar='URL', dest='endpoint_url',
-                                     help="Query the specified endpoint URL")
-        query_condition.add_argument('-v', '--verbose', action='store_true')
-        query_condition.add_argument('-p', '--pool-workers', metavar='NUM', dest='pool_workers',
-                                    type=int, default=10, help='Size of the query worker pool')
-        query_condition.add_argument('--log-level', metavar='LEVEL', dest='log_level',
-                                    choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'], default='INFO',
-                                    help='Log at the specified level')
-        query_condition.add_argument('check_id', metavar='CHECK')
+    # query notifications
+    query_notifications = subparsers.add_parser('notifications')
+    query_notifications.set_defaults(main=lazy_command('mandelbrot.command.query.notifications'))
+    query_notifications.add_argument('-i', '--agent-id', metavar='AGENT', dest='agent_id',
+                                 help='Query the specified AGENT')
+    query_notifications.add_argument('-t', '--timerange', metavar='TIMERANGE', dest='timerange', default=None,
+                                 help='Request results within the specified TIMERANGE')
+    query_notifications.add_argument('-l', '--limit', metavar='LIMIT', dest='limit', type=int, default=100,
+                                 help='Return at most LIMIT results')
+    query_notifications.add_argument('-r', '--reverse', dest='reverse', action='store_true',
+                                 help='Return results in descending order')
+    query_notifications.add_argument('-u', '--endpoint-url', metavar='URL', dest='endpoint_url',
+                                 help="Query the specified endpoint URL")
+    query_notifications.add_argument('-v', '--verbose', action='store_true')
+    query_notifications.add_argument('-p', '--pool-workers', metavar='NUM', dest='pool_workers',
+                                type=int, default=10, help='Size of the query worker pool')
+    query_notifications.add_argument('--log-level', metavar='LEVEL', dest='log_level',
+                                choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'], default='INFO',
+                                help='Log at the specified level')
+    query_notifications.add_argument('check_id', metavar='CHECK')
 
-        # query notifications
-        query_notifications = subparsers.add_parser('notifications')
-        query_notifications.set_defaults(main=notifications.run_command)
-        query_notifications.add_argument('-i', '--agent-id', metavar='AGENT', dest='agent_id',
+    # query metrics
+    query_metrics = subparsers.add_parser('metrics')
+    query_metrics.set_defaults(main=lazy_command('mandelbrot.command.query.metrics'))
+    query_metrics.add_argument('-i', '--agent-id', metavar='AGENT', dest='agent_id',
                                      help='Query the specified AGENT')
-        query_notifications.add_argument('-t', '--timerange', metavar='TIMERANGE', dest='timerange', default=None,
+    query_metrics.add_argument('-t', '--timerange', metavar='TIMERANGE', dest='timerange', default=None,
                                      help='Request results within the specified TIMERANGE')
-        query_notifications.add_argument('-l', '--limit', metavar='LIMIT', dest='limit', type=int, default=100,
+    query_metrics.add_argument('-l', '--limit', metavar='LIMIT', dest='limit', type=int, default=100,
                                      help='Return at most LIMIT results')
-        query_notifications.add_argument('-r', '--reverse', dest='reverse', action='store_true',
+    query_metrics.add_argument('-r', '--reverse', dest='reverse', action='store_true',
                                      help='Return results in descending order')
-        query_notifications.add_argument('-u', '--endpoint-url', metavar='URL', dest='endpoint_url',
+    query_metrics.add_argument('-u', '--endpoint-url', metavar='URL', dest='endpoint_url',
                                      help="Query the specified endpoint URL")
-        query_notifications.add_argument('-v', '--verbose', action='store_true')
-        query_notifications.add_argument('-p', '--pool-workers', metavar='NUM', dest='pool_workers',
-                                    type=int, default=10, help='Size of the query worker pool')
-        query_notifications.add_argument('--log-level', metavar='LEVEL', dest='log_level',
-                                    choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'], default='INFO',
-                                    help='Log at the specified level')
-        query_notifications.add_argument('check_id', metavar='CHECK')
+    query_metrics.add_argument('-v', '--verbose', action='store_true')
+    query_metrics.add_argument('-p', '--pool-workers', metavar='NUM', dest='pool_workers',
+                                     type=int, default=10, help='Size of the query worker pool')
+    query_metrics.add_argument('--log-level', metavar='LEVEL', dest='log_level',
+                                     choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'], default='INFO',
+                                     help='Log at the specified level')
+    query_metrics.add_argument('check_id', metavar='CHECK')
 
-        # query metrics
-        query_metrics = subparsers.add_parser('metrics')
-        query_metrics.set_defaults(main=metrics.run_command)
-        query_metrics.add_argument('-i', '--agent-id', metavar='AGENT', dest='agent_id',
-                                         help='Query the specified AGENT')
-        query_metrics.add_argument('-t', '--timerange', metavar='TIMERANGE', dest='timerange', default=None,
-                                         help='Request results within the specified TIMERANGE')
-        query_metrics.add_argument('-l', '--limit', metavar='LIMIT', dest='limit', type=int, default=100,
-                                         help='Return at most LIMIT results')
-        query_metrics.add_argument('-r', '--reverse', dest='reverse', action='store_true',
-                                         help='Return results in descending order')
-        query_metrics.add_argument('-u', '--endpoint-url', metavar='URL', dest='endpoint_url',
-                                         help="Query the specified endpoint URL")
-        query_metrics.add_argument('-v', '--verbose', action='store_true')
-        query_metrics.add_argument('-p', '--pool-workers', metavar='NUM', dest='pool_workers',
-                                         type=int, default=10, help='Size of the query worker pool')
-        query_metrics.add_argument('--log-level', metavar='LEVEL', dest='log_level',
-                                         choices=['DEBUG','INFO','WARNING','ERROR','CRITICAL'], default='INFO',
-                                         help='Log at the specified level')
-        query_metrics.add_argument('check_id', metavar='CHECK')
+    return parser
 
+def main():
+    """
+    """
+    try:
+        parser = make_parser()
         ns = parser.parse_args()
         return ns.main(ns)
 
@@ -20,7 +20,7 @@ import urllib.parse
 import cifparser
 import logging
 
-from mandelbrot.registry import Registry
+from mandelbrot.registry import Registry, default_index_path
 from mandelbrot.query.endpoint import make_endpoint
 from mandelbrot.timerange import parse_timerange
 from mandelbrot.table import Table, Column, Rowstore, Terminal
@@ -36,7 +36,7 @@ def run_command(ns):
     log = logging.getLogger('mandelbrot')
 
     event_loop = asyncio.get_event_loop()
-    registry = Registry()
+    registry = Registry(default_index_path())
 
     agent_id = cifparser.make_path(ns.agent_id)
     check_id = cifparser.make_path(ns.check_id)
@@ -50,7 +50,7 @@ def run_command(ns):
 
     # construct the endpoint
     log.debug("constructing endpoint %s", endpoint_url)
-    with make_endpoint(event_loop, endpoint_url, registry, 10) as endpoint:
+    with make_endpoint(event_loop, endpoint_url, registry, ns.pool_workers) as endpoint:
 
         # query the endpoint, store the results in rowstore
         rowstore = Rowstore()
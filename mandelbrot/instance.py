@@ -23,8 +23,13 @@ import lockfile
 import sqlite3
 import tempfile
 import json
+import pickle
+import uuid
 import cifparser
 
+from mandelbrot.model import construct
+from mandelbrot.model.fingerprint import RegistrationFingerprint
+
 log = logging.getLogger("mandelbrot.instance")
 
 class Instance(object):
@@ -37,11 +42,14 @@ class Instance(object):
         """
         self.path = path
         self._db = None
+        self._has_generation = False
 
     @property
     def conn(self):
         if self._db is None:
             self._db = sqlite3.connect(str(self.path / 'db'))
+            # readers such as the status commands don't block the writer
+            self._db.execute(_SQLStatements.set_journal_mode)
         return self._db
 
     def close(self):
@@ -61,6 +69,8 @@ class Instance(object):
             conn.execute(_SQLStatements.create_v1_endpoint_url_table)
             conn.execute(_SQLStatements.create_v1_check_table)
             conn.execute(_SQLStatements.create_v1_metadata_table)
+            conn.execute(_SQLStatements.create_v1_registration_fingerprint_table)
+            self._create_generation(conn)
             cursor = conn.cursor()
             cursor.execute(_SQLStatements.get_version)
             version_number = cursor.fetchone()
@@ -71,6 +81,75 @@ class Instance(object):
             else:
                 pass
 
+    def _create_generation(self, conn):
+        # instances created before snapshots were stored lack the generation
+        conn.execute(_SQLStatements.create_v1_generation_table)
+        conn.execute(_SQLStatements.init_generation, (uuid.uuid4().hex,))
+        for table in _SQLStatements.snapshot_tables:
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(_SQLStatements.create_v1_generation_trigger.format(
+                    table=table, event=event, name=event.lower()))
+        self._has_generation = True
+
+    def get_generation(self):
+        """
+        The generation is incremented by a trigger whenever the agent id,
+        manifest url, endpoint url, checks or metadata change.  The token
+        identifies the database, so a database which is recreated does not
+        repeat generations.
+
+        :returns: The token and the generation.
+        :rtype: (str,int)
+        """
+        with self.conn as conn:
+            if not self._has_generation:
+                self._create_generation(conn)
+            cursor = conn.cursor()
+            cursor.execute(_SQLStatements.get_generation)
+            token, generation = cursor.fetchone()
+            return str(token), int(generation)
+
+    def load_snapshot(self):
+        """
+        Load the compiled snapshot of the instance, which is read from the
+        snapshot file in a single read if the instance has not changed since
+        the snapshot was written.  Otherwise the snapshot is compiled from
+        the database and written to the snapshot file.  The caller should
+        hold the instance lock.
+
+        :rtype: InstanceSnapshot
+        """
+        token, generation = self.get_generation()
+        snapshot_path = self.path / 'snapshot'
+        try:
+            # the format version is stored with the snapshot, since pickle
+            # does not store class attributes
+            with snapshot_path.open('rb') as f:
+                version, snapshot = pickle.load(f)
+            if version != InstanceSnapshot.version:
+                raise ValueError("snapshot version {0} is not supported".format(version))
+            if snapshot.token == token and snapshot.generation == generation:
+                return snapshot
+            log.debug("snapshot generation %d is stale", snapshot.generation)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.debug("failed to load snapshot %s: %s", snapshot_path, e)
+        snapshot = InstanceSnapshot(token, generation, self.get_agent_id(),
+            self.get_manifest_url(), self.get_endpoint_url(),
+            sorted(self.list_checks(), key=lambda check: check.check_id),
+            list(self.list_metadata()))
+        try:
+            # write to a temporary file, then move it into place atomically
+            temp_path = str(snapshot_path) + '.' + str(os.getpid())
+            with open(temp_path, 'wb') as f:
+                pickle.dump((InstanceSnapshot.version, snapshot), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, str(snapshot_path))
+            log.debug("wrote snapshot generation %d", generation)
+        except OSError as e:
+            log.info("failed to write snapshot %s: %s", snapshot_path, e)
+        return snapshot
+
     def get_agent_id(self):
         with self.conn as conn:
             cursor = conn.cursor()
@@ -173,14 +252,7 @@ class Instance(object):
 
     def set_check(self, instance_check):
         with self.conn as conn:
-            check_id = str(instance_check.check_id)
-            check_type = str(instance_check.check_type)
-            check_params = json.dumps(cifparser.dump(instance_check.check_params.values))
-            delay = float(instance_check.delay)
-            offset = float(instance_check.offset)
-            jitter = float(instance_check.jitter)
-            conn.execute(_SQLStatements.set_check, (check_id, check_type,
-                check_params, delay, offset, jitter))
+            conn.execute(_SQLStatements.set_check, make_check_row(instance_check))
 
     def delete_check(self, check_id):
         with self.conn as conn:
@@ -190,6 +262,80 @@ class Instance(object):
         with self.conn as conn:
             conn.execute(_SQLStatements.flush_checks)
 
+    def bulk_update(self, agent_id=None, manifest_url=None, endpoint_url=None,
+                    metadata=None, checks=None, removed_metadata=None, removed_checks=None):
+        """
+        Write the specified changes in a single transaction, so either all
+        of the changes are applied or none of them are.  Arguments which
+        are None are left unchanged.
+
+        :param agent_id:
+        :type agent_id: cifparser.Path
+        :param manifest_url:
+        :type manifest_url: str
+        :param endpoint_url:
+        :type endpoint_url: urllib.parse.ParseResult
+        :param metadata: The metadata to set.
+        :type metadata: dict[str,str]
+        :param checks: The checks to set.
+        :type checks: list[InstanceCheck]
+        :param removed_metadata: The names of the metadata to delete.
+        :type removed_metadata: list[str]
+        :param removed_checks: The ids of the checks to delete.
+        :type removed_checks: list[cifparser.Path]
+        """
+        with self.conn as conn:
+            if agent_id is not None:
+                assert isinstance(agent_id, cifparser.Path)
+                conn.execute(_SQLStatements.set_agent_id, (str(agent_id),))
+            if manifest_url is not None:
+                conn.execute(_SQLStatements.set_manifest_url, (manifest_url,))
+            if endpoint_url is not None:
+                assert isinstance(endpoint_url, urllib.parse.ParseResult)
+                conn.execute(_SQLStatements.set_endpoint_url,
+                    (urllib.parse.urlunparse(endpoint_url),))
+            if removed_metadata:
+                conn.executemany(_SQLStatements.delete_meta_value,
+                    [(meta_name,) for meta_name in removed_metadata])
+            if metadata:
+                conn.executemany(_SQLStatements.set_meta_value, metadata.items())
+            if removed_checks:
+                conn.executemany(_SQLStatements.delete_check,
+                    [(str(check_id),) for check_id in removed_checks])
+            if checks:
+                conn.executemany(_SQLStatements.set_check,
+                    [make_check_row(instance_check) for instance_check in checks])
+
+    def get_registration_fingerprint(self, endpoint_url):
+        """
+        :returns: The fingerprint of the registration last accepted by the
+          endpoint, or None if no registration was accepted by the endpoint.
+        :rtype: mandelbrot.model.fingerprint.RegistrationFingerprint
+        """
+        assert isinstance(endpoint_url, urllib.parse.ParseResult)
+        with self.conn as conn:
+            # instances created before fingerprints were stored lack the table
+            conn.execute(_SQLStatements.create_v1_registration_fingerprint_table)
+            cursor = conn.cursor()
+            cursor.execute(_SQLStatements.get_registration_fingerprint)
+            results = cursor.fetchone()
+            if results is not None and results[0] == urllib.parse.urlunparse(endpoint_url):
+                return construct(RegistrationFingerprint, json.loads(results[1]))
+            return None
+
+    def set_registration_fingerprint(self, endpoint_url, fingerprint):
+        assert isinstance(endpoint_url, urllib.parse.ParseResult)
+        assert isinstance(fingerprint, RegistrationFingerprint)
+        with self.conn as conn:
+            conn.execute(_SQLStatements.create_v1_registration_fingerprint_table)
+            conn.execute(_SQLStatements.set_registration_fingerprint,
+                (urllib.parse.urlunparse(endpoint_url), json.dumps(fingerprint.destructure())))
+
+    def delete_registration_fingerprint(self):
+        with self.conn as conn:
+            conn.execute(_SQLStatements.create_v1_registration_fingerprint_table)
+            conn.execute(_SQLStatements.delete_registration_fingerprint)
+
 class InstanceCheck(object):
     """
     """
@@ -209,12 +355,42 @@ class InstanceCheck(object):
         self.offset = offset
         self.jitter = jitter
 
+class InstanceSnapshot(object):
+    """
+    A compiled copy of the instance, which is valid while the token and
+    generation match the instance database.  The version is incremented
+    whenever the attributes of the snapshot change.
+    """
+
+    version = 1
+
+    def __init__(self, token, generation, agent_id, manifest_url, endpoint_url, checks, metadata):
+        """
+        :type token: str
+        :type generation: int
+        :type agent_id: cifparser.Path
+        :type manifest_url: str
+        :type endpoint_url: urllib.parse.ParseResult
+        :param checks: The checks ordered by check id
+        :type checks: list[InstanceCheck]
+        :type metadata: list[(str,str)]
+        """
+        self.token = token
+        self.generation = generation
+        self.agent_id = agent_id
+        self.manifest_url = manifest_url
+        self.endpoint_url = endpoint_url
+        self.checks = checks
+        self.metadata = metadata
+
 class _SQLStatements(object):
     """
     """
 
     version = 1
 
+    set_journal_mode = "PRAGMA journal_mode=WAL;"
+
     create_version_table = """
 CREATE TABLE IF NOT EXISTS version ( version_number INTEGER );
 """
@@ -249,6 +425,34 @@ CREATE TABLE IF NOT EXISTS v1_metadata (
 );
 """
 
+    create_v1_registration_fingerprint_table = """
+CREATE TABLE IF NOT EXISTS v1_registration_fingerprint (
+    endpoint_url TEXT,
+    fingerprint TEXT
+);
+"""
+
+    create_v1_generation_table = """
+CREATE TABLE IF NOT EXISTS v1_generation (
+    token TEXT,
+    generation INTEGER
+);
+"""
+
+    # changes to these tables invalidate the snapshot
+    snapshot_tables = ['v1_agent_id', 'v1_manifest_url', 'v1_endpoint_url', 'v1_check', 'v1_metadata']
+
+    create_v1_generation_trigger = """
+CREATE TRIGGER IF NOT EXISTS {table}_{name} AFTER {event} ON {table}
+BEGIN
+    UPDATE v1_generation SET generation = generation + 1 WHERE rowid=0;
+END;
+"""
+
+    init_generation = "INSERT OR IGNORE INTO v1_generation ( rowid, token, generation ) VALUES ( 0, ?, 0 );"
+
+    get_generation = "SELECT token, generation FROM v1_generation WHERE rowid=0;"
+
     get_version = "SELECT version_number FROM version WHERE rowid=0;"
 
     set_version = "INSERT OR REPLACE INTO version ( rowid, version_number ) VALUES ( 0, ? );"
@@ -285,6 +489,49 @@ CREATE TABLE IF NOT EXISTS v1_metadata (
 
     flush_checks = "DELETE FROM v1_check;"
 
+    get_registration_fingerprint = "SELECT endpoint_url, fingerprint FROM v1_registration_fingerprint WHERE rowid=0;"
+
+    set_registration_fingerprint = "INSERT OR REPLACE INTO v1_registration_fingerprint ( rowid, endpoint_url, fingerprint ) VALUES ( 0, ?, ? );"
+
+    delete_registration_fingerprint = "DELETE FROM v1_registration_fingerprint;"
+
+def make_check_row(instance_check):
+    """
+    :param instance_check:
+    :type instance_check: InstanceCheck
+    :returns: The parameters for the set_check statement.
+    :rtype: tuple
+    """
+    check_id = str(instance_check.check_id)
+    check_type = str(instance_check.check_type)
+    check_params = json.dumps(cifparser.dump(instance_check.check_params.values))
+    delay = float(instance_check.delay)
+    offset = float(instance_check.offset)
+    jitter = float(instance_check.jitter)
+    return (check_id, check_type, check_params, delay, offset, jitter)
+
+def diff_instance_checks(running, loaded):
+    """
+    Compare the running instance checks with the checks loaded from the
+    instance.  A check is changed if its type, parameters or schedule
+    differ.
+
+    :param running:
+    :type running: dict[cifparser.Path,InstanceCheck]
+    :param loaded:
+    :type loaded: dict[cifparser.Path,InstanceCheck]
+    :returns: The sorted ids of the checks which were added, removed and changed.
+    :rtype: (list[cifparser.Path],list[cifparser.Path],list[cifparser.Path])
+    """
+    def check_key(check):
+        check_params = json.dumps(cifparser.dump(check.check_params.values), sort_keys=True)
+        return (check.check_type, check_params, check.delay, check.offset, check.jitter)
+    added = sorted([check_id for check_id in loaded if check_id not in running])
+    removed = sorted([check_id for check_id in running if check_id not in loaded])
+    changed = sorted([check_id for check_id in loaded if check_id in running
+        and check_key(running[check_id]) != check_key(loaded[check_id])])
+    return added, removed, changed
+
 def create_instance(path):
     """
     :param path:
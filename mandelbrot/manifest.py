@@ -0,0 +1,93 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import pathlib
+import datetime
+import logging
+import cifparser
+
+log = logging.getLogger("mandelbrot.manifest")
+
+from mandelbrot.instance import InstanceCheck
+
+default_interval = datetime.timedelta(seconds=60)
+default_offset = datetime.timedelta(seconds=0)
+default_jitter = datetime.timedelta(seconds=0)
+
+class Manifest(object):
+    """
+    """
+    def __init__(self, manifest_url, metadata, checks):
+        """
+        :param manifest_url:
+        :type manifest_url: str
+        :param metadata:
+        :type metadata: dict[str,str]
+        :param checks:
+        :type checks: list[mandelbrot.instance.InstanceCheck]
+        """
+        self.manifest_url = manifest_url
+        self.metadata = metadata
+        self.checks = checks
+
+def load_manifest(manifest_path):
+    """
+    Read and parse the manifest at the specified path.
+
+    :param manifest_path:
+    :type manifest_path: str
+    :rtype: Manifest
+    """
+    manifest_path = pathlib.Path(manifest_path).absolute()
+    manifest_url = manifest_path.as_uri()
+    f = manifest_path.open('r')
+    log.debug("reading manifest from %s", manifest_path.as_posix())
+
+    # read manifest
+    with f:
+        values = cifparser.parse_file(f)
+
+    # parse manifest
+    metadata = values.get_container_fields(cifparser.make_path('metadata'))
+    checks = []
+
+    def load_checks(path, parent):
+        for name,container in parent.get_container_containers(cifparser.ROOT_PATH).items():
+            check_id = cifparser.make_path(path, name)
+            if container.contains_field(cifparser.ROOT_PATH, 'type'):
+                check_fields = container.get_container_fields(cifparser.ROOT_PATH)
+                check_params = cifparser.Namespace(cifparser.load(check_fields))
+                check_type = check_params.get_flattened(cifparser.ROOT_PATH, 'type')
+                check_fields.pop('type', None)
+                interval = check_params.get_timedelta_or_default(cifparser.ROOT_PATH,
+                    'interval', default_interval).total_seconds()
+                check_fields.pop('interval', None)
+                offset = check_params.get_timedelta_or_default(cifparser.ROOT_PATH,
+                    'offset', default_offset).total_seconds()
+                check_fields.pop('offset', None)
+                jitter = check_params.get_timedelta_or_default(cifparser.ROOT_PATH,
+                    'jitter', default_jitter).total_seconds()
+                check_fields.pop('jitter', None)
+                check_params = cifparser.Namespace(cifparser.load(check_fields))
+                instance_check = InstanceCheck(check_id, check_type, check_params, interval, offset, jitter)
+                checks.append(instance_check)
+                log.debug("loaded check %s", check_id)
+            load_checks(check_id, container)
+
+    load_checks(cifparser.ROOT_PATH, values.get_container(cifparser.make_path('checks')))
+
+    return Manifest(manifest_url, metadata, checks)
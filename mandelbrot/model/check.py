@@ -29,6 +29,7 @@ class Check(StructuredMixin):
         self.policy = {}
         self.properties = {}
         self.metadata = {}
+        self.metric_schema = None
 
     def get_check_id(self):
         return self.check_id
@@ -72,6 +73,13 @@ class Check(StructuredMixin):
         assert isinstance(timeout, datetime.timedelta)
         self.policy['leavingTimeout'] = int(timeout / datetime.timedelta(milliseconds=1))
 
+    def get_metric_schema(self):
+        return self.metric_schema
+
+    def set_metric_schema(self, metric_schema):
+        assert isinstance(metric_schema, int)
+        self.metric_schema = metric_schema
+
     def get_property(self, property_name):
         return self.properties[property_name]
 
@@ -112,4 +120,6 @@ class Check(StructuredMixin):
         structure['policy'] =  self.policy
         structure['properties'] = self.properties
         structure['metadata'] = self.metadata
+        if self.metric_schema is not None:
+            structure['metricSchema'] = self.metric_schema
         return structure
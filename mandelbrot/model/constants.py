@@ -38,3 +38,10 @@ health_types = (CheckHealth.HEALTHY,
                 CheckHealth.DEGRADED,
                 CheckHealth.FAILED,
                 CheckHealth.UNKNOWN)
+
+class SourceType(object):
+    GAUGE = 'gauge'
+    COUNTER = 'counter'
+
+source_types = (SourceType.GAUGE,
+                SourceType.COUNTER)
@@ -86,7 +86,17 @@ class Evaluation(StructuredMixin):
         return structure
         
 def _construct_evaluation(structure):
-    raise NotImplementedError()
+    assert isinstance(structure, dict)
+    evaluation = Evaluation()
+    if 'timestamp' in structure:
+        evaluation.set_timestamp(construct(Timestamp, structure['timestamp']))
+    if 'summary' in structure:
+        evaluation.set_summary(structure['summary'])
+    if 'health' in structure:
+        evaluation.set_health(structure['health'])
+    for metric_name,metric_value in structure.get('metrics', {}).items():
+        evaluation.set_metric(metric_name, metric_value)
+    return evaluation
 
 add_constructor(Evaluation, _construct_evaluation)
 
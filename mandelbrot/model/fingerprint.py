@@ -0,0 +1,137 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+
+from mandelbrot.model import StructuredMixin, add_constructor
+
+class RegistrationFingerprint(StructuredMixin):
+    """
+    A canonical digest of each section of a registration.  Every top level
+    field is a section, except checks and metrics, where each check and
+    each metric is a separate section named 'checks/<check_id>' and
+    'metrics/<metric_source>'.  Comparing two fingerprints finds the
+    sections which changed without keeping either registration.
+    """
+    def __init__(self):
+        self.sections = {}
+        self.generation = None
+        self.expires = None
+
+    def get_digest(self):
+        return make_digest(self.sections)
+
+    def get_section(self, name):
+        return self.sections[name]
+
+    def list_sections(self):
+        return self.sections.items()
+
+    def set_section(self, name, digest):
+        assert isinstance(name, str)
+        assert isinstance(digest, str)
+        self.sections[name] = digest
+
+    def get_generation(self):
+        return self.generation
+
+    def set_generation(self, generation):
+        assert isinstance(generation, int)
+        self.generation = generation
+
+    def get_expires(self):
+        return self.expires
+
+    def set_expires(self, expires):
+        assert isinstance(expires, int)
+        self.expires = expires
+
+    def diff(self, previous):
+        """
+        :param previous:
+        :type previous: RegistrationFingerprint
+        :returns: The names of the sections which were added or changed,
+          and the names of the sections which were removed.
+        :rtype: (list[str],list[str])
+        """
+        changed = sorted([name for name,digest in self.sections.items()
+            if previous.sections.get(name) != digest])
+        removed = sorted([name for name in previous.sections
+            if name not in self.sections])
+        return changed, removed
+
+    def destructure(self):
+        structure = {}
+        structure['digest'] = self.get_digest()
+        structure['sections'] = self.sections
+        if self.generation is not None:
+            structure['generation'] = self.generation
+        if self.expires is not None:
+            structure['expires'] = self.expires
+        return structure
+
+def _construct_registration_fingerprint(structure):
+    fingerprint = RegistrationFingerprint()
+    for name,digest in structure['sections'].items():
+        fingerprint.set_section(name, digest)
+    if 'generation' in structure:
+        fingerprint.set_generation(structure['generation'])
+    if 'expires' in structure:
+        fingerprint.set_expires(structure['expires'])
+    return fingerprint
+
+add_constructor(RegistrationFingerprint, _construct_registration_fingerprint)
+
+def make_digest(structure):
+    """
+    :returns: The hex sha256 digest of the canonical JSON encoding of the
+      structure, which does not depend on the order of dict keys.
+    :rtype: str
+    """
+    canonical = json.dumps(structure, sort_keys=True, separators=(',',':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def list_sections(structure):
+    """
+    Split a destructured registration into its sections.
+
+    :param structure:
+    :type structure: dict
+    :rtype: dict[str,object]
+    """
+    sections = {}
+    for name,value in structure.items():
+        if name == 'checks' or name == 'metrics':
+            for key,item in value.items():
+                sections[name + '/' + key] = item
+        elif name == 'groups':
+            sections[name] = sorted(value)
+        else:
+            sections[name] = value
+    return sections
+
+def make_fingerprint(registration):
+    """
+    :param registration:
+    :type registration: mandelbrot.model.registration.Registration
+    :rtype: RegistrationFingerprint
+    """
+    fingerprint = RegistrationFingerprint()
+    for name,value in list_sections(registration.destructure()).items():
+        fingerprint.set_section(name, make_digest(value))
+    return fingerprint
@@ -0,0 +1,82 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import zlib
+
+class MetricSchema(object):
+    """
+    The positional layout of the metrics registered for a check.  Metrics
+    are ordered by name, and the version is derived from the name, source
+    type and unit of each metric, so the agent and the server compute the
+    same layout and version from the same registration.
+    """
+    def __init__(self, metrics):
+        """
+        :param metrics: The registered metrics, keyed by metric name
+        :type metrics: dict[str,mandelbrot.model.metric.Metric]
+        """
+        self.names = sorted(metrics)
+        self.positions = dict([(name, position) for position,name in enumerate(self.names)])
+        layout = "\n".join(["{} {} {}".format(name, metrics[name].get_source_type(),
+            metrics[name].get_metric_unit()) for name in self.names])
+        self.version = zlib.crc32(layout.encode('utf-8'))
+
+    def pack(self, metrics):
+        """
+        Return the metric values as a list ordered by the schema, with None
+        in place of any registered metric which has no value.
+
+        :param metrics:
+        :type metrics: dict[str,float]
+        :returns: The metric vector, or None if any metric is not registered
+          in the schema.
+        :rtype: list[float]
+        """
+        vector = [None] * len(self.names)
+        for name,value in metrics.items():
+            position = self.positions.get(name)
+            if position is None:
+                return None
+            vector[position] = value
+        return vector
+
+    def unpack(self, vector):
+        """
+        Return the metric values in the vector keyed by metric name.
+
+        :param vector:
+        :type vector: list[float]
+        :rtype: dict[str,float]
+        """
+        if len(vector) != len(self.names):
+            raise ValueError("metric vector does not match schema version {}".format(self.version))
+        return dict([(name, value) for name,value in zip(self.names, vector) if value is not None])
+
+def make_metric_schemas(registration):
+    """
+    Return the metric schema for each check in the registration which has
+    registered metrics.
+
+    :param registration:
+    :type registration: mandelbrot.model.registration.Registration
+    :returns: The metric schemas keyed by check id
+    :rtype: dict[str,MetricSchema]
+    """
+    check_metrics = {}
+    for (check_id,metric_name),metric in registration.list_metrics():
+        check_metrics.setdefault(str(check_id), {})[metric_name] = metric
+    return dict([(check_id, MetricSchema(metrics)) for check_id,metrics in check_metrics.items()])
@@ -14,26 +14,57 @@
 # 
 # You should have received a copy of the GNU General Public License
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
-
-import pkg_resources
+import os
+import re
+import sys
+import json
+import pathlib
 import logging
 
+try:
+    import importlib.metadata as importlib_metadata
+except ImportError:
+    try:
+        import importlib_metadata
+    except ImportError:
+        importlib_metadata = None
+
+try:
+    from packaging.requirements import Requirement
+    from packaging.utils import canonicalize_name
+except ImportError:
+    Requirement = None
+
 log = logging.getLogger("mandelbrot.registry")
 
 from mandelbrot import versionstring
 require_mandelbrot = 'mandelbrot == ' + versionstring()
 
+# only entry points in groups with this prefix are indexed
+entry_point_prefix = 'mandelbrot'
+
 class Registry(object):
     """
+    Looks up the factories which distributions register as entry points.
+    Entry points are read with importlib.metadata if it is available,
+    otherwise with pkg_resources, which is much slower to import.  Each
+    factory is loaded once per (type, name, requirement).
+
+    If index_path is specified, then the entry points are cached in an
+    index file, which is rebuilt whenever a directory on sys.path is
+    modified, for example when a distribution is installed or removed.
     """
-    def __init__(self):
-        self.env = pkg_resources.Environment([])
-        plugins,errors = pkg_resources.working_set.find_plugins(self.env)
-        for plugin in plugins:
-            pkg_resources.working_set.add(plugin)
-        for error in errors:
-            log.info("failed to load distribution: %s", error)
+    def __init__(self, index_path=None):
+        """
+        :param index_path: The path of the entry point index, or None to
+          scan the installed distributions on first lookup.
+        :type index_path: pathlib.Path
+        """
+        self.index_path = index_path
         self.overrides = {}
+        self.factories = {}
+        self.index = None
+        self.working_set = None
 
     def override_factory(self, entry_point_type, factory_name, factory):
         """
@@ -62,14 +93,163 @@ class Registry(object):
         # check factory overrides first
         if (entry_point_type,factory_name) in self.overrides:
             factory = self.overrides[(entry_point_type,factory_name)]
+        # then factories which were already loaded
+        elif (entry_point_type,factory_name,requirement) in self.factories:
+            factory = self.factories[(entry_point_type,factory_name,requirement)]
         # find the entrypoint matching the specified requirement
         else:
-            requirement = pkg_resources.Requirement.parse(requirement)
-            distribution = pkg_resources.working_set.find(requirement)
-            factory = distribution.load_entry_point(entry_point_type, factory_name)
-        log.debug("loaded factory %s.%s", factory.__module__, factory.__class__.__name__)
+            if importlib_metadata is not None:
+                factory = self.load_entry_point(entry_point_type, factory_name, requirement)
+            else:
+                factory = self.load_distribution_entry_point(entry_point_type,
+                    factory_name, requirement)
+            self.factories[(entry_point_type,factory_name,requirement)] = factory
+            log.debug("loaded factory %s.%s", factory.__module__, factory.__name__)
         # verify that the factory is the correct type
         if not issubclass(factory, factory_type):
             raise TypeError("{}.{} is not a subclass of {}".format(
-                factory.__module__, factory.__class__.__name__, factory_type.__name__))
+                factory.__module__, factory.__name__, factory_type.__name__))
         return factory
+
+    def load_entry_point(self, entry_point_type, factory_name, requirement):
+        """
+        Load the entry point using importlib.metadata.
+
+        :raises KeyError: No distribution matching the requirement
+          registers the entry point.
+        """
+        if self.index is None:
+            self.index = self.load_index()
+        matches = requirement_matcher(requirement)
+        for dist_name,version,value in self.index['entry_points'].get(entry_point_type, {}).get(factory_name, []):
+            if matches(dist_name, version):
+                entry_point = importlib_metadata.EntryPoint(factory_name, value, entry_point_type)
+                return entry_point.load()
+        raise KeyError("no {} named '{}' matches requirement {}".format(
+            entry_point_type, factory_name, requirement))
+
+    def load_distribution_entry_point(self, entry_point_type, factory_name, requirement):
+        """
+        Load the entry point using pkg_resources.
+        """
+        import pkg_resources
+        if self.working_set is None:
+            env = pkg_resources.Environment([])
+            plugins,errors = pkg_resources.working_set.find_plugins(env)
+            for plugin in plugins:
+                pkg_resources.working_set.add(plugin)
+            for error in errors:
+                log.info("failed to load distribution: %s", error)
+            self.working_set = pkg_resources.working_set
+        requirement = pkg_resources.Requirement.parse(requirement)
+        distribution = self.working_set.find(requirement)
+        if distribution is None:
+            raise KeyError("no distribution matches requirement {}".format(requirement))
+        return distribution.load_entry_point(entry_point_type, factory_name)
+
+    def load_index(self):
+        """
+        Load the entry point index from the index file if it is still
+        valid, otherwise build the index and write it to the index file.
+
+        :rtype: dict
+        """
+        mtimes = path_mtimes()
+        if self.index_path is not None:
+            try:
+                with self.index_path.open('r') as f:
+                    index = json.load(f)
+                if index['mtimes'] == mtimes:
+                    log.debug("loaded entry point index %s", self.index_path)
+                    return index
+            except (OSError, ValueError, KeyError):
+                pass
+        index = {'mtimes': mtimes, 'entry_points': make_entry_point_index()}
+        if self.index_path is not None:
+            try:
+                # write to a temporary file, then move it into place atomically
+                os.makedirs(str(self.index_path.parent), exist_ok=True)
+                temp_path = str(self.index_path) + '.' + str(os.getpid())
+                with open(temp_path, 'w') as f:
+                    json.dump(index, f)
+                os.replace(temp_path, str(self.index_path))
+                log.debug("wrote entry point index %s", self.index_path)
+            except OSError as e:
+                log.info("failed to write entry point index %s: %s", self.index_path, e)
+        return index
+
+def default_index_path():
+    """
+    :returns: The path of the entry point index in the user cache directory.
+    :rtype: pathlib.Path
+    """
+    cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return pathlib.Path(cache_dir, 'mandelbrot', 'registry.index')
+
+def path_mtimes():
+    """
+    :returns: The modification time of each directory on sys.path.
+    :rtype: dict[str,float]
+    """
+    mtimes = {}
+    for path in sys.path:
+        try:
+            mtimes[path] = os.stat(path or '.').st_mtime
+        except OSError:
+            pass
+    return mtimes
+
+def make_entry_point_index():
+    """
+    Scan the installed distributions for mandelbrot entry points.  Where
+    multiple distributions register the same entry point, the distribution
+    which comes first on sys.path comes first in the index.
+
+    :returns: A dict mapping entry point group to a dict mapping entry point
+      name to a list of [distribution name, version, entry point value].
+    :rtype: dict[str,dict[str,list]]
+    """
+    entry_points = {}
+    for distribution in importlib_metadata.distributions():
+        dist_name = distribution.metadata['Name']
+        if dist_name is None:
+            continue
+        for entry_point in distribution.entry_points:
+            if not entry_point.group.startswith(entry_point_prefix):
+                continue
+            entry_points.setdefault(entry_point.group, {}).setdefault(entry_point.name, []).append(
+                [dist_name, distribution.version, entry_point.value])
+    return entry_points
+
+# matches a requirement which pins a single version, such as require_mandelbrot
+pinned_requirement = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*==\s*([A-Za-z0-9._+!-]+)\s*$')
+
+def canonical_name(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def requirement_matcher(requirement):
+    """
+    A requirement which pins a single version is matched directly, and
+    any other requirement is parsed with packaging if it is available,
+    otherwise with pkg_resources.
+
+    :param requirement:
+    :type requirement: str
+    :returns: A function which returns True if the specified distribution
+      name and version satisfy the requirement.
+    :rtype: callable
+    """
+    pinned = pinned_requirement.match(requirement)
+    if pinned is not None:
+        name, version = canonical_name(pinned.group(1)), pinned.group(2)
+        return lambda dist_name,dist_version: canonical_name(dist_name) == name \
+            and dist_version == version
+    if Requirement is not None:
+        requirement = Requirement(requirement)
+        name = canonicalize_name(requirement.name)
+        return lambda dist_name,version: canonicalize_name(dist_name) == name \
+            and requirement.specifier.contains(version, prereleases=True)
+    import pkg_resources
+    requirement = pkg_resources.Requirement.parse(requirement)
+    return lambda dist_name,version: pkg_resources.safe_name(dist_name).lower() == requirement.key \
+        and version in requirement
@@ -0,0 +1,144 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import logging
+
+log = logging.getLogger("mandelbrot.stats")
+
+# default histogram bucket bounds, in seconds
+default_bounds = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+class Histogram(object):
+    """
+    Counts observed values in buckets.  Bucket n counts the values which
+    are less than or equal to bounds[n] and greater than bounds[n-1]; the
+    last bucket counts the values greater than every bound.
+    """
+    def __init__(self, bounds=default_bounds):
+        """
+        :param bounds: The upper bound of each bucket, in increasing order
+        :type bounds: tuple[float]
+        """
+        self.bounds = tuple(bounds)
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def __str__(self):
+        buckets = ["le{}:{}".format(bound, n) for bound,n in zip(self.bounds, self.buckets) if n > 0]
+        if self.buckets[-1] > 0:
+            buckets.append("inf:{}".format(self.buckets[-1]))
+        return "count={} mean={:.6f} [{}]".format(self.count, self.mean(), " ".join(buckets))
+
+class Stats(object):
+    """
+    A named set of counters, gauges and histograms describing the internal
+    state of some agent component.  Counters only ever increase; gauges hold
+    the most recent value; histograms count observed values in buckets.
+    """
+    def __init__(self, name):
+        """
+        :param name:
+        :type name: str
+        """
+        self.name = name
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, counter_name, value=1):
+        self.counters[counter_name] = self.counters.get(counter_name, 0) + value
+
+    def get_counter(self, counter_name):
+        return self.counters.get(counter_name, 0)
+
+    def set_gauge(self, gauge_name, value):
+        self.gauges[gauge_name] = value
+
+    def get_gauge(self, gauge_name):
+        return self.gauges.get(gauge_name)
+
+    def observe(self, histogram_name, value, bounds=default_bounds):
+        histogram = self.histograms.get(histogram_name)
+        if histogram is None:
+            histogram = self.histograms[histogram_name] = Histogram(bounds)
+        histogram.observe(value)
+
+    def get_histogram(self, histogram_name):
+        return self.histograms.get(histogram_name)
+
+    def set_histogram(self, histogram_name, histogram):
+        self.histograms[histogram_name] = histogram
+
+    def remove_histogram(self, histogram_name):
+        self.histograms.pop(histogram_name, None)
+
+    def snapshot(self):
+        """
+        :returns: The current value of each counter, gauge and histogram.
+        :rtype: dict[str,object]
+        """
+        snapshot = dict(self.counters)
+        snapshot.update(self.gauges)
+        snapshot.update(self.histograms)
+        return snapshot
+
+    def clear(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+_stats = {}
+
+def get_stats(name):
+    """
+    Return the Stats with the specified name, creating it if necessary.
+
+    :param name:
+    :type name: str
+    :rtype: Stats
+    """
+    if name not in _stats:
+        _stats[name] = Stats(name)
+    return _stats[name]
+
+def list_stats():
+    """
+    :rtype: list[Stats]
+    """
+    return [_stats[name] for name in sorted(_stats)]
+
+def log_stats(logger=log, level=logging.INFO):
+    """
+    Log a snapshot of every Stats.
+    """
+    for stats in list_stats():
+        snapshot = stats.snapshot()
+        if len(snapshot) > 0:
+            values = ", ".join(["{}={}".format(k, v) for k,v in sorted(snapshot.items())])
+            logger.log(level, "%s: %s", stats.name, values)
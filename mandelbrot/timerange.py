@@ -16,81 +16,108 @@
 # along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
 
 import datetime
-import pyparsing as pp
 
 from mandelbrot.model.timestamp import Timestamp, UTC
 
-EpochDateTime = pp.Word(pp.srange('[1-9]'), pp.srange('[0-9]'))
 def parseEpochDateTime(tokens):
     return datetime.datetime.fromtimestamp(int(tokens[0]), UTC)
-EpochDateTime.setParseAction(parseEpochDateTime)
 
-ISODateTimeUTC = pp.Regex(r'\d{4}-\d{2}-\d{2}T\d{2}\:\d{2}\:\d{2}Z')
 def parseISODateTime(tokens):
     return datetime.datetime.strptime(tokens[0], '%Y-%m-%dT%H:%M:%SZ')
-ISODateTimeUTC.setParseAction(parseISODateTime)
 
-ISODateTimeAndOffset = pp.Regex(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}[+-]\d{2}:\d{2}')
 def parseISODateTimeAndOffset(tokens):
     return datetime.datetime.strptime(tokens[0], '%Y-%m-%dT%H:%M:%S%z')
-ISODateTimeAndOffset.setParseAction(parseISODateTimeAndOffset)
 
-ISODateTime = ISODateTimeUTC | ISODateTimeAndOffset
-
-TimeValue = pp.Word(pp.srange('[1-9]'), pp.srange('[0-9]'))
-
-UnitDays = pp.CaselessKeyword('day') | pp.CaselessKeyword('days')
-UnitDays.setParseAction(lambda x: lambda hours: hours * 60 * 60 * 24)
-UnitHours = pp.CaselessKeyword('hour') | pp.CaselessKeyword('hours')
-UnitHours.setParseAction(lambda x: lambda hours: hours * 60 * 60)
-UnitMinutes = pp.CaselessKeyword('minute') | pp.CaselessKeyword('minutes')
-UnitMinutes.setParseAction(lambda x: lambda minutes: minutes * 60)
-UnitSeconds = pp.CaselessKeyword('second') | pp.CaselessKeyword('seconds')
-UnitSeconds.setParseAction(lambda x: lambda seconds: seconds)
-TimeUnit = UnitDays | UnitHours | UnitMinutes | UnitSeconds
-
-DirectionAgo = pp.CaselessLiteral("ago")
-DirectionAgo.setParseAction(lambda x: lambda point,delta: point - delta)
-DirectionAhead = pp.CaselessLiteral("ahead")
-DirectionAhead.setParseAction(lambda x: lambda point,delta: point + delta)
-
-RelativeDirection = DirectionAgo | DirectionAhead
-RelativeDateTime = TimeValue + TimeUnit + RelativeDirection
 def parseRelativeDateTime(tokens):
     value = int(tokens[0])
     magnify = tokens[1]
     shift = tokens[2]
     seconds = magnify(value)
     return shift(datetime.datetime.now(UTC), datetime.timedelta(seconds=seconds))
-RelativeDateTime.setParseAction(parseRelativeDateTime)
-
-DateTime = ISODateTime | RelativeDateTime | EpochDateTime
-
-ClosedDateTimeRange = DateTime + pp.Suppress(pp.Literal('..')) + DateTime
-LeftOpenDateTimeRange = pp.Literal('..') + DateTime
-RightOpenDateTimeRange = DateTime + pp.Literal('..')
-
-DateTimeRange = ClosedDateTimeRange | LeftOpenDateTimeRange | RightOpenDateTimeRange
 
-DateTimePlusDelta = DateTime + pp.Suppress(pp.Literal('+')) + TimeValue + TimeUnit
 def parseDateTimePlusDelta(tokens):
     start = tokens[0]
     value = int(tokens[1])
     magnify = tokens[2]
     delta = datetime.timedelta(seconds=magnify(value))
     return [start, start + delta]
-DateTimePlusDelta.setParseAction(parseDateTimePlusDelta)
 
-NowPlusDelta = pp.Suppress(pp.Literal('+')) + TimeValue + TimeUnit
 def parseNowPlusDelta(tokens):
     start = datetime.datetime.now(UTC)
     value = int(tokens[0])
     magnify = tokens[1]
     delta = datetime.timedelta(seconds=magnify(value))
     return [start, start + delta]
-NowPlusDelta.setParseAction(parseNowPlusDelta)
 
-DateTimeWindow = ClosedDateTimeRange | DateTimePlusDelta | NowPlusDelta
+_grammar = {}
+
+def get_grammar():
+    """
+    Build the timerange grammar on first use, since importing pyparsing
+    and building the grammar is slow, and most callers never parse a
+    timerange.
+
+    :returns: A dict containing the DateTime, DateTimeRange and
+      DateTimeWindow parser elements.
+    :rtype: dict
+    """
+    if _grammar:
+        return _grammar
+
+    import pyparsing as pp
+
+    EpochDateTime = pp.Word(pp.srange('[1-9]'), pp.srange('[0-9]'))
+    EpochDateTime.setParseAction(parseEpochDateTime)
+
+    ISODateTimeUTC = pp.Regex(r'\d{4}-\d{2}-\d{2}T\d{2}\:\d{2}\:\d{2}Z')
+    ISODateTimeUTC.setParseAction(parseISODateTime)
+
+    ISODateTimeAndOffset = pp.Regex(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}[+-]\d{2}:\d{2}')
+    ISODateTimeAndOffset.setParseAction(parseISODateTimeAndOffset)
+
+    ISODateTime = ISODateTimeUTC | ISODateTimeAndOffset
+
+    TimeValue = pp.Word(pp.srange('[1-9]'), pp.srange('[0-9]'))
+
+    UnitDays = pp.CaselessKeyword('day') | pp.CaselessKeyword('days')
+    UnitDays.setParseAction(lambda x: lambda hours: hours * 60 * 60 * 24)
+    UnitHours = pp.CaselessKeyword('hour') | pp.CaselessKeyword('hours')
+    UnitHours.setParseAction(lambda x: lambda hours: hours * 60 * 60)
+    UnitMinutes = pp.CaselessKeyword('minute') | pp.CaselessKeyword('minutes')
+    UnitMinutes.setParseAction(lambda x: lambda minutes: minutes * 60)
+    UnitSeconds = pp.CaselessKeyword('second') | pp.CaselessKeyword('seconds')
+    UnitSeconds.setParseAction(lambda x: lambda seconds: seconds)
+    TimeUnit = UnitDays | UnitHours | UnitMinutes | UnitSeconds
+
+    DirectionAgo = pp.CaselessLiteral("ago")
+    DirectionAgo.setParseAction(lambda x: lambda point,delta: point - delta)
+    DirectionAhead = pp.CaselessLiteral("ahead")
+    DirectionAhead.setParseAction(lambda x: lambda point,delta: point + delta)
+
+    RelativeDirection = DirectionAgo | DirectionAhead
+    RelativeDateTime = TimeValue + TimeUnit + RelativeDirection
+    RelativeDateTime.setParseAction(parseRelativeDateTime)
+
+    DateTime = ISODateTime | RelativeDateTime | EpochDateTime
+
+    ClosedDateTimeRange = DateTime + pp.Suppress(pp.Literal('..')) + DateTime
+    LeftOpenDateTimeRange = pp.Literal('..') + DateTime
+    RightOpenDateTimeRange = DateTime + pp.Literal('..')
+
+    DateTimeRange = ClosedDateTimeRange | LeftOpenDateTimeRange | RightOpenDateTimeRange
+
+    DateTimePlusDelta = DateTime + pp.Suppress(pp.Literal('+')) + TimeValue + TimeUnit
+    DateTimePlusDelta.setParseAction(parseDateTimePlusDelta)
+
+    NowPlusDelta = pp.Suppress(pp.Literal('+')) + TimeValue + TimeUnit
+    NowPlusDelta.setParseAction(parseNowPlusDelta)
+
+    DateTimeWindow = ClosedDateTimeRange | DateTimePlusDelta | NowPlusDelta
+
+    _grammar['DateTime'] = DateTime
+    _grammar['DateTimeRange'] = DateTimeRange
+    _grammar['DateTimeWindow'] = DateTimeWindow
+    return _grammar
 
 def datetime_to_timestamp(dt):
     timestamp = Timestamp()
@@ -112,7 +139,7 @@ def parse_datetime(string):
     :raises ValueError: the timerange could not be parsed
     """
     try:
-        return datetime_to_timestamp(DateTime.parseString(string, parseAll=True).asList()[0])
+        return datetime_to_timestamp(get_grammar()['DateTime'].parseString(string, parseAll=True).asList()[0])
     except Exception as e:
         raise ValueError("failed to parse datetime '%s'" % string)
 
@@ -131,7 +158,7 @@ def parse_timerange(string):
     :raises ValueError: the timerange could not be parsed
     """
     try:
-        start,end = DateTimeRange.parseString(string, parseAll=True).asList()
+        start,end = get_grammar()['DateTimeRange'].parseString(string, parseAll=True).asList()
         start = None if start == ".." else datetime_to_timestamp(start)
         end = None if end == ".." else datetime_to_timestamp(end)
         return (start,end)
@@ -154,7 +181,7 @@ def parse_timewindow(string):
     :raises ValueError: the timewindow could not be parsed
     """
     try:
-        start,end = DateTimeWindow.parseString(string, parseAll=True).asList()
+        start,end = get_grammar()['DateTimeWindow'].parseString(string, parseAll=True).asList()
         return (datetime_to_timestamp(start), datetime_to_timestamp(end))
     except Exception as e:
         raise ValueError("failed to parse timewindow '%s'" % string)
@@ -17,10 +17,19 @@
 
 import asyncio
 
+from mandelbrot.transport.codec import CodecNegotiator
+from mandelbrot.transport.compression import make_compressor
+
 entry_point_type = 'mandelbrot.transport'
 
 class Transport(object):
     """
+    Entities are encoded and decoded by the codecs in the negotiator.  If
+    the codecs keyword argument is specified, then only those codecs are
+    offered, otherwise every available codec is offered.  If the
+    compression keyword argument names a content encoding, then request
+    bodies of at least compression_threshold bytes are compressed.  The
+    workers keyword argument is the number of workers in the executor.
     """
     def __init__(self, url, event_loop, executor, **kwargs):
         """
@@ -34,6 +43,10 @@ class Transport(object):
         self.url = url
         self.event_loop = event_loop
         self.executor = executor
+        self.workers = kwargs.get('workers')
+        self.negotiator = CodecNegotiator(kwargs.get('codecs'))
+        self.compressor = make_compressor(kwargs.get('compression'),
+            kwargs.get('compression_threshold'))
 
     @asyncio.coroutine
     def create_item(self, path, item):
@@ -51,6 +64,25 @@ class Transport(object):
         """
         raise NotImplementedError()
 
+    @asyncio.coroutine
+    def create_items(self, path, items):
+        """
+        Create each of the specified items in the collection specified by
+        path using a single request.  Returns a list containing the result
+        for each item in the same order as items; if the item was created
+        then the result is the response entity (or None), otherwise the
+        result is the TransportException describing the failure.
+
+        :param path:
+        :type path: str
+        :param items:
+        :type items: list[dict]
+        :rtype: list
+        :raises BadRequest:
+        :raises Forbidden:
+        """
+        raise NotImplementedError()
+
     @asyncio.coroutine
     def replace_item(self, path, item):
         """
@@ -101,7 +133,8 @@ class Transport(object):
     def patch_item(self, path, fields, constraints):
         """
         Conditionally replace the specified fields for the item at the
-        specified path, if all constraints hold.
+        specified path, if all constraints hold.  The fields are sent as
+        the request entity and the constraints as request parameters.
 
         :param path:
         :type path: str
@@ -148,6 +181,15 @@ class Transport(object):
         """
         raise NotImplementedError()
 
+    def get_capacity(self):
+        """
+        Returns the number of requests which the transport can have
+        outstanding at once, or None if the capacity is unbounded.
+
+        :rtype: int
+        """
+        return None
+
     def close(self):
         """
         Release resources associated with the transport.
@@ -178,3 +220,55 @@ class ResourceNotFound(TransportException):
 
 class RetryLater(TransportException):
     pass
+
+class UnsupportedMediaType(TransportException):
+    pass
+
+class CircuitOpen(RetryLater):
+    """
+    Raised without contacting the server while the circuit breaker for
+    the endpoint is open.
+    """
+
+# transport exceptions which indicate the request may succeed if retried
+retryable_exceptions = (RetryLater, InternalError)
+
+# maps HTTP status codes to the corresponding transport exception
+status_exceptions = {
+    400: BadRequest,
+    403: Forbidden,
+    404: ResourceNotFound,
+    409: Conflict,
+    415: UnsupportedMediaType,
+    500: InternalError,
+    501: NotImplemented,
+    503: RetryLater,
+}
+
+def item_results(items, entity):
+    """
+    Convert the response entity for a multi-item request into the list of
+    per-item results returned by Transport.create_items().  The entity must
+    contain one result for each item, in order; each result holds the HTTP
+    status for the item and optionally a description and an entity.
+
+    :param items:
+    :type items: list
+    :param entity:
+    :type entity: list[dict]
+    :rtype: list
+    :raises InternalError: The entity does not contain a result for each item.
+    """
+    if not isinstance(entity, list) or len(entity) != len(items):
+        raise InternalError("expected {} results, server returned {}".format(
+            len(items), entity))
+    results = []
+    for result in entity:
+        status_code = result.get('status', 200)
+        if status_code not in status_exceptions:
+            results.append(result.get('entity'))
+        elif 'description' in result:
+            results.append(status_exceptions[status_code](result['description']))
+        else:
+            results.append(status_exceptions[status_code]())
+    return results
@@ -0,0 +1,233 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+
+log = logging.getLogger("mandelbrot.transport.codec")
+
+# binary codecs are optional, and only offered if the library is installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+class Codec(object):
+    """
+    Encodes and decodes request and response entities for a single media
+    type.
+    """
+    name = None
+    content_type = None
+
+    def encode(self, entity):
+        """
+        :param entity:
+        :type entity: object
+        :rtype: bytes
+        """
+        raise NotImplementedError()
+
+    def decode(self, body):
+        """
+        :param body:
+        :type body: bytes
+        :rtype: object
+        :raises ValueError: If the body cannot be decoded.
+        """
+        raise NotImplementedError()
+
+class JsonCodec(Codec):
+    name = 'json'
+    content_type = 'application/json'
+
+    def encode(self, entity):
+        return json.dumps(entity).encode('utf-8')
+
+    def decode(self, body):
+        return json.loads(body.decode('utf-8'))
+
+class MsgpackCodec(Codec):
+    name = 'msgpack'
+    content_type = 'application/msgpack'
+
+    def encode(self, entity):
+        return msgpack.packb(entity, use_bin_type=True)
+
+    def decode(self, body):
+        try:
+            return msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ValueError(str(e))
+
+class CborCodec(Codec):
+    name = 'cbor'
+    content_type = 'application/cbor'
+
+    def encode(self, entity):
+        return cbor2.dumps(entity)
+
+    def decode(self, body):
+        try:
+            return cbor2.loads(body)
+        except Exception as e:
+            raise ValueError(str(e))
+
+json_codec = JsonCodec()
+
+def available_codecs():
+    """
+    Return the codecs which can be used, most preferred first.  JSON is
+    always available, and is always last.
+
+    :rtype: list[Codec]
+    """
+    codecs = []
+    if msgpack is not None:
+        codecs.append(MsgpackCodec())
+    if cbor2 is not None:
+        codecs.append(CborCodec())
+    codecs.append(json_codec)
+    return codecs
+
+def make_codecs(names):
+    """
+    Return the available codecs with the specified names, in the order
+    specified.  JSON is appended if it is not named, since every server
+    accepts it.
+
+    :param names:
+    :type names: list[str]
+    :rtype: list[Codec]
+    """
+    available = dict([(codec.name, codec) for codec in available_codecs()])
+    codecs = []
+    for name in names:
+        if name not in available:
+            log.warning("codec %s is not available", name)
+            continue
+        codecs.append(available[name])
+    if json_codec not in codecs:
+        codecs.append(json_codec)
+    return codecs
+
+def parse_codecs(value):
+    """
+    Parse the codecs setting, which is 'auto' to offer every available
+    codec, or a comma separated list of codec names, most preferred first.
+
+    :param value:
+    :type value: str
+    :returns: The codecs, or None to offer every available codec.
+    :rtype: list[Codec]
+    """
+    value = value.strip()
+    if value == 'auto':
+        return None
+    return make_codecs([name.strip() for name in value.split(',') if name.strip() != ''])
+
+class CodecNegotiator(object):
+    """
+    Negotiates the codec used for request and response entities.  The
+    Accept header lists every codec in order of preference, so the server
+    chooses the response codec.  Requests are encoded as JSON until the
+    server responds with a preferred codec, since that proves the server
+    understands it; if the server later rejects the codec, then requests
+    fall back to JSON.
+    """
+    def __init__(self, codecs=None):
+        """
+        :param codecs: The codecs to offer, most preferred first
+        :type codecs: list[Codec]
+        """
+        self.codecs = list(codecs) if codecs is not None else available_codecs()
+        if json_codec not in self.codecs:
+            self.codecs.append(json_codec)
+        self.request_codec = json_codec
+        quality = 10
+        accept = []
+        for codec in self.codecs:
+            if quality == 10:
+                accept.append(codec.content_type)
+            else:
+                accept.append("{};q={:.1f}".format(codec.content_type, quality / 10.0))
+            quality = max(1, quality - 1)
+        self.accept = ", ".join(accept)
+
+    def get_codec(self, content_type):
+        """
+        Return the codec for the content type, or None if there is no codec
+        for the content type.  If content_type is None, then JSON is assumed.
+
+        :param content_type: The value of the Content-Type header
+        :type content_type: str
+        :rtype: Codec
+        """
+        if not content_type:
+            return json_codec
+        media_type = content_type.partition(';')[0].strip().lower()
+        if media_type == 'application/x-msgpack':
+            media_type = MsgpackCodec.content_type
+        for codec in self.codecs:
+            if codec.content_type == media_type:
+                return codec
+        return None
+
+    def encode(self, entity):
+        """
+        :returns: The content type and the encoded entity.
+        :rtype: (str,bytes)
+        """
+        return self.request_codec.content_type, self.request_codec.encode(entity)
+
+    def decode(self, content_type, body):
+        """
+        Decode the response body.  If the server responds using a preferred
+        codec, then subsequent requests are encoded using that codec.
+
+        :param content_type: The value of the Content-Type header
+        :type content_type: str
+        :param body:
+        :type body: bytes
+        :raises ValueError: If the body is empty or cannot be decoded.
+        """
+        if len(body) == 0:
+            raise ValueError("response has no entity")
+        codec = self.get_codec(content_type)
+        if codec is None:
+            raise ValueError("no codec for content type {}".format(content_type))
+        if codec is not self.request_codec and self.codecs.index(codec) < self.codecs.index(self.request_codec):
+            log.debug("server supports %s, switching request codec", codec.content_type)
+            self.request_codec = codec
+        return codec.decode(body)
+
+    def reject(self):
+        """
+        Fall back to JSON after the server rejects the request codec.
+
+        :returns: True if the request should be retried using JSON.
+        :rtype: bool
+        """
+        if self.request_codec is json_codec:
+            return False
+        log.info("server rejects %s, falling back to JSON", self.request_codec.content_type)
+        self.request_codec = json_codec
+        return True
@@ -0,0 +1,121 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import gzip
+import threading
+import time
+import logging
+
+log = logging.getLogger("mandelbrot.transport.compression")
+
+# zstd is optional, and only offered if the library is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from mandelbrot.stats import get_stats
+
+default_compression_threshold = 1024
+
+# bounds for the histogram of compressed size as a fraction of the original
+ratio_bounds = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+class Compressor(object):
+    """
+    Compresses request bodies which are at least threshold bytes.  The
+    compressor is called from the transport executor, so compression never
+    runs on the event loop.  If the server rejects the content encoding,
+    then compression is disabled for the remaining requests.  The ratio
+    and time spent compressing are recorded in the
+    'mandelbrot.transport.compression' stats.
+    """
+    def __init__(self, encoding, threshold=default_compression_threshold, level=None):
+        """
+        :param encoding: The content encoding, either 'gzip' or 'zstd'
+        :type encoding: str
+        :param threshold: The minimum size in bytes of a body to compress
+        :type threshold: int
+        :param level: The compression level, or None for the default
+        :type level: int
+        """
+        if encoding == 'gzip':
+            level = level if level is not None else 6
+            self._compress = lambda body: gzip.compress(body, level)
+        elif encoding == 'zstd':
+            if zstandard is None:
+                raise ValueError("zstd compression requires the zstandard module")
+            compressor = zstandard.ZstdCompressor(level=level if level is not None else 3)
+            self._compress = compressor.compress
+        else:
+            raise ValueError("unknown content encoding '{}'".format(encoding))
+        self.encoding = encoding
+        self.threshold = threshold
+        self.enabled = True
+        self.lock = threading.Lock()
+        self.stats = get_stats('mandelbrot.transport.compression')
+
+    def compress(self, body):
+        """
+        :param body:
+        :type body: bytes
+        :returns: The content encoding, or None if the body is not
+          compressed, and the body.
+        :rtype: (str,bytes)
+        """
+        if not self.enabled or len(body) < self.threshold:
+            with self.lock:
+                self.stats.increment('uncompressed requests')
+            return None, body
+        started = time.perf_counter()
+        compressed = self._compress(body)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.stats.increment('compressed requests')
+            self.stats.increment('original bytes', len(body))
+            self.stats.increment('compressed bytes', len(compressed))
+            self.stats.increment('compression seconds', elapsed)
+            self.stats.observe('compression ratio', len(compressed) / len(body), ratio_bounds)
+        return self.encoding, compressed
+
+    def reject(self):
+        """
+        Disable compression after the server rejects the content encoding.
+
+        :returns: True if the request should be sent again uncompressed.
+        :rtype: bool
+        """
+        if not self.enabled:
+            return False
+        log.info("server rejects %s content encoding, disabling compression", self.encoding)
+        self.enabled = False
+        return True
+
+def make_compressor(encoding, threshold=None):
+    """
+    :param encoding: The content encoding, or None or 'none' to disable
+      compression
+    :type encoding: str
+    :param threshold:
+    :type threshold: int
+    :rtype: Compressor
+    """
+    if encoding is None or encoding == 'none':
+        return None
+    if threshold is None:
+        threshold = default_compression_threshold
+    return Compressor(encoding, threshold)
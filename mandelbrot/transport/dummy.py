@@ -30,6 +30,11 @@ class DummyTransport(Transport):
         log.info("create item %s from %s", str(path), str(item))
         return None
 
+    @asyncio.coroutine
+    def create_items(self, path, items):
+        log.info("create %d items %s from %s", len(items), str(path), str(items))
+        return [None for item in items]
+
     @asyncio.coroutine
     def replace_item(self, path, item):
         log.info("replace item %s with %s", str(path), str(item))
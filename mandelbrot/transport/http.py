@@ -37,7 +37,7 @@ class HttpTransport(Transport):
         :param executor:
         :type executor: concurrent.futures.Executor
         """
-        super().__init__(url, event_loop, executor)
+        super().__init__(url, event_loop, executor, **kwargs)
         self.event_loop = event_loop
         self.scheme = self.url.scheme
         self.netloc = self.url.netloc
@@ -46,44 +46,83 @@ class HttpTransport(Transport):
         else:
             self.session = requests.Session()
         self.session.headers = {
-            'accept': 'application/json',
+            'accept': self.negotiator.accept,
             'user-agent': "mandelbrot " + versionstring(),
             }
 
+    def get_capacity(self):
+        # each outstanding request occupies a thread in the executor
+        return self.workers
+
     def absolute_url(self, path):
         return urllib.parse.urlunparse((self.scheme, self.netloc, path, '', '', ''))
 
-    def request(self, request):
+    def request(self, request, item=None):
         """
+        Send the request on the executor.  If item is specified, then it is
+        encoded and compressed on the executor as well.
+
         :param request:
         :type request: requests.Request
+        :param item:
+        :type item: object
         :returns: The Response object wrapped in a Future.
         :rtype: asyncio.Future
+        :raises RetryLater: The request failed before a response was received.
         """
         def send_request():
+            if item is not None:
+                request.headers['content-type'], request.data = self.negotiator.encode(item)
+                if self.compressor is not None:
+                    encoding, request.data = self.compressor.compress(request.data)
+                    if encoding is not None:
+                        request.headers['content-encoding'] = encoding
             prepared = self.session.prepare_request(request)
-            response = self.session.send(prepared)
             try:
-                if response.status_code == 400:
-                    raise BadRequest()
-                if response.status_code == 403:
-                    raise Forbidden()
-                if response.status_code == 404:
-                    raise ResourceNotFound()
-                if response.status_code == 409:
-                    raise Conflict()
-                if response.status_code == 500:
-                    raise InternalError()
-                if response.status_code == 501:
-                    raise NotImplemented()
-                if response.status_code == 503:
-                    raise RetryLater()
+                response = self.session.send(prepared)
+            except requests.RequestException as e:
+                raise RetryLater("failed to send {} {}: {}".format(prepared.method, prepared.url, e))
+            try:
+                if response.status_code in status_exceptions:
+                    raise status_exceptions[response.status_code]()
                 return response
             except Exception:
                 self.log_response_and_entity(response)
                 raise
         return self.event_loop.run_in_executor(self.executor, send_request)
 
+    @asyncio.coroutine
+    def send(self, method, path, params=None, item=None):
+        """
+        Encode the item using the negotiated codec and send the request.  If
+        the server rejects the content encoding, then the request is sent
+        again uncompressed, and if the server rejects the codec, then the
+        request is sent again as JSON.
+
+        :returns: The Response object.
+        :rtype: requests.Response
+        """
+        while True:
+            request = requests.Request(method=method, url=self.absolute_url(path),
+                params=params, headers={})
+            try:
+                return (yield from self.request(request, item))
+            except UnsupportedMediaType:
+                if item is None:
+                    raise
+                if 'content-encoding' in request.headers and self.compressor.reject():
+                    continue
+                if not self.negotiator.reject():
+                    raise
+
+    def decode(self, response):
+        """
+        Decode the response entity using the codec for its content type.
+
+        :raises ValueError: If the response has no entity.
+        """
+        return self.negotiator.decode(response.headers.get('content-type'), response.content)
+
     def log_response(self, response):
         request = response.request
         log.debug("%s %s returns %d %s", request.method,
@@ -92,28 +131,30 @@ class HttpTransport(Transport):
     def log_response_and_entity(self, response):
         request = response.request
         log.debug("%s %s returns %d %s:\n%s", request.method,
-            request.url, response.status_code, response.reason, response.text)
+            request.url, response.status_code, response.reason, response.content)
 
     @asyncio.coroutine
     def create_item(self, path, item):
-        request = requests.Request(
-            method='POST', url=self.absolute_url(path), json=item)
-        response = yield from self.request(request)
+        response = yield from self.send('POST', path, item=item)
         try:
-            entity = response.json()
+            entity = self.decode(response)
         except ValueError:
             self.log_response(response)
         else:
             self.log_response_and_entity(response)
             return entity
 
+    @asyncio.coroutine
+    def create_items(self, path, items):
+        response = yield from self.send('POST', path, item=items)
+        self.log_response_and_entity(response)
+        return item_results(items, self.decode(response))
+
     @asyncio.coroutine
     def replace_item(self, path, item):
-        request = requests.Request(
-            method='PUT', url=self.absolute_url(path), json=item)
-        response = yield from self.request(request)
+        response = yield from self.send('PUT', path, item=item)
         try:
-            entity = response.json()
+            entity = self.decode(response)
         except ValueError:
             self.log_response(response)
         else:
@@ -122,11 +163,9 @@ class HttpTransport(Transport):
 
     @asyncio.coroutine
     def delete_item(self, path):
-        request = requests.Request(
-            method='DELETE', url=self.absolute_url(path))
-        response = yield from self.request(request)
+        response = yield from self.send('DELETE', path)
         try:
-            entity = response.json()
+            entity = self.decode(response)
         except ValueError:
             self.log_response(response)
         else:
@@ -135,11 +174,9 @@ class HttpTransport(Transport):
 
     @asyncio.coroutine
     def get_item(self, path, filters):
-        request = requests.Request(
-            method='GET', url=self.absolute_url(path), params=filters)
-        response = yield from self.request(request)
+        response = yield from self.send('GET', path, params=filters)
         try:
-            entity = response.json()
+            entity = self.decode(response)
         except ValueError:
             self.log_response(response)
         else:
@@ -148,7 +185,14 @@ class HttpTransport(Transport):
 
     @asyncio.coroutine
     def patch_item(self, path, fields, constraints):
-        raise NotImplementedError()
+        response = yield from self.send('PATCH', path, params=constraints, item=fields)
+        try:
+            entity = self.decode(response)
+        except ValueError:
+            self.log_response(response)
+        else:
+            self.log_response_and_entity(response)
+            return entity
 
     @asyncio.coroutine
     def get_collection(self, path, matchers, count, last):
@@ -157,11 +201,9 @@ class HttpTransport(Transport):
             params['limit'] = count
         if last is not None:
             params['last'] = last
-        request = requests.Request(
-            method='GET', url=self.absolute_url(path), params=params)
-        response = yield from self.request(request)
+        response = yield from self.send('GET', path, params=params)
         try:
-            entity = response.json()
+            entity = self.decode(response)
         except ValueError:
             self.log_response(response)
         else:
@@ -0,0 +1,253 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import random
+import logging
+
+log = logging.getLogger("mandelbrot.transport.retry")
+
+from mandelbrot.transport import Transport, TransportException, CircuitOpen, retryable_exceptions
+from mandelbrot.stats import get_stats
+
+class RetryPolicy(object):
+    """
+    Describes how requests which fail with a retryable error are retried.
+    The delay before retry n is chosen uniformly at random from the range
+    [(1 - jitter) * d, d], where d = min(max_delay, min_delay * 2^n).
+    """
+    def __init__(self, max_attempts=3, min_delay=0.5, max_delay=30.0, jitter=1.0,
+                 budget_ratio=0.2, budget_reserve=10.0, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param max_attempts: The maximum number of attempts for each request
+        :type max_attempts: int
+        :param min_delay: The delay in seconds before the first retry
+        :type min_delay: float
+        :param max_delay: The maximum delay in seconds before any retry
+        :type max_delay: float
+        :param jitter: The fraction of each delay which is randomized
+        :type jitter: float
+        :param budget_ratio: The number of retries earned by each request
+        :type budget_ratio: float
+        :param budget_reserve: The maximum number of retries which may be saved up
+        :type budget_reserve: float
+        :param failure_threshold: The number of consecutive failures which
+          opens the circuit breaker
+        :type failure_threshold: int
+        :param reset_timeout: The number of seconds the circuit breaker stays
+          open before allowing a trial request
+        :type reset_timeout: float
+        """
+        self.max_attempts = max_attempts
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.budget_ratio = budget_ratio
+        self.budget_reserve = budget_reserve
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def get_delay(self, retry):
+        """
+        :param retry: The retry number, starting at 0
+        :type retry: int
+        :rtype: float
+        """
+        delay = min(self.max_delay, self.min_delay * (2 ** retry))
+        return delay - (random.random() * self.jitter * delay)
+
+class RetryBudget(object):
+    """
+    Limits retries to a fraction of the requests.  Each request deposits
+    budget_ratio into the budget, up to budget_reserve, and each retry
+    withdraws 1.  When the endpoint is failing, this keeps retries from
+    multiplying the load on it.
+    """
+    def __init__(self, ratio, reserve):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.balance = reserve
+
+    def deposit(self):
+        self.balance = min(self.reserve, self.balance + self.ratio)
+
+    def withdraw(self):
+        if self.balance < 1.0:
+            return False
+        self.balance -= 1.0
+        return True
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests to an endpoint after failure_threshold
+    consecutive failures.  After reset_timeout seconds one trial request is
+    allowed through; if it succeeds the breaker closes, otherwise it opens
+    again.  The caller must call finish_trial() when the trial request
+    completes, however it completes.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, event_loop, failure_threshold, reset_timeout):
+        self.event_loop = event_loop
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_pending = False
+
+    def allow_request(self):
+        if self.state == CircuitBreaker.OPEN:
+            if self.event_loop.time() < self.opened_at + self.reset_timeout:
+                return False
+            self.state = CircuitBreaker.HALF_OPEN
+            self.trial_pending = False
+        if self.state == CircuitBreaker.HALF_OPEN:
+            if self.trial_pending:
+                return False
+            self.trial_pending = True
+        return True
+
+    def finish_trial(self):
+        self.trial_pending = False
+
+    def record_success(self):
+        if self.state != CircuitBreaker.CLOSED:
+            log.info("circuit breaker closes")
+        self.state = CircuitBreaker.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == CircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != CircuitBreaker.OPEN:
+                log.warning("circuit breaker opens after %d failures", self.failures)
+            self.state = CircuitBreaker.OPEN
+            self.opened_at = self.event_loop.time()
+
+class RetryingTransport(Transport):
+    """
+    Wraps a transport and retries requests which fail with a retryable
+    error, according to the retry policy.  Delays are awaited on the event
+    loop, so a request waiting to be retried never blocks other tasks.
+    Retry counts, delays and circuit breaker state are recorded in the
+    'mandelbrot.transport.retry' stats.
+    """
+    def __init__(self, transport, policy):
+        """
+        :param transport: The transport which sends requests
+        :type transport: mandelbrot.transport.Transport
+        :param policy:
+        :type policy: RetryPolicy
+        """
+        super().__init__(transport.url, transport.event_loop, transport.executor)
+        self.transport = transport
+        self.policy = policy
+        self.budget = RetryBudget(policy.budget_ratio, policy.budget_reserve)
+        self.breaker = CircuitBreaker(transport.event_loop,
+            policy.failure_threshold, policy.reset_timeout)
+        self.stats = get_stats('mandelbrot.transport.retry')
+        self.stats.set_gauge('breaker state', self.breaker.state)
+
+    @asyncio.coroutine
+    def call(self, method, *args):
+        """
+        Call the transport method, retrying according to the policy.
+        """
+        self.budget.deposit()
+        self.stats.increment('requests')
+        retry = 0
+        while True:
+            if not self.breaker.allow_request():
+                self.stats.increment('rejected requests')
+                raise CircuitOpen()
+            trial = self.breaker.state == CircuitBreaker.HALF_OPEN
+            try:
+                result = yield from method(*args)
+            except retryable_exceptions as e:
+                self.breaker.record_failure()
+                self.stats.set_gauge('breaker state', self.breaker.state)
+                self.stats.increment('failed attempts')
+                if retry + 1 >= self.policy.max_attempts:
+                    raise
+                if self.breaker.state == CircuitBreaker.OPEN:
+                    raise
+                if not self.budget.withdraw():
+                    self.stats.increment('retries over budget')
+                    raise
+                delay = self.policy.get_delay(retry)
+                self.stats.increment('retries')
+                self.stats.increment('retry delay seconds', delay)
+                log.debug("%s failed with %s, retrying in %.3f seconds",
+                    method.__name__, repr(e), delay)
+                yield from asyncio.sleep(delay, loop=self.event_loop)
+                retry += 1
+            except TransportException:
+                # the server is responding, even if it rejected the request
+                self.breaker.record_success()
+                self.stats.set_gauge('breaker state', self.breaker.state)
+                raise
+            else:
+                self.breaker.record_success()
+                self.stats.set_gauge('breaker state', self.breaker.state)
+                return result
+            finally:
+                # any other error, or cancellation, says nothing about the
+                # server, but the trial must be released so another can run
+                if trial:
+                    self.breaker.finish_trial()
+
+    @asyncio.coroutine
+    def create_item(self, path, item):
+        return (yield from self.call(self.transport.create_item, path, item))
+
+    @asyncio.coroutine
+    def create_items(self, path, items):
+        return (yield from self.call(self.transport.create_items, path, items))
+
+    @asyncio.coroutine
+    def replace_item(self, path, item):
+        return (yield from self.call(self.transport.replace_item, path, item))
+
+    @asyncio.coroutine
+    def delete_item(self, path):
+        return (yield from self.call(self.transport.delete_item, path))
+
+    @asyncio.coroutine
+    def get_item(self, path, filters):
+        return (yield from self.call(self.transport.get_item, path, filters))
+
+    @asyncio.coroutine
+    def patch_item(self, path, fields, constraints):
+        return (yield from self.call(self.transport.patch_item, path, fields, constraints))
+
+    @asyncio.coroutine
+    def get_collection(self, path, matchers, count, last):
+        return (yield from self.call(self.transport.get_collection, path, matchers, count, last))
+
+    @asyncio.coroutine
+    def delete_collection(self, path, params):
+        return (yield from self.call(self.transport.delete_collection, path, params))
+
+    def get_capacity(self):
+        return self.transport.get_capacity()
+
+    def close(self):
+        self.transport.close()
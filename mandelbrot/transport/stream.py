@@ -0,0 +1,484 @@
+# Copyright 2015 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Mandelbrot.
+#
+# Mandelbrot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Mandelbrot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Mandelbrot.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import json
+import ssl
+import urllib.parse
+import logging
+
+log = logging.getLogger("mandelbrot.transport.stream")
+
+from mandelbrot import versionstring
+from mandelbrot.transport import *
+
+default_max_connections = 4
+default_pipeline_depth = 8
+default_max_in_flight = 32
+default_request_timeout = 60.0
+
+# requests which may be pipelined, because sending them again is harmless
+idempotent_methods = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+class HttpResponse(object):
+    """
+    A parsed HTTP/1.1 response.
+    """
+    def __init__(self, status_code, reason, headers, body):
+        """
+        :param status_code:
+        :type status_code: int
+        :param reason:
+        :type reason: str
+        :param headers: response headers, with lower-cased names
+        :type headers: dict[str,str]
+        :param body:
+        :type body: bytes
+        """
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def should_close(self):
+        return self.headers.get('connection', '').lower() == 'close'
+
+    def json(self):
+        return json.loads(self.body.decode('utf-8'))
+
+@asyncio.coroutine
+def read_response(reader):
+    """
+    Read a single HTTP/1.1 response from the stream.
+
+    :param reader:
+    :type reader: asyncio.StreamReader
+    :returns: The response, or None if the stream is at EOF.
+    :rtype: HttpResponse
+    """
+    status_line = yield from reader.readline()
+    if status_line == b'':
+        return None
+    _, status_code, reason = status_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+    status_code = int(status_code)
+    headers = {}
+    while True:
+        line = yield from reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if status_code in (204, 304) or status_code < 200:
+        body = b''
+    elif 'chunked' in headers.get('transfer-encoding', '').lower():
+        chunks = []
+        while True:
+            size = yield from reader.readline()
+            size = int(size.split(b';', 1)[0].strip(), 16)
+            if size == 0:
+                # consume the trailers and the final CRLF
+                while (yield from reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append((yield from reader.readexactly(size)))
+            yield from reader.readexactly(2)
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = yield from reader.readexactly(int(headers['content-length']))
+    else:
+        # the body is delimited by the server closing the connection
+        body = yield from reader.read()
+        headers['connection'] = 'close'
+    return HttpResponse(status_code, reason, headers, body)
+
+class HttpConnection(object):
+    """
+    A persistent HTTP/1.1 connection.  Requests may be pipelined, that is
+    written before the responses for earlier requests have been read; the
+    responses are matched to requests in the order the requests were sent.
+    """
+    def __init__(self, event_loop, host, port, ssl_context):
+        """
+        :param event_loop:
+        :type event_loop: asyncio.AbstractEventLoop
+        :param host:
+        :type host: str
+        :param port:
+        :type port: int
+        :param ssl_context:
+        :type ssl_context: ssl.SSLContext
+        """
+        self.event_loop = event_loop
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.reader = None
+        self.writer = None
+        self.connected = None
+        self.reader_task = None
+        self.outstanding = collections.deque()
+        self.num_requests = 0
+        self.closed = False
+
+    @asyncio.coroutine
+    def _connect(self):
+        self.reader, self.writer = yield from asyncio.open_connection(self.host,
+            self.port, ssl=self.ssl_context, loop=self.event_loop)
+        self.reader_task = self.event_loop.create_task(self._read_responses())
+        log.debug("connected to %s:%d", self.host, self.port)
+
+    @asyncio.coroutine
+    def _read_responses(self):
+        try:
+            while not self.closed:
+                response = yield from read_response(self.reader)
+                if response is None:
+                    break
+                future = self.outstanding.popleft()
+                if not future.done():
+                    future.set_result(response)
+                if response.should_close():
+                    break
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.debug("connection to %s:%d failed: %s", self.host, self.port, e)
+        self.close()
+
+    @asyncio.coroutine
+    def send(self, request, timeout=None):
+        """
+        Write the serialized request to the connection and wait for the
+        response.  If the response is not read within timeout seconds, then
+        the connection is closed, because the responses which follow can no
+        longer be matched to their requests.
+
+        :param request:
+        :type request: bytes
+        :param timeout:
+        :type timeout: float
+        :rtype: HttpResponse
+        :raises RetryLater: The connection failed before the response was
+          read, or the response was not read in time.
+        """
+        self.num_requests += 1
+        try:
+            return (yield from asyncio.wait_for(self._send(request), timeout,
+                loop=self.event_loop))
+        except asyncio.TimeoutError:
+            self.close()
+            raise RetryLater("no response from {}:{} after {:.1f} seconds".format(
+                self.host, self.port, timeout))
+        finally:
+            self.num_requests -= 1
+
+    @asyncio.coroutine
+    def _send(self, request):
+        if self.connected is None:
+            self.connected = self.event_loop.create_task(self._connect())
+        try:
+            yield from asyncio.shield(self.connected, loop=self.event_loop)
+        except OSError as e:
+            self.close()
+            raise RetryLater("failed to connect to {}:{}: {}".format(self.host, self.port, e))
+        if self.closed:
+            raise RetryLater("connection to {}:{} is closed".format(self.host, self.port))
+        future = asyncio.Future(loop=self.event_loop)
+        self.outstanding.append(future)
+        self.writer.write(request)
+        yield from self.writer.drain()
+        return (yield from future)
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        """
+        Wait for the connection to finish reading responses after it is closed.
+        """
+        if self.reader_task is not None:
+            yield from asyncio.wait([self.reader_task], loop=self.event_loop)
+
+    def close(self):
+        """
+        Close the connection.  Any requests which are waiting for a response
+        fail with RetryLater.
+        """
+        if not self.closed:
+            self.closed = True
+            if self.writer is not None:
+                self.writer.close()
+            if self.reader_task is not None:
+                self.reader_task.cancel()
+        while len(self.outstanding) > 0:
+            future = self.outstanding.popleft()
+            if not future.done():
+                future.set_exception(RetryLater("connection to {}:{} closed".format(
+                    self.host, self.port)))
+
+class StreamTransport(Transport):
+    """
+    An HTTP/1.1 transport which runs directly on asyncio streams instead of
+    handing each request to a thread in the executor.  Connections are kept
+    alive and pooled, up to max_connections, and each connection may have
+    up to pipeline_depth requests outstanding.  No more than max_in_flight
+    requests are outstanding across all connections; additional requests
+    wait until a slot is available.
+
+    Only idempotent requests are pipelined.  If a connection fails, then
+    every request waiting on it fails with RetryLater, and a request such
+    as POST which the server may already have processed would be sent
+    twice, so a non-idempotent request is only sent on an idle connection.
+    A request which receives no response within request_timeout seconds
+    closes its connection and fails with RetryLater.
+    """
+    def __init__(self, url, event_loop, executor, **kwargs):
+        """
+        :param url:
+        :type url: urllib.parse.ParseResult
+        :param event_loop:
+        :type event_loop: asyncio.AbstractEventLoop
+        :param executor: Unused, requests are not run on an executor
+        :type executor: concurrent.futures.Executor
+        """
+        super().__init__(url, event_loop, executor, **kwargs)
+        scheme = self.url.scheme.partition('+')[0]
+        self.host = self.url.hostname
+        if scheme == 'https':
+            self.port = self.url.port or 443
+            self.ssl_context = kwargs.get('ssl_context', ssl.create_default_context())
+        else:
+            self.port = self.url.port or 80
+            self.ssl_context = None
+        self.netloc = self.url.netloc
+        self.max_connections = kwargs.get('max_connections', default_max_connections)
+        self.pipeline_depth = kwargs.get('pipeline_depth', default_pipeline_depth)
+        self.max_in_flight = min(kwargs.get('max_in_flight', default_max_in_flight),
+            self.max_connections * self.pipeline_depth)
+        self.request_timeout = kwargs.get('request_timeout', default_request_timeout)
+        self.in_flight = asyncio.Semaphore(self.max_in_flight, loop=event_loop)
+        # notified each time a request completes, so a connection may be idle
+        self.request_done = asyncio.Condition(loop=event_loop)
+        self.connections = []
+        self.closed_connections = []
+        self.headers = {
+            'accept': self.negotiator.accept,
+            'user-agent': "mandelbrot " + versionstring(),
+            }
+
+    def get_capacity(self):
+        return self.max_in_flight
+
+    def _select_connection(self, pipelined=True):
+        """
+        Return the open connection with the fewest outstanding requests, or a
+        new connection if every open connection is busy and the pool is not
+        full.  Because at most max_in_flight requests are outstanding, the
+        selected connection never exceeds pipeline_depth.  If pipelined is
+        False, then only an idle connection is returned, or None if every
+        connection is busy and the pool is full.
+        """
+        self.connections = [c for c in self.connections if not c.closed]
+        if not pipelined:
+            for connection in self.connections:
+                if connection.num_requests == 0:
+                    return connection
+            if len(self.connections) >= self.max_connections:
+                return None
+            connection = HttpConnection(self.event_loop, self.host, self.port, self.ssl_context)
+            self.connections.append(connection)
+            return connection
+        selected = None
+        for connection in self.connections:
+            if selected is None or connection.num_requests < selected.num_requests:
+                selected = connection
+        if selected is None or (selected.num_requests > 0
+                and len(self.connections) < self.max_connections):
+            selected = HttpConnection(self.event_loop, self.host, self.port, self.ssl_context)
+            self.connections.append(selected)
+        return selected
+
+    def encode_item(self, item):
+        """
+        Encode the item using the negotiated codec, and compress it if
+        compression is enabled.
+
+        :returns: The entity headers and the entity body.
+        :rtype: (dict[str,str],bytes)
+        """
+        headers = {}
+        headers['content-type'], body = self.negotiator.encode(item)
+        if self.compressor is not None:
+            encoding, body = self.compressor.compress(body)
+            if encoding is not None:
+                headers['content-encoding'] = encoding
+        return headers, body
+
+    def serialize_request(self, method, path, params=None, entity=None):
+        """
+        :param entity: The entity headers and body returned by encode_item()
+        :type entity: (dict[str,str],bytes)
+        :rtype: bytes
+        """
+        target = '/' + path.lstrip('/')
+        if params:
+            target += '?' + urllib.parse.urlencode(params)
+        headers = dict(self.headers)
+        headers['host'] = self.netloc
+        if entity is not None:
+            entity_headers, body = entity
+            headers.update(entity_headers)
+        else:
+            body = b''
+        headers['content-length'] = str(len(body))
+        lines = ["{} {} HTTP/1.1".format(method, target)]
+        lines.extend(["{}: {}".format(name, value) for name,value in headers.items()])
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+    @asyncio.coroutine
+    def request(self, method, path, params=None, item=None):
+        """
+        Send the request and return the decoded response entity.
+
+        :param method:
+        :type method: str
+        :param path:
+        :type path: str
+        :param params:
+        :type params: dict
+        :param item:
+        :type item: object
+        :returns: The decoded response entity, or None if the response
+          has no entity.
+        """
+        while True:
+            entity = None
+            if item is not None and self.compressor is not None:
+                # compress on the executor so the event loop is not blocked
+                entity = yield from self.event_loop.run_in_executor(self.executor,
+                    self.encode_item, item)
+            elif item is not None:
+                entity = self.encode_item(item)
+            request = self.serialize_request(method, path, params, entity)
+            response = yield from self.send_request(method, path, request)
+            # if the server rejects the content encoding, then send the request again
+            # uncompressed, and if it rejects the request codec, then send it as JSON
+            if response.status_code == 415 and entity is not None:
+                if 'content-encoding' in entity[0] and self.compressor.reject():
+                    continue
+                if self.negotiator.reject():
+                    continue
+            break
+        if response.status_code in status_exceptions:
+            log.debug("%s %s returns %d %s:\n%s", method, path, response.status_code,
+                response.reason, response.body)
+            raise status_exceptions[response.status_code]()
+        try:
+            entity = self.negotiator.decode(response.headers.get('content-type'), response.body)
+        except ValueError:
+            log.debug("%s %s returns %d %s", method, path,
+                response.status_code, response.reason)
+        else:
+            log.debug("%s %s returns %d %s:\n%s", method, path,
+                response.status_code, response.reason, entity)
+            return entity
+
+    @asyncio.coroutine
+    def send_request(self, method, path, request):
+        """
+        Send the serialized request on a pooled connection and wait for the
+        response.  A non-idempotent request waits for an idle connection.
+
+        :param method:
+        :type method: str
+        :param path:
+        :type path: str
+        :param request:
+        :type request: bytes
+        :rtype: HttpResponse
+        :raises RetryLater: The connection failed, or the response was not
+          received within request_timeout seconds.
+        """
+        pipelined = method in idempotent_methods
+        yield from self.in_flight.acquire()
+        try:
+            connection = self._select_connection(pipelined)
+            while connection is None:
+                yield from self.request_done.acquire()
+                try:
+                    yield from self.request_done.wait()
+                finally:
+                    self.request_done.release()
+                connection = self._select_connection(pipelined)
+            return (yield from connection.send(request, self.request_timeout))
+        finally:
+            self.in_flight.release()
+            yield from self.request_done.acquire()
+            self.request_done.notify_all()
+            self.request_done.release()
+
+    @asyncio.coroutine
+    def create_item(self, path, item):
+        return (yield from self.request('POST', path, item=item))
+
+    @asyncio.coroutine
+    def create_items(self, path, items):
+        entity = yield from self.request('POST', path, item=items)
+        return item_results(items, entity)
+
+    @asyncio.coroutine
+    def replace_item(self, path, item):
+        return (yield from self.request('PUT', path, item=item))
+
+    @asyncio.coroutine
+    def delete_item(self, path):
+        return (yield from self.request('DELETE', path))
+
+    @asyncio.coroutine
+    def get_item(self, path, filters):
+        return (yield from self.request('GET', path, params=filters))
+
+    @asyncio.coroutine
+    def patch_item(self, path, fields, constraints):
+        return (yield from self.request('PATCH', path, params=constraints, item=fields))
+
+    @asyncio.coroutine
+    def get_collection(self, path, matchers, count, last):
+        params = matchers.copy()
+        if count is not None:
+            params['limit'] = count
+        if last is not None:
+            params['last'] = last
+        return (yield from self.request('GET', path, params=params))
+
+    @asyncio.coroutine
+    def delete_collection(self, path, params):
+        raise NotImplementedError()
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        """
+        Wait for the connections closed by close() to finish.
+        """
+        for connection in self.closed_connections:
+            yield from connection.wait_closed()
+        self.closed_connections = []
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.closed_connections.extend(self.connections)
+        self.connections = []
@@ -29,6 +29,12 @@ setup(
     url="https://github.com/msfrank/mandelbrot",
     # installation dependencies
     install_requires=requirements,
+    # optional codecs and compression for the transport
+    extras_require={
+        'msgpack': ['msgpack'],
+        'cbor': ['cbor2'],
+        'zstd': ['zstandard'],
+        },
     # package classifiers for PyPI
     classifiers=[
         "Development Status :: 3 - Alpha",
@@ -78,6 +84,8 @@ setup(
             'dummy=mandelbrot.transport.dummy:DummyTransport',
             'http=mandelbrot.transport.http:HttpTransport',
             'https=mandelbrot.transport.http:HttpTransport',
+            'http+stream=mandelbrot.transport.stream:StreamTransport',
+            'https+stream=mandelbrot.transport.stream:StreamTransport',
             ],
         },
     # test dependencies
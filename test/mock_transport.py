@@ -11,6 +11,13 @@ class MockTransport(Transport):
     def create_item(self, path, item):
         return self.mock_create_item(path, item)
 
+    def mock_create_items(self, path, items):
+        raise NotImplementedError()
+
+    @asyncio.coroutine
+    def create_items(self, path, items):
+        return self.mock_create_items(path, items)
+
     def mock_replace_item(self, path, item):
         raise NotImplementedError()
 
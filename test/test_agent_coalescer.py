@@ -0,0 +1,66 @@
+import bootstrap
+
+import unittest
+import asyncio
+
+from mandelbrot.agent.coalescer import CoalescingQueue
+from mandelbrot.agent.evaluator import CheckEvaluation
+from mandelbrot.model.evaluation import Evaluation, HEALTHY, DEGRADED, FAILED
+
+def make_check_evaluation(check_id, health, summary):
+    evaluation = Evaluation()
+    evaluation.set_health(health)
+    evaluation.set_summary(summary)
+    return CheckEvaluation(check_id, evaluation)
+
+class TestCoalescingQueue(unittest.TestCase):
+
+    def test_coalesce_evaluations_with_same_health(self):
+        "A CoalescingQueue should keep only the freshest evaluation when health is unchanged"
+        event_loop = asyncio.new_event_loop()
+        queue = CoalescingQueue(event_loop)
+        queue.put_nowait(make_check_evaluation('check1', HEALTHY, '1'))
+        queue.put_nowait(make_check_evaluation('check1', HEALTHY, '2'))
+        queue.put_nowait(make_check_evaluation('check1', HEALTHY, '3'))
+        self.assertEqual(queue.qsize(), 1)
+        result = event_loop.run_until_complete(asyncio.wait_for(queue.get(), 5.0, loop=event_loop))
+        self.assertEqual(result.evaluation.get_summary(), '3')
+        self.assertTrue(queue.empty())
+        event_loop.close()
+
+    def test_keep_health_transitions(self):
+        "A CoalescingQueue should keep every health transition in order"
+        event_loop = asyncio.new_event_loop()
+        queue = CoalescingQueue(event_loop)
+        queue.put_nowait(make_check_evaluation('check1', HEALTHY, '1'))
+        queue.put_nowait(make_check_evaluation('check1', FAILED, '2'))
+        queue.put_nowait(make_check_evaluation('check1', FAILED, '3'))
+        queue.put_nowait(make_check_evaluation('check1', HEALTHY, '4'))
+        self.assertEqual(queue.qsize(), 3)
+        summaries = [queue.get_nowait().evaluation.get_summary() for _ in range(3)]
+        self.assertEqual(summaries, ['1', '3', '4'])
+        self.assertRaises(asyncio.QueueEmpty, queue.get_nowait)
+        event_loop.close()
+
+    def test_dequeue_checks_round_robin(self):
+        "A CoalescingQueue should alternate between checks when dequeuing"
+        event_loop = asyncio.new_event_loop()
+        queue = CoalescingQueue(event_loop)
+        queue.put_nowait(make_check_evaluation('check1', HEALTHY, '1'))
+        queue.put_nowait(make_check_evaluation('check1', DEGRADED, '2'))
+        queue.put_nowait(make_check_evaluation('check2', HEALTHY, '3'))
+        summaries = [queue.get_nowait().evaluation.get_summary() for _ in range(3)]
+        self.assertEqual(summaries, ['1', '3', '2'])
+        event_loop.close()
+
+    def test_drop_oldest_transition_when_full(self):
+        "A CoalescingQueue should drop the oldest transition when a check exceeds max_transitions"
+        event_loop = asyncio.new_event_loop()
+        queue = CoalescingQueue(event_loop, max_transitions=2)
+        queue.put_nowait(make_check_evaluation('check1', HEALTHY, '1'))
+        queue.put_nowait(make_check_evaluation('check1', FAILED, '2'))
+        queue.put_nowait(make_check_evaluation('check1', HEALTHY, '3'))
+        self.assertEqual(queue.qsize(), 2)
+        summaries = [queue.get_nowait().evaluation.get_summary() for _ in range(2)]
+        self.assertEqual(summaries, ['2', '3'])
+        event_loop.close()
@@ -0,0 +1,45 @@
+import bootstrap
+
+import unittest
+
+from mandelbrot.agent.credits import SubmitCredits, size_submit_credits, default_capacity
+
+class TestSubmitCredits(unittest.TestCase):
+
+    def test_acquire_up_to_capacity(self):
+        "SubmitCredits should refuse a credit when all credits are in use"
+        credits = SubmitCredits(2)
+        self.assertTrue(credits.acquire())
+        self.assertTrue(credits.acquire())
+        self.assertFalse(credits.acquire())
+        self.assertEqual(credits.available(), 0)
+        credits.release()
+        self.assertEqual(credits.available(), 1)
+
+    def test_stretch_when_exhausted_with_backlog(self):
+        "SubmitCredits should double the stretch when credits are exhausted and evaluations are waiting"
+        credits = SubmitCredits(1, max_stretch=4.0)
+        for expected in (2.0, 4.0, 4.0):
+            credits.acquire()
+            credits.release(backlog=3)
+            self.assertEqual(credits.stretch, expected)
+
+    def test_relax_stretch_when_backlog_clears(self):
+        "SubmitCredits should halve the stretch once the backlog clears"
+        credits = SubmitCredits(1)
+        credits.stretch = 4.0
+        credits.acquire()
+        credits.release(backlog=0)
+        self.assertEqual(credits.stretch, 2.0)
+        credits.acquire()
+        credits.release(backlog=0)
+        credits.acquire()
+        credits.release(backlog=0)
+        self.assertEqual(credits.stretch, 1.0)
+
+    def test_size_submit_credits(self):
+        "size_submit_credits() should choose the smallest specified bound"
+        self.assertEqual(size_submit_credits(), default_capacity)
+        self.assertEqual(size_submit_credits(8), 8)
+        self.assertEqual(size_submit_credits(None, 4), 4)
+        self.assertEqual(size_submit_credits(8, 4), 4)
@@ -13,6 +13,12 @@ from mandelbrot.agent.endpoint import Endpoint
 from mandelbrot.model import construct
 from mandelbrot.model.agent_metadata import AgentMetadata
 from mandelbrot.model.registration import Registration
+from mandelbrot.model.evaluation import Evaluation
+from mandelbrot.model.constants import SourceType
+from mandelbrot.model.metric_schema import make_metric_schemas
+from mandelbrot.model.fingerprint import make_fingerprint
+from mandelbrot.model.check import Check
+from mandelbrot.check import make_metric
 from mandelbrot.model.timestamp import Timestamp, UTC
 
 class TestEndpoint(unittest.TestCase):
@@ -41,3 +47,138 @@ class TestEndpoint(unittest.TestCase):
         self.assertEqual(transport.mock_create_item.call_count, 1)
         call_args,call_kwargs = transport.mock_create_item.call_args
         self.assertEqual(call_args[0], 'v2/agents')
+
+    def make_registration(self):
+        registration = Registration()
+        registration.set_agent_id(self.agent_id)
+        check_id = cifparser.make_path('load')
+        registration.set_metric(check_id, 'load1', make_metric(SourceType.GAUGE, 'load'))
+        registration.set_metric(check_id, 'load5', make_metric(SourceType.GAUGE, 'load'))
+        registration.set_metric(check_id, 'load15', make_metric(SourceType.GAUGE, 'load'))
+        return registration
+
+    def test_submit_positional_metrics(self):
+        "An Endpoint should submit registered metrics as a positional vector"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = MockTransport(self.url, event_loop, executor)
+        transport.mock_create_item = unittest.mock.Mock(return_value=None)
+        endpoint = Endpoint(transport, positional_metrics=True)
+        endpoint.metric_schemas = make_metric_schemas(self.make_registration())
+        evaluation = Evaluation()
+        evaluation.set_metric('load1', 1.0)
+        evaluation.set_metric('load15', 15.0)
+        future = asyncio.wait_for(endpoint.submit_evaluation(self.agent_id,
+            cifparser.make_path('load'), evaluation), 5.0, loop=event_loop)
+        event_loop.run_until_complete(future)
+        call_args,call_kwargs = transport.mock_create_item.call_args
+        self.assertEqual(call_args[0], 'v2/agents/foo.local/checks/load')
+        item = call_args[1]
+        self.assertNotIn('metrics', item)
+        self.assertEqual(item['metricSchema'], endpoint.metric_schemas['load'].version)
+        self.assertListEqual(item['metricVector'], [1.0, 15.0, None])
+        self.assertDictEqual(endpoint.metric_schemas['load'].unpack(item['metricVector']),
+            {'load1': 1.0, 'load15': 15.0})
+        event_loop.close()
+
+    def test_submit_unregistered_metrics_by_name(self):
+        "An Endpoint should submit metrics by name if any metric is not registered"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = MockTransport(self.url, event_loop, executor)
+        transport.mock_create_item = unittest.mock.Mock(return_value=None)
+        endpoint = Endpoint(transport, positional_metrics=True)
+        endpoint.metric_schemas = make_metric_schemas(self.make_registration())
+        evaluation = Evaluation()
+        evaluation.set_metric('load1', 1.0)
+        evaluation.set_metric('load30', 30.0)
+        future = asyncio.wait_for(endpoint.submit_evaluation(self.agent_id,
+            cifparser.make_path('load'), evaluation), 5.0, loop=event_loop)
+        event_loop.run_until_complete(future)
+        call_args,call_kwargs = transport.mock_create_item.call_args
+        self.assertDictEqual(call_args[1], {'metrics': {'load1': 1.0, 'load30': 30.0}})
+        event_loop.close()
+
+    def make_checks_registration(self, *check_names):
+        registration = Registration()
+        registration.set_agent_id(self.agent_id)
+        for check_name in check_names:
+            check_id = cifparser.make_path(check_name)
+            check = Check()
+            check.set_check_id(check_id)
+            check.set_behavior_type(check_name)
+            registration.set_check(check_id, check)
+        return registration
+
+    def make_agent_metadata(self, generation):
+        agent_metadata = AgentMetadata()
+        agent_metadata.set_agent_id(self.agent_id)
+        agent_metadata.set_joined_on(construct(Timestamp, 0))
+        agent_metadata.set_last_update(construct(Timestamp, 0))
+        agent_metadata.set_generation(generation)
+        return agent_metadata.destructure()
+
+    def test_synchronize_unchanged_registration(self):
+        "An Endpoint should not send a registration which the endpoint already accepted"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = MockTransport(self.url, event_loop, executor)
+        transport.mock_create_item = unittest.mock.Mock()
+        transport.mock_replace_item = unittest.mock.Mock()
+        transport.mock_patch_item = unittest.mock.Mock()
+        endpoint = Endpoint(transport)
+        registration = self.make_checks_registration('cpu', 'load')
+        accepted = make_fingerprint(self.make_checks_registration('load', 'cpu'))
+        accepted.set_generation(2)
+        future = asyncio.wait_for(endpoint.synchronize_agent(self.agent_id,
+            registration, accepted), 5.0, loop=event_loop)
+        fingerprint = event_loop.run_until_complete(future)
+        self.assertEqual(fingerprint.get_digest(), accepted.get_digest())
+        self.assertEqual(fingerprint.get_generation(), 2)
+        self.assertEqual(transport.mock_create_item.call_count, 0)
+        self.assertEqual(transport.mock_replace_item.call_count, 0)
+        self.assertEqual(transport.mock_patch_item.call_count, 0)
+        event_loop.close()
+
+    def test_synchronize_changed_checks(self):
+        "An Endpoint should patch only the checks which changed since the registration was accepted"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = MockTransport(self.url, event_loop, executor)
+        transport.mock_patch_item = unittest.mock.Mock(return_value=self.make_agent_metadata(3))
+        endpoint = Endpoint(transport)
+        registration = self.make_checks_registration('cpu', 'memory')
+        accepted = make_fingerprint(self.make_checks_registration('cpu', 'load'))
+        accepted.set_generation(2)
+        future = asyncio.wait_for(endpoint.synchronize_agent(self.agent_id,
+            registration, accepted), 5.0, loop=event_loop)
+        fingerprint = event_loop.run_until_complete(future)
+        self.assertEqual(fingerprint.get_digest(), make_fingerprint(registration).get_digest())
+        self.assertEqual(fingerprint.get_generation(), 3)
+        call_args,call_kwargs = transport.mock_patch_item.call_args
+        self.assertEqual(call_args[0], 'v2/agents/foo.local')
+        self.assertDictEqual(call_args[1], {
+            'checks/memory': registration.get_check(cifparser.make_path('memory')).destructure(),
+            'checks/load': None})
+        self.assertDictEqual(call_args[2], {'generation': 2})
+        event_loop.close()
+
+    def test_synchronize_rejected_patch(self):
+        "An Endpoint should send the full registration if the endpoint rejects the patch"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = MockTransport(self.url, event_loop, executor)
+        transport.mock_patch_item = unittest.mock.Mock(side_effect=Conflict())
+        transport.mock_create_item = unittest.mock.Mock(side_effect=Conflict())
+        transport.mock_replace_item = unittest.mock.Mock(return_value=self.make_agent_metadata(4))
+        endpoint = Endpoint(transport)
+        registration = self.make_checks_registration('cpu', 'memory')
+        accepted = make_fingerprint(self.make_checks_registration('cpu'))
+        future = asyncio.wait_for(endpoint.synchronize_agent(self.agent_id,
+            registration, accepted), 5.0, loop=event_loop)
+        fingerprint = event_loop.run_until_complete(future)
+        self.assertEqual(fingerprint.get_generation(), 4)
+        self.assertEqual(transport.mock_patch_item.call_count, 1)
+        call_args,call_kwargs = transport.mock_replace_item.call_args
+        self.assertDictEqual(call_args[1], registration.destructure())
+        event_loop.close()
@@ -3,8 +3,14 @@ import bootstrap
 import unittest
 import asyncio
 import concurrent.futures
+import time
 
 import mandelbrot.agent.evaluator
+from mandelbrot.agent.worker import WorkerPool
+from mandelbrot.agent.threads import ThreadPool
+from mandelbrot.check import EXECUTION_INLINE, EXECUTION_THREAD, EXECUTION_PROCESS
+from mandelbrot.model.evaluation import UNKNOWN
+from mandelbrot.stats import get_stats
 
 class CheckSuccess(object):
     def __init__(self, s):
@@ -40,8 +46,38 @@ class CheckContext(object):
         if context['current'] != self.current:
             raise Exception("context.current != self.current")
 
+class CheckHangs(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+    def execute(self, evaluation, context):
+        time.sleep(self.seconds)
+        evaluation.set_summary("check returned")
+    def init(self):
+        return None
+    def fini(self, context):
+        pass
+
+class CheckLifecycle(object):
+    def __init__(self, s, seconds=0.0):
+        self.s = s
+        self.seconds = seconds
+        self.finished = False
+    def execute(self, evaluation, context):
+        time.sleep(self.seconds)
+        evaluation.set_summary(self.s)
+    def init(self):
+        return None
+    def fini(self, context):
+        self.finished = True
+
 class TestEvaluator(unittest.TestCase):
 
+    def shutdown(self, event_loop, evaluator_task, shutdown_signal):
+        "stop the evaluator and close the event loop"
+        shutdown_signal.set()
+        event_loop.run_until_complete(asyncio.wait_for(evaluator_task, 5.0, loop=event_loop))
+        event_loop.close()
+
     check1 = mandelbrot.agent.evaluator.ScheduledCheck('id1', CheckSuccess("check1"), 1.2, 0.0, 0.0)
 
     check2 = mandelbrot.agent.evaluator.ScheduledCheck('id2', CheckSuccess("check2"), 1.2, 0.4, 0.0)
@@ -61,13 +97,14 @@ class TestEvaluator(unittest.TestCase):
         checks = [self.check1, self.check2, self.check3]
         evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, checks, executor)
         shutdown_signal = asyncio.Event(loop=event_loop)
-        event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "check1")
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "check2")
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "check3")
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
 
     def test_evaluate_checks_using_process_pool(self):
         "An Evaluator should submit checks to a ProcessPoolExecutor and return the result"
@@ -76,13 +113,14 @@ class TestEvaluator(unittest.TestCase):
         checks = [self.check1, self.check2, self.check3]
         evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, checks, executor)
         shutdown_signal = asyncio.Event(loop=event_loop)
-        event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "check1")
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "check2")
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "check3")
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
 
     def test_handle_failed_check(self):
         "An Evaluator should continue processing if the check raises an exception"
@@ -91,11 +129,12 @@ class TestEvaluator(unittest.TestCase):
         checks = [self.check2, self.failure1]
         evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, checks, executor)
         shutdown_signal = asyncio.Event(loop=event_loop)
-        event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "check2")
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "check2")
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
 
     def test_pass_check_context(self):
         "An Evaluator should pass the context between check invocations"
@@ -104,7 +143,7 @@ class TestEvaluator(unittest.TestCase):
         checks = [self.context1, self.context2]
         evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, checks, executor)
         shutdown_signal = asyncio.Event(loop=event_loop)
-        event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "0")
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
@@ -113,3 +152,212 @@ class TestEvaluator(unittest.TestCase):
         self.assertEquals(result.evaluation.get_summary(), "2")
         result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
         self.assertEquals(result.evaluation.get_summary(), "3")
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
+
+    def test_evaluate_checks_inline(self):
+        "An Evaluator should execute inline checks on the event loop without an executor"
+        event_loop = asyncio.new_event_loop()
+        inline1 = mandelbrot.agent.evaluator.ScheduledCheck('id7', CheckContext(0), 1.0, 0.0, 0.0,
+            execution=EXECUTION_INLINE)
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [inline1], {})
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+        self.assertEquals(result.evaluation.get_summary(), "0")
+        result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+        self.assertEquals(result.evaluation.get_summary(), "2")
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
+
+    def test_route_checks_by_execution_class(self):
+        "An Evaluator should route each check to the executor for its execution class"
+        event_loop = asyncio.new_event_loop()
+        thread_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        process_executor = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [],
+            {EXECUTION_THREAD: thread_executor, EXECUTION_PROCESS: process_executor})
+        self.assertIsNone(evaluator.get_executor(EXECUTION_INLINE))
+        self.assertIs(evaluator.get_executor(EXECUTION_THREAD), thread_executor)
+        self.assertIs(evaluator.get_executor(EXECUTION_PROCESS), process_executor)
+        self.assertIs(evaluator.get_executor(None), process_executor)
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [],
+            {EXECUTION_THREAD: thread_executor})
+        self.assertIs(evaluator.get_executor(EXECUTION_PROCESS), thread_executor)
+        thread_executor.shutdown()
+        process_executor.shutdown()
+
+    def test_pass_check_context_using_worker_pool(self):
+        "An Evaluator should keep the context of each check in its worker"
+        event_loop = asyncio.new_event_loop()
+        pool = WorkerPool(event_loop, 2)
+        checks = [mandelbrot.agent.evaluator.ScheduledCheck('id8', CheckContext(0), 1.0, 0.0, 0.0),
+                  mandelbrot.agent.evaluator.ScheduledCheck('id9', CheckContext(1), 1.0, 0.5, 0.0)]
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, checks, {EXECUTION_PROCESS: pool})
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        summaries = []
+        for n in range(4):
+            result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+            summaries.append(result.evaluation.get_summary())
+        self.assertListEqual(summaries, ["0", "1", "2", "3"])
+        shutdown_signal.set()
+        event_loop.run_until_complete(asyncio.wait_for(evaluator_task, 5.0, loop=event_loop))
+        pool.shutdown()
+
+    def test_abandon_thread_check_after_timeout(self):
+        "An Evaluator should evaluate a check as UNKNOWN when it times out on a thread"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        check = mandelbrot.agent.evaluator.ScheduledCheck('id10', CheckHangs(1.0), 5.0, 0.0, 0.0,
+            execution=EXECUTION_THREAD, timeout=0.2)
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [check], {EXECUTION_THREAD: executor})
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+        self.assertEqual(result.check_id, 'id10')
+        self.assertEqual(result.evaluation.get_health(), UNKNOWN)
+        self.assertIn('id10', evaluator.abandoned)
+        event_loop.run_until_complete(asyncio.sleep(1.0, loop=event_loop))
+        self.assertNotIn('id10', evaluator.abandoned)
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
+        executor.shutdown()
+
+    def test_replace_thread_after_timeout(self):
+        "An Evaluator should replace an abandoned thread, and clean up the check once it returns"
+        event_loop = asyncio.new_event_loop()
+        pool = ThreadPool(1)
+        hangs = CheckLifecycle("hangs", 2.0)
+        check = mandelbrot.agent.evaluator.ScheduledCheck('id10', hangs, 5.0, 0.0, 0.0,
+            execution=EXECUTION_THREAD, timeout=0.2)
+        other = mandelbrot.agent.evaluator.ScheduledCheck('id1', CheckSuccess("check1"), 5.0, 0.3, 0.0,
+            execution=EXECUTION_THREAD)
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [check, other], {EXECUTION_THREAD: pool})
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        results = []
+        for n in range(2):
+            result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 0.8, loop=event_loop))
+            results.append((result.check_id, result.evaluation.get_health()))
+        self.assertEqual(results[0], ('id10', UNKNOWN))
+        # the other check runs on the replacement thread while the check hangs
+        self.assertEqual(results[1][0], 'id1')
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
+        self.assertFalse(hangs.finished)
+        time.sleep(2.0)
+        self.assertTrue(hangs.finished)
+        pool.shutdown()
+        self.assertEqual(len(pool.threads), 0)
+
+    def test_replace_worker_after_timeout(self):
+        "An Evaluator should replace the worker when a check times out in a worker process"
+        event_loop = asyncio.new_event_loop()
+        pool = WorkerPool(event_loop, 1)
+        check = mandelbrot.agent.evaluator.ScheduledCheck('id11', CheckHangs(60.0), 5.0, 0.0, 0.0,
+            execution=EXECUTION_PROCESS, timeout=0.2)
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [check], {EXECUTION_PROCESS: pool})
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        event_loop.run_until_complete(asyncio.sleep(0.1, loop=event_loop))
+        old_process = pool.workers[0].process
+        result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+        self.assertEqual(result.check_id, 'id11')
+        self.assertEqual(result.evaluation.get_health(), UNKNOWN)
+        self.assertIsNot(pool.workers[0].process, old_process)
+        old_process.join(5.0)
+        self.assertFalse(old_process.is_alive())
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
+        pool.shutdown()
+
+    def test_shutdown_during_hung_worker_check(self):
+        "An Evaluator should replace the worker instead of waiting for a hung check at shutdown"
+        event_loop = asyncio.new_event_loop()
+        pool = WorkerPool(event_loop, 1)
+        check = mandelbrot.agent.evaluator.ScheduledCheck('id15', CheckHangs(60.0), 5.0, 0.0, 0.0,
+            execution=EXECUTION_PROCESS, timeout=30.0)
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [check], {EXECUTION_PROCESS: pool})
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        event_loop.run_until_complete(asyncio.sleep(0.2, loop=event_loop))
+        self.assertIn('id15', evaluator.checks_running)
+        old_process = pool.workers[0].process
+        started = time.time()
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
+        self.assertLess(time.time() - started, 2.0)
+        self.assertIsNot(pool.workers[0].process, old_process)
+        old_process.join(5.0)
+        self.assertFalse(old_process.is_alive())
+        pool.shutdown()
+
+    def test_catch_up_missed_intervals(self):
+        "An Evaluator should run each missed interval of a catch up check after the previous run completes"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        check = mandelbrot.agent.evaluator.ScheduledCheck('id16', CheckLifecycle("check", 0.05),
+            0.2, 0.0, 0.0, catch_up=True, execution=EXECUTION_THREAD)
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [check], {EXECUTION_THREAD: executor})
+        skipped = get_stats('mandelbrot.agent.evaluator').get_counter('skipped checks')
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+        first = result.evaluation.get_timestamp().destructure()
+        # block the event loop so the next three intervals are missed
+        time.sleep(0.7)
+        timestamps = []
+        for n in range(3):
+            result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+            timestamps.append(result.evaluation.get_timestamp().destructure() - first)
+        for n,timestamp in enumerate(timestamps):
+            self.assertAlmostEqual(timestamp, (n + 1) * 200, delta=20)
+        self.assertEqual(get_stats('mandelbrot.agent.evaluator').get_counter('skipped checks'), skipped)
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
+        executor.shutdown()
+
+    def test_add_and_remove_checks(self):
+        "An Evaluator should start added checks and stop removed checks while it is running"
+        event_loop = asyncio.new_event_loop()
+        check1 = CheckLifecycle("check1")
+        check2 = CheckLifecycle("check2")
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [
+            mandelbrot.agent.evaluator.ScheduledCheck('id12', check1, 0.2, 0.0, 0.0,
+                execution=EXECUTION_INLINE)], {})
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+        self.assertEqual(result.check_id, 'id12')
+        event_loop.run_until_complete(evaluator.add_check(
+            mandelbrot.agent.evaluator.ScheduledCheck('id13', check2, 0.2, 0.0, 0.0,
+                execution=EXECUTION_INLINE)))
+        event_loop.run_until_complete(evaluator.remove_check('id12'))
+        self.assertTrue(check1.finished)
+        result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+        self.assertEqual(result.check_id, 'id13')
+        self.assertFalse(check2.finished)
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
+        self.assertTrue(check2.finished)
+
+    def test_replace_running_check(self):
+        "An Evaluator should start a replacement check once the running check it replaces completes"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        old_check = CheckLifecycle("old", 0.5)
+        new_check = CheckLifecycle("new")
+        evaluator = mandelbrot.agent.evaluator.Evaluator(event_loop, [
+            mandelbrot.agent.evaluator.ScheduledCheck('id14', old_check, 5.0, 0.0, 0.0,
+                execution=EXECUTION_THREAD)], {EXECUTION_THREAD: executor})
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        evaluator_task = event_loop.create_task(evaluator.run_until_signaled(shutdown_signal))
+        event_loop.run_until_complete(asyncio.sleep(0.1, loop=event_loop))
+        self.assertIn('id14', evaluator.checks_running)
+        event_loop.run_until_complete(evaluator.remove_check('id14'))
+        event_loop.run_until_complete(evaluator.add_check(
+            mandelbrot.agent.evaluator.ScheduledCheck('id14', new_check, 5.0, 0.0, 0.0,
+                execution=EXECUTION_THREAD)))
+        self.assertFalse(old_check.finished)
+        self.assertIn('id14', evaluator.deferred)
+        result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+        self.assertEqual(result.evaluation.get_summary(), "old")
+        self.assertTrue(old_check.finished)
+        result = event_loop.run_until_complete(asyncio.wait_for(evaluator.next_evaluation(), 5.0, loop=event_loop))
+        self.assertEqual(result.evaluation.get_summary(), "new")
+        self.shutdown(event_loop, evaluator_task, shutdown_signal)
+        self.assertTrue(new_check.finished)
+        executor.shutdown()
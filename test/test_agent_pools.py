@@ -0,0 +1,45 @@
+import bootstrap
+
+import unittest
+
+from mandelbrot.agent.pools import parse_pool_size, size_check_pools, size_transport_pool
+from mandelbrot.agent.scheduled_check import ScheduledCheck
+from mandelbrot.check import EXECUTION_INLINE, EXECUTION_THREAD, EXECUTION_PROCESS
+
+def make_checks(execution, count):
+    return [ScheduledCheck('{}{}'.format(execution, n), None, 1.0, 0.0, 0.0, execution=execution)
+            for n in range(count)]
+
+class TestPools(unittest.TestCase):
+
+    def test_parse_pool_size(self):
+        "parse_pool_size should parse a positive integer or 'auto'"
+        self.assertEqual(parse_pool_size('4'), 4)
+        self.assertIsNone(parse_pool_size('auto'))
+        self.assertIsNone(parse_pool_size(' AUTO '))
+        with self.assertRaises(ValueError):
+            parse_pool_size('0')
+        with self.assertRaises(ValueError):
+            parse_pool_size('many')
+
+    def test_size_check_pools_automatically(self):
+        "size_check_pools should size each pool by CPU count and the check mix"
+        checks = make_checks(EXECUTION_INLINE, 5) + make_checks(EXECUTION_THREAD, 3) \
+            + make_checks(EXECUTION_PROCESS, 10)
+        pool_sizes = size_check_pools(checks, cpu_count=2)
+        self.assertDictEqual(pool_sizes, {EXECUTION_THREAD: 3, EXECUTION_PROCESS: 2})
+        pool_sizes = size_check_pools(checks, cpu_count=64)
+        self.assertDictEqual(pool_sizes, {EXECUTION_THREAD: 3, EXECUTION_PROCESS: 10})
+
+    def test_size_check_pools_explicitly(self):
+        "size_check_pools should only create the pools which are needed"
+        checks = make_checks(EXECUTION_INLINE, 5) + make_checks(EXECUTION_THREAD, 3)
+        pool_sizes = size_check_pools(checks, 8)
+        self.assertDictEqual(pool_sizes, {EXECUTION_THREAD: 8})
+        self.assertDictEqual(size_check_pools(make_checks(EXECUTION_INLINE, 5)), {})
+
+    def test_size_transport_pool(self):
+        "size_transport_pool should size the pool by CPU count unless specified"
+        self.assertEqual(size_transport_pool(cpu_count=2), 6)
+        self.assertEqual(size_transport_pool(cpu_count=64), 32)
+        self.assertEqual(size_transport_pool(3, cpu_count=64), 3)
@@ -9,7 +9,8 @@ import cifparser
 from mandelbrot.transport import Transport
 from mandelbrot.agent.endpoint import Endpoint
 from mandelbrot.agent.evaluator import Evaluator, ScheduledCheck
-from mandelbrot.agent.processor import process_evaluations
+from mandelbrot.agent.processor import Processor, process_evaluations
+from mandelbrot.agent.credits import SubmitCredits
 from mandelbrot.check import Check
 from mandelbrot.model import construct
 from mandelbrot.model.constants import CheckHealth
@@ -18,9 +19,14 @@ from mandelbrot.model.timestamp import Timestamp
 class MockTransport(Transport):
     def __init__(self):
         self.mock_create_item = unittest.mock.Mock(return_value=None)
+        self.mock_create_items = unittest.mock.Mock(return_value=None)
     @asyncio.coroutine
     def create_item(self, path, item):
         yield self.mock_create_item(path, item)
+    @asyncio.coroutine
+    def create_items(self, path, items):
+        self.mock_create_items(path, items)
+        return [None for item in items]
 
 class MockCheck(Check):
     """
@@ -57,3 +63,91 @@ class TestProcessor(unittest.TestCase):
             unittest.mock.call('v2/agents/foo.local/checks/id1', {'summary': 'check returns healthy', 'health': 'healthy', 'timestamp': 0}),
             unittest.mock.call('v2/agents/foo.local/checks/id1', {'summary': 'check returns healthy', 'health': 'healthy', 'timestamp': 0}),
         ])
+
+    def test_process_evaluations_in_batches(self):
+        "process_evaluations() should submit batches of evaluations to the endpoint"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        evaluator = Evaluator(event_loop, [self.check1], executor)
+        agent_id = cifparser.make_path("foo.local")
+        transport = MockTransport()
+        endpoint = Endpoint(transport)
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        event_loop.call_later(1.0, shutdown_signal.set)
+        process_task = process_evaluations(event_loop, evaluator, agent_id, endpoint,
+            shutdown_signal, batch_size=2, batch_window=5.0)
+        event_loop.run_until_complete(asyncio.wait_for(process_task, 3.0, loop=event_loop))
+        self.assertEqual(transport.mock_create_item.call_count, 0)
+        evaluation = {'summary': 'check returns healthy', 'health': 'healthy', 'timestamp': 0, 'checkId': 'id1'}
+        self.assertListEqual(transport.mock_create_items.call_args_list, [
+            unittest.mock.call('v2/agents/foo.local/evaluations', [evaluation, evaluation]),
+            unittest.mock.call('v2/agents/foo.local/evaluations', [evaluation]),
+        ])
+
+    def test_process_evaluations_submits_partial_batch_on_shutdown(self):
+        "process_evaluations() should submit the partial batch when it is signaled"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        evaluator = Evaluator(event_loop, [self.check1], executor)
+        agent_id = cifparser.make_path("foo.local")
+        transport = MockTransport()
+        endpoint = Endpoint(transport)
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        event_loop.call_later(1.0, shutdown_signal.set)
+        process_task = process_evaluations(event_loop, evaluator, agent_id, endpoint,
+            shutdown_signal, batch_size=10, batch_window=30.0)
+        event_loop.run_until_complete(asyncio.wait_for(process_task, 3.0, loop=event_loop))
+        evaluation = {'summary': 'check returns healthy', 'health': 'healthy', 'timestamp': 0, 'checkId': 'id1'}
+        self.assertListEqual(transport.mock_create_items.call_args_list, [
+            unittest.mock.call('v2/agents/foo.local/evaluations', [evaluation, evaluation, evaluation]),
+        ])
+        event_loop.close()
+
+    def test_process_evaluations_limits_submissions_in_flight(self):
+        "process_evaluations() should not submit more evaluations than there are credits"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        check2 = ScheduledCheck('id2', MockCheck(), 0.1, 0.0, 0.0)
+        evaluator = Evaluator(event_loop, [check2], executor)
+        agent_id = cifparser.make_path("foo.local")
+        in_flight = []
+        max_in_flight = []
+        @asyncio.coroutine
+        def slow_create_item(path, item):
+            in_flight.append(path)
+            max_in_flight.append(len(in_flight))
+            yield from asyncio.sleep(0.5, loop=event_loop)
+            in_flight.remove(path)
+        transport = MockTransport()
+        transport.create_item = slow_create_item
+        endpoint = Endpoint(transport)
+        credits = SubmitCredits(1)
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        event_loop.call_later(1.2, shutdown_signal.set)
+        process_task = process_evaluations(event_loop, evaluator, agent_id, endpoint,
+            shutdown_signal, credits=credits)
+        event_loop.run_until_complete(asyncio.wait_for(process_task, 3.0, loop=event_loop))
+        self.assertEqual(max(max_in_flight), 1)
+        self.assertGreater(credits.stretch, 1.0)
+        self.assertEqual(evaluator.stretch, credits.stretch)
+        event_loop.close()
+
+    def test_synchronize_full_registration_on_start(self):
+        "A Processor should send the full registration when starting, and use the fingerprint when reloading"
+        event_loop = asyncio.new_event_loop()
+        instance = unittest.mock.MagicMock()
+        accepted = unittest.mock.Mock()
+        instance.get_registration_fingerprint.return_value = accepted
+        endpoint = unittest.mock.Mock()
+        @asyncio.coroutine
+        def synchronize_agent(agent_id, registration, accepted=None):
+            return 'fingerprint'
+        endpoint.synchronize_agent = unittest.mock.Mock(side_effect=synchronize_agent)
+        processor = Processor(event_loop, instance, None, None)
+        processor.agent_id = cifparser.make_path('foo.local')
+        event_loop.run_until_complete(processor.synchronize(endpoint, 'registration', incremental=False))
+        self.assertIsNone(endpoint.synchronize_agent.call_args[0][2])
+        event_loop.run_until_complete(processor.synchronize(endpoint, 'registration'))
+        self.assertIs(endpoint.synchronize_agent.call_args[0][2], accepted)
+        self.assertEqual(instance.set_registration_fingerprint.call_count, 2)
+        event_loop.close()
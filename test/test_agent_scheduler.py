@@ -2,8 +2,10 @@ import bootstrap
 
 import unittest
 import asyncio
+import time
 
 import mandelbrot.agent.scheduler
+from mandelbrot.stats import get_stats
 
 class TestScheduler(unittest.TestCase):
 
@@ -62,3 +64,93 @@ class TestScheduler(unittest.TestCase):
         self.assertEquals(f, self.f3)
 
 
+
+    def test_next_batch(self):
+        "A Scheduler should return all tasks which are due in a single batch"
+        event_loop = asyncio.new_event_loop()
+        scheduler = mandelbrot.agent.scheduler.Scheduler(event_loop)
+        scheduler.schedule_task(self.f1, 3.0, 0.1, 0.0)
+        scheduler.schedule_task(self.f2, 3.0, 0.0, 0.0)
+        scheduler.schedule_task(self.f3, 3.0, 0.5, 0.0)
+        event_loop.run_until_complete(asyncio.sleep(0.2, loop=event_loop))
+        batch = event_loop.run_until_complete(asyncio.wait_for(scheduler.next_batch(), 5.0, loop=event_loop))
+        self.assertListEqual(batch, [self.f2, self.f1])
+        batch = event_loop.run_until_complete(asyncio.wait_for(scheduler.next_batch(), 5.0, loop=event_loop))
+        self.assertListEqual(batch, [self.f3])
+        scheduler.unschedule_all()
+
+    def test_schedule_without_drift(self):
+        "A Scheduler should compute the next scheduled time from the previous scheduled time"
+        event_loop = asyncio.new_event_loop()
+        scheduler = mandelbrot.agent.scheduler.Scheduler(event_loop)
+        scheduler.schedule_task(self.f1, 0.1, 0.0, 0.0)
+        task = scheduler.task_list[self.f1]
+        start = task.next_scheduled_time
+        for n in range(5):
+            event_loop.run_until_complete(asyncio.wait_for(scheduler.next_task(), 5.0, loop=event_loop))
+            # consume the task late, which must not delay the following intervals
+            event_loop.run_until_complete(asyncio.sleep(0.03, loop=event_loop))
+        self.assertAlmostEqual(task.next_scheduled_time, start + 0.5)
+        scheduler.unschedule_all()
+
+    def test_skip_missed_intervals(self):
+        "A Scheduler should skip intervals which were missed, and never queue a task twice"
+        event_loop = asyncio.new_event_loop()
+        scheduler = mandelbrot.agent.scheduler.Scheduler(event_loop)
+        scheduler.schedule_task(self.f1, 0.1, 0.0, 0.0)
+        task = scheduler.task_list[self.f1]
+        start = task.next_scheduled_time
+        event_loop.run_until_complete(asyncio.sleep(0.35, loop=event_loop))
+        batch = event_loop.run_until_complete(asyncio.wait_for(scheduler.next_batch(), 5.0, loop=event_loop))
+        self.assertListEqual(batch, [self.f1])
+        self.assertGreater(task.next_scheduled_time, event_loop.time())
+        intervals = (task.next_scheduled_time - start) / 0.1
+        self.assertAlmostEqual(intervals, round(intervals), delta=0.001)
+        scheduler.unschedule_all()
+
+    def test_schedule_aligned(self):
+        "A Scheduler should schedule an aligned task on the wall clock grid"
+        event_loop = asyncio.new_event_loop()
+        scheduler = mandelbrot.agent.scheduler.Scheduler(event_loop)
+        scheduler.schedule_task(self.f1, 0.2, 0.05, 0.01, aligned=True)
+        task = scheduler.task_list[self.f1]
+        wall_time = scheduler.wall_time() + (task.next_scheduled_time - event_loop.time())
+        self.assertAlmostEqual((wall_time - 0.06) / 0.2, round((wall_time - 0.06) / 0.2), delta=0.01)
+        f = event_loop.run_until_complete(asyncio.wait_for(scheduler.next_task(), 5.0, loop=event_loop))
+        self.assertEquals(f, self.f1)
+        self.assertEqual(scheduler.get_lateness(self.f1).count, 1)
+        scheduler.unschedule_all()
+
+    def test_report_lateness_per_task(self):
+        "A Scheduler should report the lateness of each task in the lateness stats"
+        event_loop = asyncio.new_event_loop()
+        scheduler = mandelbrot.agent.scheduler.Scheduler(event_loop)
+        scheduler.schedule_task(self.f1, 0.1, 0.0, 0.0)
+        stats = get_stats('mandelbrot.agent.lateness')
+        f = event_loop.run_until_complete(asyncio.wait_for(scheduler.next_task(), 5.0, loop=event_loop))
+        self.assertEquals(f, self.f1)
+        self.assertIs(stats.get_histogram(str(self.f1)), scheduler.get_lateness(self.f1))
+        self.assertEqual(stats.get_histogram(str(self.f1)).count, 1)
+        scheduler.unschedule_task(self.f1)
+        self.assertIsNone(stats.get_histogram(str(self.f1)))
+        scheduler.unschedule_all()
+
+    def test_catch_up_missed_intervals(self):
+        "A Scheduler should run missed intervals of a task with the catch up policy"
+        event_loop = asyncio.new_event_loop()
+        scheduler = mandelbrot.agent.scheduler.Scheduler(event_loop)
+        scheduler.schedule_task(self.f1, 0.1, 0.0, 0.0, catch_up=True)
+        task = scheduler.task_list[self.f1]
+        start = task.next_scheduled_time
+        wall_start = scheduler.wall_time() + (start - event_loop.time())
+        # block the event loop so the next three intervals are missed
+        time.sleep(0.35)
+        for n in range(4):
+            f = event_loop.run_until_complete(asyncio.wait_for(scheduler.next_task(), 5.0, loop=event_loop))
+            self.assertEquals(f, self.f1)
+            self.assertAlmostEqual(task.next_scheduled_time, start + 0.4)
+            self.assertAlmostEqual(scheduler.get_scheduled_time(self.f1), wall_start + n * 0.1, delta=0.01)
+            # the next missed interval is not ready until the run is done
+            self.assertEqual(len(scheduler.ready), 0)
+            scheduler.task_done(self.f1)
+        scheduler.unschedule_all()
@@ -0,0 +1,95 @@
+import bootstrap
+
+import unittest
+import asyncio
+import pathlib
+import tempfile
+import shutil
+import cifparser
+
+from mandelbrot.agent.spool import Spool
+from mandelbrot.model.evaluation import Evaluation
+from mandelbrot.transport import RetryLater, BadRequest
+
+def make_evaluation(summary):
+    evaluation = Evaluation()
+    evaluation.set_summary(summary)
+    return evaluation
+
+class TestSpool(unittest.TestCase):
+
+    tmp_path = pathlib.Path(tempfile.gettempdir(), 'fixture_TestSpool')
+
+    def setUp(self):
+        self.tmp_path.mkdir(parents=True)
+
+    def tearDown(self):
+        if self.tmp_path.exists():
+            shutil.rmtree(str(self.tmp_path))
+
+    def replay(self, event_loop, spool, results, duration, batch_size=1):
+        "replay the spool for the specified duration, returning the submitted summaries"
+        submitted = []
+        results = iter(results)
+        @asyncio.coroutine
+        def submit(evaluations):
+            submitted.extend([evaluation.get_summary() for _,evaluation in evaluations])
+            return [next(results) for _ in evaluations]
+        shutdown_signal = asyncio.Event(loop=event_loop)
+        event_loop.call_later(duration, shutdown_signal.set)
+        replay_task = spool.replay_until_signaled(submit, shutdown_signal,
+            batch_size=batch_size, min_backoff=0.1)
+        event_loop.run_until_complete(asyncio.wait_for(replay_task, 5.0, loop=event_loop))
+        return submitted
+
+    def test_replay_in_order(self):
+        "A Spool should replay appended evaluations in order"
+        event_loop = asyncio.new_event_loop()
+        spool = Spool(event_loop, self.tmp_path / 'spool', commit_delay=0.0)
+        for n in range(5):
+            spool.append(cifparser.make_path('check'), make_evaluation(str(n)))
+        self.assertFalse(spool.is_empty())
+        submitted = self.replay(event_loop, spool, [None] * 5, 0.5, batch_size=2)
+        self.assertListEqual(submitted, ['0', '1', '2', '3', '4'])
+        self.assertTrue(spool.is_empty())
+        event_loop.close()
+
+    def test_retry_after_backoff(self):
+        "A Spool should retry an evaluation which fails with a retryable error"
+        event_loop = asyncio.new_event_loop()
+        spool = Spool(event_loop, self.tmp_path / 'spool', commit_delay=0.0)
+        spool.append(cifparser.make_path('check'), make_evaluation('0'))
+        spool.append(cifparser.make_path('check'), make_evaluation('1'))
+        submitted = self.replay(event_loop, spool, [RetryLater(), None, BadRequest()], 0.5)
+        self.assertListEqual(submitted, ['0', '0', '1'])
+        self.assertTrue(spool.is_empty())
+        event_loop.close()
+
+    def test_persist_across_reopen(self):
+        "A Spool should replay only the unsubmitted evaluations after it is reopened"
+        event_loop = asyncio.new_event_loop()
+        spool = Spool(event_loop, self.tmp_path / 'spool', commit_delay=0.0)
+        for n in range(3):
+            spool.append(cifparser.make_path('check'), make_evaluation(str(n)))
+        submitted = self.replay(event_loop, spool, [None, RetryLater()], 0.05)
+        self.assertListEqual(submitted, ['0', '1'])
+        event_loop.run_until_complete(spool.close())
+        spool = Spool(event_loop, self.tmp_path / 'spool', commit_delay=0.0)
+        self.assertFalse(spool.is_empty())
+        submitted = self.replay(event_loop, spool, [None, None], 0.5)
+        self.assertListEqual(submitted, ['1', '2'])
+        event_loop.close()
+
+    def test_discard_oldest_when_full(self):
+        "A Spool should discard the oldest segments when it exceeds the maximum size"
+        event_loop = asyncio.new_event_loop()
+        spool = Spool(event_loop, self.tmp_path / 'spool', max_size=400, commit_delay=0.0)
+        for n in range(20):
+            spool.append(cifparser.make_path('check'), make_evaluation(str(n)))
+            event_loop.run_until_complete(spool.close())
+        self.assertLessEqual(spool.size(), 400)
+        self.assertGreater(spool.num_dropped_bytes, 0)
+        submitted = self.replay(event_loop, spool, [None] * 20, 0.5)
+        self.assertEqual(submitted[-1], '19')
+        self.assertNotEqual(submitted[0], '0')
+        event_loop.close()
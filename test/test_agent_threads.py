@@ -0,0 +1,50 @@
+import bootstrap
+
+import unittest
+import threading
+import time
+
+from mandelbrot.agent.threads import ThreadPool
+
+class TestThreadPool(unittest.TestCase):
+
+    def test_submit_call(self):
+        "A ThreadPool should run a submitted call and return its result"
+        pool = ThreadPool(2)
+        future = pool.submit(lambda x, y: x + y, 1, y=2)
+        self.assertEqual(future.result(5.0), 3)
+        pool.shutdown()
+        self.assertEqual(len(pool.threads), 0)
+
+    def test_threads_are_daemonic(self):
+        "A ThreadPool should run calls on daemon threads"
+        pool = ThreadPool(1)
+        future = pool.submit(lambda: threading.current_thread().daemon)
+        self.assertTrue(future.result(5.0))
+        pool.shutdown()
+
+    def test_replace_thread(self):
+        "A ThreadPool should run calls on a replacement thread while a call is stuck"
+        pool = ThreadPool(1)
+        release = threading.Event()
+        stuck = pool.submit(release.wait)
+        pool.replace_thread()
+        self.assertEqual(pool.submit(lambda: 1).result(5.0), 1)
+        release.set()
+        self.assertTrue(stuck.result(5.0))
+        # the extra thread exits once its call returns
+        time.sleep(0.1)
+        self.assertEqual(len(pool.threads), 1)
+        pool.shutdown()
+
+    def test_shutdown_without_waiting(self):
+        "A ThreadPool should not wait for a stuck call when shut down without waiting"
+        pool = ThreadPool(1)
+        release = threading.Event()
+        stuck = pool.submit(release.wait)
+        pool.shutdown(wait=False)
+        self.assertFalse(stuck.done())
+        with self.assertRaises(RuntimeError):
+            pool.submit(lambda: 1)
+        release.set()
+        self.assertTrue(stuck.result(5.0))
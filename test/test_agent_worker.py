@@ -0,0 +1,95 @@
+import bootstrap
+
+import unittest
+import asyncio
+
+from mandelbrot.agent.worker import WorkerPool, WorkerException
+
+class CounterCheck(object):
+    def init(self):
+        return {'count': 0}
+    def execute(self, evaluation, context):
+        context['count'] += 1
+        evaluation.set_summary(str(context['count']))
+    def fini(self, context):
+        pass
+
+class FailingCheck(object):
+    def init(self):
+        return None
+    def execute(self, evaluation, context):
+        raise ValueError("check failed")
+    def fini(self, context):
+        pass
+
+class TestWorkerPool(unittest.TestCase):
+
+    def run_coro(self, event_loop, coro):
+        return event_loop.run_until_complete(asyncio.wait_for(coro, 5.0, loop=event_loop))
+
+    def test_context_stays_in_worker(self):
+        "A WorkerPool should keep the check context in the worker between executions"
+        event_loop = asyncio.new_event_loop()
+        pool = WorkerPool(event_loop, 2)
+        check = CounterCheck()
+        context = check.init()
+        self.run_coro(event_loop, pool.assign('check1', check, context))
+        for n in range(1, 4):
+            evaluation = self.run_coro(event_loop, pool.execute('check1'))
+            self.assertEqual(evaluation.get_summary(), str(n))
+            self.assertIsNotNone(evaluation.get_timestamp())
+        self.assertEqual(context['count'], 0)
+        self.run_coro(event_loop, pool.release('check1'))
+        pool.shutdown()
+        event_loop.close()
+
+    def test_assign_to_least_loaded_worker(self):
+        "A WorkerPool should spread checks across its workers"
+        event_loop = asyncio.new_event_loop()
+        pool = WorkerPool(event_loop, 2)
+        for check_id in ('check1', 'check2', 'check3', 'check4'):
+            self.run_coro(event_loop, pool.assign(check_id, CounterCheck(), {'count': 0}))
+        self.assertListEqual([len(w.checks) for w in pool.workers], [2, 2])
+        pool.shutdown()
+        event_loop.close()
+
+    def test_check_raises_exception(self):
+        "A WorkerPool should raise the exception raised by the check"
+        event_loop = asyncio.new_event_loop()
+        pool = WorkerPool(event_loop, 1)
+        self.run_coro(event_loop, pool.assign('check1', FailingCheck(), None))
+        with self.assertRaises(ValueError):
+            self.run_coro(event_loop, pool.execute('check1'))
+        pool.shutdown()
+        event_loop.close()
+
+    def test_worker_exits(self):
+        "A WorkerPool should fail outstanding requests if a worker exits"
+        event_loop = asyncio.new_event_loop()
+        pool = WorkerPool(event_loop, 1)
+        self.run_coro(event_loop, pool.assign('check1', CounterCheck(), {'count': 0}))
+        pool.workers[0].process.terminate()
+        with self.assertRaises(WorkerException):
+            self.run_coro(event_loop, pool.execute('check1'))
+        pool.shutdown()
+        event_loop.close()
+
+    def test_replace_worker(self):
+        "A WorkerPool should replace a worker and reload the checks it held"
+        event_loop = asyncio.new_event_loop()
+        pool = WorkerPool(event_loop, 1)
+        self.run_coro(event_loop, pool.assign('check1', CounterCheck(), {'count': 0}))
+        self.run_coro(event_loop, pool.assign('check2', CounterCheck(), {'count': 0}))
+        self.run_coro(event_loop, pool.execute('check1'))
+        old_process = pool.workers[0].process
+        self.run_coro(event_loop, pool.replace('check1'))
+        self.assertIsNot(pool.workers[0].process, old_process)
+        old_process.join(5.0)
+        self.assertFalse(old_process.is_alive())
+        self.assertSetEqual(pool.workers[0].checks, {'check1', 'check2'})
+        evaluation = self.run_coro(event_loop, pool.execute('check1'))
+        self.assertEqual(evaluation.get_summary(), "1")
+        evaluation = self.run_coro(event_loop, pool.execute('check2'))
+        self.assertEqual(evaluation.get_summary(), "1")
+        pool.shutdown()
+        event_loop.close()
@@ -0,0 +1,44 @@
+import bootstrap
+
+import unittest
+import collections
+
+from mandelbrot.check.counters import DeviceCounters, parse_device_patterns, worst_health
+from mandelbrot.model.evaluation import HEALTHY, DEGRADED, FAILED
+
+MockCounters = collections.namedtuple('MockCounters', ['rx', 'tx'])
+
+class TestDeviceCounters(unittest.TestCase):
+
+    def test_parse_device_patterns(self):
+        "parse_device_patterns should split a list of patterns, or return None for all devices"
+        self.assertListEqual(parse_device_patterns("sda, sd[bc]  nvme*"), ['sda', 'sd[bc]', 'nvme*'])
+        self.assertIsNone(parse_device_patterns("all"))
+        self.assertIsNone(parse_device_patterns("*"))
+
+    def test_compute_rates(self):
+        "DeviceCounters should compute the rate of every counter on every selected device"
+        counters = DeviceCounters(['rx', 'tx'], ['eth*'])
+        context = counters.make_context({'eth0': MockCounters(0, 0), 'eth1': MockCounters(10, 10),
+                                         'lo': MockCounters(0, 0)}, 0.0)
+        devices, rates = counters.update(context, {'eth0': MockCounters(100, 50),
+            'eth1': MockCounters(30, 10), 'lo': MockCounters(1000, 1000)}, 10.0)
+        self.assertListEqual(devices, ['eth0', 'eth1'])
+        self.assertDictEqual(dict(counters.iter_rates(devices, rates)),
+            {'eth0': {'rx': 10.0, 'tx': 5.0}, 'eth1': {'rx': 2.0, 'tx': 0.0}})
+        self.assertEqual(context['timestamp'], 10.0)
+
+    def test_realign_devices(self):
+        "DeviceCounters should realign counters when devices appear, disappear or reset"
+        counters = DeviceCounters(['rx', 'tx'])
+        context = counters.make_context({'eth0': MockCounters(0, 0), 'eth1': MockCounters(50, 50)}, 0.0)
+        devices, rates = counters.update(context, {'eth1': MockCounters(10, 60),
+            'eth2': MockCounters(500, 500)}, 10.0)
+        self.assertListEqual(devices, ['eth1', 'eth2'])
+        self.assertDictEqual(dict(counters.iter_rates(devices, rates)),
+            {'eth1': {'rx': 0.0, 'tx': 1.0}, 'eth2': {'rx': 0.0, 'tx': 0.0}})
+
+    def test_worst_health(self):
+        "worst_health should return the most severe health"
+        self.assertEqual(worst_health([HEALTHY, FAILED, DEGRADED]), FAILED)
+        self.assertEqual(worst_health([]), HEALTHY)
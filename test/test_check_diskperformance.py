@@ -5,6 +5,7 @@ import unittest.mock
 import cifparser
 import collections
 
+from mandelbrot.check.sampling import SampleCache
 from mandelbrot.model.evaluation import *
 
 MockDiskIO = collections.namedtuple('MockDiskIO', ['read_count', 'write_count',
@@ -12,6 +13,12 @@ MockDiskIO = collections.namedtuple('MockDiskIO', ['read_count', 'write_count',
 
 class TestDiskPerformance(unittest.TestCase):
 
+    def setUp(self):
+        # each execution runs after the previous sample expired
+        patcher = unittest.mock.patch('mandelbrot.check.sampling._cache', SampleCache(ttl=0.0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @unittest.mock.patch('psutil.disk_io_counters')
     @unittest.mock.patch('time.time')
     def test_execute_DiskPerformance_check_healthy(self, time, disk_io_counters):
@@ -170,3 +177,49 @@ class TestDiskPerformance(unittest.TestCase):
         check.execute(evaluation, context)
         print(evaluation)
         self.assertEqual(evaluation.get_health(), FAILED)
+
+    @unittest.mock.patch('psutil.disk_io_counters')
+    @unittest.mock.patch('time.time')
+    def test_execute_DiskPerformance_check_multiple_devices(self, time, disk_io_counters):
+        "DiskPerformance check should evaluate every matching device and return the worst health"
+        time.side_effect = [0.0, 100.0]
+        idle = MockDiskIO(read_count=0.0, write_count=0.0, read_bytes=0,
+                          write_bytes=0, read_time=0.0, write_time=0.0)
+        disk_io_counters.side_effect = [
+            {'sda': idle, 'sdb': idle, 'loop0': idle},
+            {'sda': idle, 'sdb': MockDiskIO(read_count=10000.0, write_count=0.0, read_bytes=0,
+                                            write_bytes=0, read_time=0.0, write_time=0.0),
+             'loop0': idle},
+            ]
+        values = cifparser.ValueTree()
+        values.put_field(cifparser.ROOT_PATH, "disk devices", "sd*")
+        values.put_field(cifparser.ROOT_PATH, "read rate degraded threshold", "25 bytes/sec")
+        values.put_field(cifparser.ROOT_PATH, "read rate failed threshold", "75 bytes/sec")
+        ns = cifparser.Namespace(values)
+        from mandelbrot.check.diskperformance import DiskPerformance
+        check = DiskPerformance(ns)
+        evaluation = Evaluation()
+        context = check.init()
+        check.execute(evaluation, context)
+        print(evaluation)
+        self.assertEqual(evaluation.get_health(), FAILED)
+        self.assertEqual(evaluation.get_metric('sda.read_count'), 0.0)
+        self.assertEqual(evaluation.get_metric('sdb.read_count'), 100.0)
+        self.assertNotIn('loop0.read_count', dict(evaluation.list_metrics()))
+
+    @unittest.mock.patch('psutil.disk_io_counters')
+    def test_execute_DiskPerformance_check_device_within_sample_ttl(self, disk_io_counters):
+        "DiskPerformance check should report zero rates when executed before the initial sample expires"
+        disk_io_counters.return_value = {'sda': MockDiskIO(read_count=10.0, write_count=10.0,
+            read_bytes=0, write_bytes=0, read_time=0.0, write_time=0.0)}
+        values = cifparser.ValueTree()
+        values.put_field(cifparser.ROOT_PATH, "disk device", "sda")
+        ns = cifparser.Namespace(values)
+        from mandelbrot.check.diskperformance import DiskPerformance
+        check = DiskPerformance(ns)
+        evaluation = Evaluation()
+        with unittest.mock.patch('mandelbrot.check.sampling._cache', SampleCache(ttl=60.0)):
+            context = check.init()
+            check.execute(evaluation, context)
+        self.assertEqual(evaluation.get_health(), HEALTHY)
+        self.assertEqual(disk_io_counters.call_count, 1)
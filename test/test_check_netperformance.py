@@ -5,6 +5,7 @@ import unittest.mock
 import cifparser
 import collections
 
+from mandelbrot.check.sampling import SampleCache
 from mandelbrot.model.evaluation import *
 
 MockNetIO = collections.namedtuple('MockNetIO', [ 'bytes_sent', "bytes_recv",
@@ -12,6 +13,12 @@ MockNetIO = collections.namedtuple('MockNetIO', [ 'bytes_sent', "bytes_recv",
 
 class TestNetPerformance(unittest.TestCase):
 
+    def setUp(self):
+        # each execution runs after the previous sample expired
+        patcher = unittest.mock.patch('mandelbrot.check.sampling._cache', SampleCache(ttl=0.0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @unittest.mock.patch('psutil.net_io_counters')
     @unittest.mock.patch('time.time')
     def test_execute_NetPerformance_check_healthy(self, time, net_io_counters):
@@ -170,3 +177,33 @@ class TestNetPerformance(unittest.TestCase):
         check.execute(evaluation, context)
         print(evaluation)
         self.assertEqual(evaluation.get_health(), FAILED)
+
+    @unittest.mock.patch('psutil.net_io_counters')
+    @unittest.mock.patch('time.time')
+    def test_execute_NetPerformance_check_multiple_devices(self, time, net_io_counters):
+        "NetPerformance check should evaluate every matching interface and return the worst health"
+        time.side_effect = [0.0, 100.0]
+        idle = MockNetIO(bytes_sent=0, bytes_recv=0, packets_sent=0, packets_recv=0,
+                         errin=0, errout=0, dropin=0, dropout=0)
+        net_io_counters.side_effect = [
+            {'eth0': idle, 'veth1': idle, 'veth2': idle},
+            {'eth0': MockNetIO(bytes_sent=0, bytes_recv=100000, packets_sent=0, packets_recv=0,
+                               errin=0, errout=0, dropin=0, dropout=0),
+             'veth1': idle,
+             'veth2': MockNetIO(bytes_sent=5000, bytes_recv=0, packets_sent=0, packets_recv=0,
+                                errin=0, errout=0, dropin=0, dropout=0)},
+            ]
+        values = cifparser.ValueTree()
+        values.put_field(cifparser.ROOT_PATH, "net devices", "veth*")
+        values.put_field(cifparser.ROOT_PATH, "tx throughput degraded threshold", "25 bytes/sec")
+        values.put_field(cifparser.ROOT_PATH, "tx throughput failed threshold", "75 bytes/sec")
+        ns = cifparser.Namespace(values)
+        from mandelbrot.check.netperformance import NetPerformance
+        check = NetPerformance(ns)
+        evaluation = Evaluation()
+        context = check.init()
+        check.execute(evaluation, context)
+        print(evaluation)
+        self.assertEqual(evaluation.get_health(), DEGRADED)
+        self.assertEqual(evaluation.get_metric('veth2.bytes_sent'), 50.0)
+        self.assertNotIn('eth0.bytes_recv', dict(evaluation.list_metrics()))
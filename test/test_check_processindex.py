@@ -0,0 +1,80 @@
+import bootstrap
+
+import unittest
+import unittest.mock
+
+import psutil
+
+from mandelbrot.check.processindex import ProcessIndex, ProcessMatcher
+
+class MockProcess(object):
+    def __init__(self, pid, name, create_time=1.0, cmdline=None):
+        self.pid = pid
+        self.attrs = {'name': name, 'exe': '/bin/' + name, 'cmdline': cmdline or [name],
+                      'username': 'root', 'create_time': create_time}
+        self.inspected = 0
+    def as_dict(self, attrs, ad_value=None):
+        self.inspected += 1
+        return dict([(attr, self.attrs[attr]) for attr in attrs])
+    def create_time(self):
+        return self.attrs['create_time']
+
+class TestProcessIndex(unittest.TestCase):
+
+    def make_table(self, *processes):
+        self.table = dict([(p.pid, p) for p in processes])
+
+    def mock_process(self, pid):
+        if pid not in self.table:
+            raise psutil.NoSuchProcess(pid)
+        return self.table[pid]
+
+    def test_find_matching_processes(self):
+        "A ProcessIndex should return the processes which match"
+        self.make_table(MockProcess(1, 'init'), MockProcess(2, 'sshd'),
+            MockProcess(3, 'nginx', cmdline=['nginx', '-g', 'daemon off;']))
+        with unittest.mock.patch('psutil.pids', side_effect=lambda: sorted(self.table)), \
+             unittest.mock.patch('psutil.Process', side_effect=self.mock_process):
+            index = ProcessIndex(ttl=0.0)
+            self.assertListEqual([p.pid for p in index.find(ProcessMatcher(name='ssh'))], [2])
+            self.assertListEqual([p.pid for p in index.find(ProcessMatcher(cmdline='nginx -g'))], [3])
+            self.assertListEqual(index.find(ProcessMatcher(name='ssh', username='nobody')), [])
+
+    def test_inspect_only_new_pids(self):
+        "A ProcessIndex should only read the attributes of processes not seen before"
+        init = MockProcess(1, 'init')
+        self.make_table(init)
+        with unittest.mock.patch('psutil.pids', side_effect=lambda: sorted(self.table)), \
+             unittest.mock.patch('psutil.Process', side_effect=self.mock_process):
+            index = ProcessIndex(ttl=0.0)
+            matcher = ProcessMatcher(name='sshd')
+            self.assertListEqual(index.find(matcher), [])
+            sshd = MockProcess(2, 'sshd')
+            self.table[2] = sshd
+            self.assertListEqual(index.find(matcher), [sshd])
+            self.assertListEqual(index.find(matcher), [sshd])
+            self.assertEqual(init.inspected, 1)
+            self.assertEqual(sshd.inspected, 1)
+
+    def test_detect_reused_pid(self):
+        "A ProcessIndex should reinspect a matching pid which was reused"
+        self.make_table(MockProcess(2, 'sshd', create_time=1.0))
+        with unittest.mock.patch('psutil.pids', side_effect=lambda: sorted(self.table)), \
+             unittest.mock.patch('psutil.Process', side_effect=self.mock_process):
+            index = ProcessIndex(ttl=0.0)
+            matcher = ProcessMatcher(name='sshd')
+            self.assertEqual(len(index.find(matcher)), 1)
+            self.table[2] = MockProcess(2, 'bash', create_time=2.0)
+            self.assertListEqual(index.find(matcher), [])
+
+    def test_detect_pid_reused_by_matching_process(self):
+        "A ProcessIndex should reinspect a non-matching pid which was reused by a matching process"
+        self.make_table(MockProcess(2, 'bash', create_time=1.0))
+        with unittest.mock.patch('psutil.pids', side_effect=lambda: sorted(self.table)), \
+             unittest.mock.patch('psutil.Process', side_effect=self.mock_process):
+            index = ProcessIndex(ttl=0.0)
+            matcher = ProcessMatcher(name='sshd')
+            self.assertListEqual(index.find(matcher), [])
+            sshd = MockProcess(2, 'sshd', create_time=2.0)
+            self.table[2] = sshd
+            self.assertListEqual(index.find(matcher), [sshd])
@@ -0,0 +1,39 @@
+import bootstrap
+
+import unittest
+import unittest.mock
+
+from mandelbrot.check.sampling import SampleCache
+
+class TestSampleCache(unittest.TestCase):
+
+    def test_share_sample_within_ttl(self):
+        "A SampleCache should call the probe once for callers within the ttl"
+        probe = unittest.mock.Mock(side_effect=[1, 2])
+        cache = SampleCache(ttl=60.0)
+        value1, timestamp1 = cache.sample(probe)
+        value2, timestamp2 = cache.sample(probe)
+        self.assertEqual(value1, 1)
+        self.assertEqual(value2, 1)
+        self.assertEqual(timestamp1, timestamp2)
+        self.assertEqual(probe.call_count, 1)
+
+    def test_key_by_arguments(self):
+        "A SampleCache should cache each set of probe arguments separately"
+        probe = unittest.mock.Mock(side_effect=lambda perdisk: perdisk)
+        cache = SampleCache(ttl=60.0)
+        self.assertTrue(cache.sample(probe, perdisk=True)[0])
+        self.assertFalse(cache.sample(probe, perdisk=False)[0])
+        self.assertTrue(cache.sample(probe, perdisk=True)[0])
+        self.assertEqual(probe.call_count, 2)
+
+    @unittest.mock.patch('time.monotonic')
+    def test_expire_sample(self, monotonic):
+        "A SampleCache should call the probe again after the ttl expires"
+        monotonic.side_effect = [0.0, 0.1, 0.5]
+        probe = unittest.mock.Mock(side_effect=[1, 2])
+        cache = SampleCache(ttl=0.25)
+        self.assertEqual(cache.sample(probe)[0], 1)
+        self.assertEqual(cache.sample(probe)[0], 1)
+        self.assertEqual(cache.sample(probe)[0], 2)
+        self.assertEqual(probe.call_count, 2)
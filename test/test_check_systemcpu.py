@@ -5,6 +5,7 @@ import unittest.mock
 import cifparser
 import collections
 
+from mandelbrot.check.sampling import SampleCache
 from mandelbrot.model.evaluation import *
 
 MockCPUtimes = collections.namedtuple('MockCPUTimes', [
@@ -12,6 +13,12 @@ MockCPUtimes = collections.namedtuple('MockCPUTimes', [
 
 class TestSystemCPU(unittest.TestCase):
 
+    def setUp(self):
+        # each execution runs after the previous sample expired
+        patcher = unittest.mock.patch('mandelbrot.check.sampling._cache', SampleCache(ttl=0.0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @unittest.mock.patch('psutil.cpu_times')
     @unittest.mock.patch('time.time')
     def test_execute_SystemCPU_check_healthy(self, time, cpu_times):
@@ -81,3 +88,19 @@ class TestSystemCPU(unittest.TestCase):
         check.execute(evaluation, context)
         print(evaluation)
         self.assertEqual(evaluation.get_health(), FAILED)
+
+    @unittest.mock.patch('psutil.cpu_times')
+    def test_execute_SystemCPU_check_within_sample_ttl(self, cpu_times):
+        "SystemCPU check should return unknown evaluation when executed before the initial sample expires"
+        cpu_times.return_value = MockCPUtimes(user=0.0, system=0.0, idle=0.0, nice=0.0, iowait=0.0,
+            irq=0.0, softirq=0.0, steal=0.0, guest=0.0, guest_nice=0.0)
+        values = cifparser.ValueTree()
+        ns = cifparser.Namespace(values)
+        from mandelbrot.check.systemcpu import SystemCPU
+        check = SystemCPU(ns)
+        evaluation = Evaluation()
+        with unittest.mock.patch('mandelbrot.check.sampling._cache', SampleCache(ttl=60.0)):
+            context = check.init()
+            check.execute(evaluation, context)
+        self.assertEqual(evaluation.get_health(), UNKNOWN)
+        self.assertEqual(cpu_times.call_count, 1)
@@ -0,0 +1,116 @@
+import bootstrap
+
+import unittest
+import unittest.mock
+import argparse
+import pathlib
+import tempfile
+import shutil
+import cifparser
+
+import mandelbrot.instance
+import mandelbrot.command.agent.apply
+from mandelbrot.manifest import load_manifest
+
+manifest = """
+metadata:
+  pretty name = localhost
+  role = web
+checks:
+  system.load:
+    type = SystemLoad
+    interval = 30 seconds
+  system.cpu:
+    type = SystemCPU
+    idle failed threshold = 50%
+"""
+
+class TestApplyCommand(unittest.TestCase):
+
+    tmp_path = pathlib.Path(tempfile.gettempdir(), 'fixture_TestApplyCommand')
+
+    def setUp(self):
+        self.tmp_path.mkdir(parents=True)
+
+    def tearDown(self):
+        if self.tmp_path.exists():
+            shutil.rmtree(str(self.tmp_path))
+
+    def write_manifest(self, name, content):
+        path = self.tmp_path / name
+        with path.open('w') as f:
+            f.write(content)
+        return str(path)
+
+    def make_instance(self, manifest_path):
+        path = self.tmp_path / 'agent'
+        loaded = load_manifest(manifest_path)
+        instance = mandelbrot.instance.create_instance(path)
+        instance.bulk_update(agent_id=cifparser.make_path('foo'), manifest_url=loaded.manifest_url,
+            metadata=loaded.metadata, checks=loaded.checks)
+        return instance
+
+    def apply(self, manifest_path=None, dry_run=False):
+        ns = argparse.Namespace(manifest_path=manifest_path, dry_run=dry_run,
+            no_reload=True, verbose=False, path=str(self.tmp_path / 'agent'))
+        with unittest.mock.patch('builtins.print'):
+            return mandelbrot.command.agent.apply.run_command(ns)
+
+    def test_load_manifest(self):
+        "load_manifest() should load the metadata and the checks with their schedules"
+        manifest_path = self.write_manifest('manifest', manifest)
+        loaded = load_manifest(manifest_path)
+        self.assertEqual(loaded.manifest_url, pathlib.Path(manifest_path).as_uri())
+        self.assertListEqual(sorted(loaded.metadata), ['pretty name', 'role'])
+        self.assertEqual(loaded.metadata['role'].strip(), 'web')
+        checks = dict([(check.check_id, check) for check in loaded.checks])
+        self.assertListEqual(sorted(checks), [cifparser.make_path('system.cpu'),
+            cifparser.make_path('system.load')])
+        load = checks[cifparser.make_path('system.load')]
+        self.assertEqual(load.check_type, 'SystemLoad')
+        self.assertEqual(load.delay, 30.0)
+        self.assertEqual(load.offset, 0.0)
+        self.assertFalse(load.check_params.contains_field(cifparser.ROOT_PATH, 'interval'))
+        cpu = checks[cifparser.make_path('system.cpu')]
+        self.assertEqual(cpu.delay, 60.0)
+        self.assertEqual(cpu.check_params.get_str(cifparser.ROOT_PATH, 'idle failed threshold'), '50%')
+
+    def test_apply_unchanged_manifest(self):
+        "Applying the manifest the instance was created with should write nothing"
+        instance = self.make_instance(self.write_manifest('manifest', manifest))
+        generation = instance.get_generation()[1]
+        with unittest.mock.patch.object(mandelbrot.instance.Instance, 'bulk_update') as bulk_update:
+            self.assertEqual(self.apply(), 0)
+            self.assertEqual(bulk_update.call_count, 0)
+        self.assertEqual(instance.get_generation()[1], generation)
+        instance.close()
+
+    def test_apply_changed_manifest(self):
+        "Applying a changed manifest should write only the changes in a single transaction"
+        instance = self.make_instance(self.write_manifest('manifest', manifest))
+        changed = manifest.replace("role = web", "site = east") \
+                          .replace("50%", "40%") \
+                          .replace("interval = 30 seconds", "interval = 30 seconds\n  system.memory:\n    type = SystemMemory")
+        manifest_path = self.write_manifest('changed', changed)
+        # a dry run writes nothing
+        generation = instance.get_generation()[1]
+        self.assertEqual(self.apply(manifest_path, dry_run=True), 0)
+        self.assertEqual(instance.get_generation()[1], generation)
+        bulk_update = mandelbrot.instance.Instance.bulk_update
+        with unittest.mock.patch.object(mandelbrot.instance.Instance, 'bulk_update',
+                autospec=True, side_effect=bulk_update) as mock_bulk_update:
+            self.assertEqual(self.apply(manifest_path), 0)
+            self.assertEqual(mock_bulk_update.call_count, 1)
+            kwargs = mock_bulk_update.call_args[1]
+        self.assertEqual(kwargs['manifest_url'], pathlib.Path(manifest_path).as_uri())
+        self.assertListEqual(sorted(kwargs['metadata']), ['site'])
+        self.assertListEqual(kwargs['removed_metadata'], ['role'])
+        self.assertListEqual(sorted([check.check_id for check in kwargs['checks']]),
+            [cifparser.make_path('system.cpu'), cifparser.make_path('system.memory')])
+        self.assertListEqual(kwargs['removed_checks'], [])
+        self.assertListEqual(sorted([name for name,value in instance.list_metadata()]),
+            ['pretty name', 'site'])
+        self.assertListEqual(sorted([check.check_id for check in instance.list_checks()]),
+            [cifparser.make_path('system.cpu'), cifparser.make_path('system.load'),
+             cifparser.make_path('system.memory')])
+        instance.close()
@@ -0,0 +1,74 @@
+import bootstrap
+
+import unittest
+import subprocess
+import sys
+import os
+import time
+
+# modules which neither entry point should import before a subcommand runs
+heavy_modules = ['requests', 'pyparsing', 'psutil', 'daemon', 'cifparser', 'pkg_resources']
+
+# seconds each command may take to start, beyond starting the interpreter.  timings
+# are unreliable on a loaded machine, so the budget is only checked when it is set,
+# for example MANDELBROT_STARTUP_BUDGET=0.75
+startup_budget = os.environ.get('MANDELBROT_STARTUP_BUDGET')
+if startup_budget is not None:
+    startup_budget = float(startup_budget)
+
+def run_python(code):
+    "run code in a fresh interpreter, which imports mandelbrot from this tree"
+    env = dict(os.environ)
+    env['PYTHONPATH'] = bootstrap.parent
+    start = time.perf_counter()
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return time.perf_counter() - start, output.decode('utf-8').strip()
+
+def startup_time(code):
+    "return the best of three startup times, less the interpreter startup time"
+    baseline = min([run_python('pass')[0] for _ in range(3)])
+    return min([run_python(code)[0] for _ in range(3)]) - baseline
+
+class TestCommandStartup(unittest.TestCase):
+
+    def imported_heavy_modules(self, code):
+        code += "\nimport sys; print(' '.join(m for m in {} if m in sys.modules))".format(heavy_modules)
+        return run_python(code)[1].split()
+
+    def test_agent_parser_imports_no_dependencies(self):
+        "Creating the mandelbrot-agent parser should not import any subcommand dependencies"
+        imported = self.imported_heavy_modules(
+            "from mandelbrot.command.agent import make_parser\n"
+            "make_parser().parse_args(['status', 'instance'])")
+        self.assertListEqual(imported, [])
+
+    def test_query_parser_imports_no_dependencies(self):
+        "Creating the mandelbrot-query parser should not import any subcommand dependencies"
+        imported = self.imported_heavy_modules(
+            "from mandelbrot.command.query import make_parser\n"
+            "make_parser().parse_args(['condition', 'check'])")
+        self.assertListEqual(imported, [])
+
+    def test_timerange_grammar_is_built_on_first_use(self):
+        "Importing mandelbrot.timerange should not import pyparsing until a timerange is parsed"
+        imported = self.imported_heavy_modules("import mandelbrot.timerange")
+        self.assertNotIn('pyparsing', imported)
+        imported = self.imported_heavy_modules("import mandelbrot.timerange\n"
+            "mandelbrot.timerange.parse_timerange('1430000000..')")
+        self.assertIn('pyparsing', imported)
+
+    @unittest.skipIf(startup_budget is None, "MANDELBROT_STARTUP_BUDGET is not set")
+    def test_agent_startup_budget(self):
+        "Starting mandelbrot-agent status should fit within the startup budget"
+        elapsed = startup_time("from mandelbrot.command.agent import make_parser\n"
+            "make_parser().parse_args(['status', 'instance'])\n"
+            "import mandelbrot.command.agent.status")
+        self.assertLess(elapsed, startup_budget)
+
+    @unittest.skipIf(startup_budget is None, "MANDELBROT_STARTUP_BUDGET is not set")
+    def test_query_startup_budget(self):
+        "Starting mandelbrot-query condition should fit within the startup budget"
+        elapsed = startup_time("from mandelbrot.command.query import make_parser\n"
+            "make_parser().parse_args(['condition', 'check'])\n"
+            "import mandelbrot.command.query.condition")
+        self.assertLess(elapsed, startup_budget)
@@ -1,6 +1,7 @@
 import bootstrap
 
 import unittest
+import unittest.mock
 import pathlib
 import urllib.parse
 import tempfile
@@ -8,6 +9,7 @@ import shutil
 import cifparser
 
 import mandelbrot.instance
+from mandelbrot.model.fingerprint import RegistrationFingerprint
 
 class TestInstance(unittest.TestCase):
 
@@ -75,3 +77,156 @@ class TestInstance(unittest.TestCase):
         instance.set_endpoint_url(urllib.parse.urlparse('http://foo.com'))
         self.assertEqual(urllib.parse.urlunparse(instance.get_endpoint_url()), 'http://foo.com')
         instance.close()
+
+    def test_get_registration_fingerprint(self):
+        "Getting the registration fingerprint should return None if it was stored for another endpoint"
+        path = pathlib.Path(self.tmp_path, 'agent')
+        instance = mandelbrot.instance.create_instance(path)
+        self.assertIsNone(instance.get_registration_fingerprint(urllib.parse.urlparse('http://foo.com')))
+        instance.set_registration_fingerprint(urllib.parse.urlparse('http://foo.com'),
+            RegistrationFingerprint())
+        self.assertIsNone(instance.get_registration_fingerprint(urllib.parse.urlparse('http://bar.com')))
+        instance.close()
+
+    def test_set_registration_fingerprint(self):
+        "Setting the registration fingerprint for an instance should succeed"
+        path = pathlib.Path(self.tmp_path, 'agent')
+        instance = mandelbrot.instance.create_instance(path)
+        fingerprint = RegistrationFingerprint()
+        fingerprint.set_section('checks/load', 'abc')
+        fingerprint.set_generation(3)
+        instance.set_registration_fingerprint(urllib.parse.urlparse('http://foo.com'), fingerprint)
+        instance.close()
+        instance = mandelbrot.instance.open_instance(path)
+        accepted = instance.get_registration_fingerprint(urllib.parse.urlparse('http://foo.com'))
+        self.assertDictEqual(accepted.destructure(), fingerprint.destructure())
+        instance.close()
+
+    def test_load_snapshot(self):
+        "Loading the snapshot of an instance should return the checks, metadata and urls"
+        path = pathlib.Path(self.tmp_path, 'agent')
+        instance = mandelbrot.instance.create_instance(path)
+        instance.set_agent_id(cifparser.make_path('foo'))
+        instance.set_endpoint_url(urllib.parse.urlparse('http://foo.com'))
+        instance.set_meta_value('role', 'web')
+        for check_id in ('load', 'cpu'):
+            values = cifparser.ValueTree()
+            values.put_field(cifparser.ROOT_PATH, 'threshold', '90%')
+            instance.set_check(mandelbrot.instance.InstanceCheck(cifparser.make_path(check_id),
+                'systemload', cifparser.Namespace(values), 60.0, 0.0, 0.0))
+        snapshot = instance.load_snapshot()
+        self.assertEqual(snapshot.agent_id, cifparser.make_path('foo'))
+        self.assertEqual(urllib.parse.urlunparse(snapshot.endpoint_url), 'http://foo.com')
+        self.assertListEqual(snapshot.metadata, [('role', 'web')])
+        self.assertListEqual([check.check_id for check in snapshot.checks],
+            [cifparser.make_path('cpu'), cifparser.make_path('load')])
+        self.assertEqual(snapshot.checks[0].check_params.get_str(cifparser.ROOT_PATH, 'threshold'), '90%')
+        self.assertTrue((path / 'snapshot').exists())
+        instance.close()
+
+    def test_load_snapshot_until_instance_changes(self):
+        "Loading the snapshot should read the snapshot file until the instance changes"
+        path = pathlib.Path(self.tmp_path, 'agent')
+        instance = mandelbrot.instance.create_instance(path)
+        instance.set_meta_value('role', 'web')
+        snapshot = instance.load_snapshot()
+        # a valid snapshot is read from the snapshot file, not compiled from the database
+        with unittest.mock.patch.object(instance, 'list_metadata') as list_metadata:
+            self.assertListEqual(instance.load_snapshot().metadata, [('role', 'web')])
+            self.assertEqual(list_metadata.call_count, 0)
+        instance.set_meta_value('role', 'db')
+        self.assertGreater(instance.get_generation()[1], snapshot.generation)
+        self.assertListEqual(instance.load_snapshot().metadata, [('role', 'db')])
+        instance.close()
+        # a recreated instance does not accept the snapshot of the old instance
+        generation = instance.get_generation()[1]
+        shutil.copy(str(path / 'snapshot'), str(self.tmp_path / 'snapshot'))
+        shutil.rmtree(str(path))
+        instance = mandelbrot.instance.create_instance(path)
+        instance.set_meta_value('role', 'web')
+        instance.set_meta_value('role', 'cache')
+        self.assertEqual(instance.get_generation()[1], generation)
+        shutil.copy(str(self.tmp_path / 'snapshot'), str(path / 'snapshot'))
+        self.assertListEqual(instance.load_snapshot().metadata, [('role', 'cache')])
+        instance.close()
+
+    def test_load_snapshot_with_other_version(self):
+        "Loading the snapshot should compile a new snapshot if the snapshot file has another version"
+        path = pathlib.Path(self.tmp_path, 'agent')
+        instance = mandelbrot.instance.create_instance(path)
+        instance.set_meta_value('role', 'web')
+        instance.load_snapshot()
+        with unittest.mock.patch.object(mandelbrot.instance.InstanceSnapshot, 'version', 2):
+            with unittest.mock.patch.object(instance, 'list_metadata',
+                    return_value=[('role', 'web')]) as list_metadata:
+                self.assertListEqual(instance.load_snapshot().metadata, [('role', 'web')])
+                self.assertEqual(list_metadata.call_count, 1)
+        instance.close()
+
+    def test_bulk_update(self):
+        "Bulk updating an instance should set and delete checks and metadata"
+        path = pathlib.Path(self.tmp_path, 'agent')
+        instance = mandelbrot.instance.create_instance(path)
+        instance.bulk_update(agent_id=cifparser.make_path('foo'),
+            endpoint_url=urllib.parse.urlparse('http://foo.com'),
+            metadata={'role': 'web', 'site': 'east'},
+            checks=[self.make_instance_check('load'), self.make_instance_check('cpu')])
+        self.assertEqual(instance.get_agent_id(), cifparser.make_path('foo'))
+        self.assertListEqual(sorted(instance.list_metadata()), [('role', 'web'), ('site', 'east')])
+        instance.bulk_update(metadata={'role': 'db'}, removed_metadata=['site'],
+            checks=[self.make_instance_check('load', delay=30.0)],
+            removed_checks=[cifparser.make_path('cpu')])
+        self.assertEqual(instance.get_agent_id(), cifparser.make_path('foo'))
+        self.assertListEqual(sorted(instance.list_metadata()), [('role', 'db')])
+        checks = list(instance.list_checks())
+        self.assertListEqual([check.check_id for check in checks], [cifparser.make_path('load')])
+        self.assertEqual(checks[0].delay, 30.0)
+        instance.close()
+
+    def test_bulk_update_is_atomic(self):
+        "Bulk updating an instance should write none of the changes if any change fails"
+        path = pathlib.Path(self.tmp_path, 'agent')
+        instance = mandelbrot.instance.create_instance(path)
+        instance.set_meta_value('role', 'web')
+        generation = instance.get_generation()[1]
+        self.assertRaises(Exception, instance.bulk_update,
+            agent_id=cifparser.make_path('foo'), removed_metadata=['role'],
+            metadata={'site': object()})
+        self.assertIsNone(instance.get_agent_id())
+        self.assertListEqual(list(instance.list_metadata()), [('role', 'web')])
+        self.assertEqual(instance.get_generation()[1], generation)
+        instance.close()
+
+    def test_journal_mode(self):
+        "Opening an instance should use write-ahead logging"
+        path = pathlib.Path(self.tmp_path, 'agent')
+        instance = mandelbrot.instance.create_instance(path)
+        journal_mode = instance.conn.execute('PRAGMA journal_mode;').fetchone()[0]
+        self.assertEqual(journal_mode, 'wal')
+        instance.close()
+
+    def make_instance_check(self, check_id, delay=60.0, **params):
+        values = cifparser.ValueTree()
+        for name,value in params.items():
+            values.put_field(cifparser.ROOT_PATH, name, value)
+        return mandelbrot.instance.InstanceCheck(cifparser.make_path(check_id), 'systemload',
+            cifparser.Namespace(values), delay, 0.0, 0.0)
+
+    def test_diff_instance_checks(self):
+        "diff_instance_checks() should find the checks which were added, removed or changed"
+        running = {}
+        for check in [self.make_instance_check('load'),
+                      self.make_instance_check('cpu'),
+                      self.make_instance_check('memory', threshold='90%'),
+                      self.make_instance_check('disk')]:
+            running[check.check_id] = check
+        loaded = {}
+        for check in [self.make_instance_check('load'),
+                      self.make_instance_check('cpu', delay=30.0),
+                      self.make_instance_check('memory', threshold='95%'),
+                      self.make_instance_check('net')]:
+            loaded[check.check_id] = check
+        added,removed,changed = mandelbrot.instance.diff_instance_checks(running, loaded)
+        self.assertListEqual(added, [cifparser.make_path('net')])
+        self.assertListEqual(removed, [cifparser.make_path('disk')])
+        self.assertListEqual(changed, [cifparser.make_path('cpu'), cifparser.make_path('memory')])
@@ -1,14 +1,28 @@
 import bootstrap
 
 import unittest
+import pathlib
+import tempfile
+import shutil
+import json
+import unittest.mock
 
-from mandelbrot.registry import Registry
+from mandelbrot.registry import Registry, require_mandelbrot, requirement_matcher
 from mandelbrot.check import Check, entry_point_type
 from mandelbrot.check.dummy import AlwaysHealthy
 from mandelbrot import versionstring
 
 class TestRegistry(unittest.TestCase):
 
+    tmp_path = pathlib.Path(tempfile.gettempdir(), 'fixture_TestRegistry')
+
+    def setUp(self):
+        self.tmp_path.mkdir(parents=True)
+
+    def tearDown(self):
+        if self.tmp_path.exists():
+            shutil.rmtree(str(self.tmp_path))
+
     def test_lookup_check(self):
         "A Registry should lookup a check"
         registry = Registry()
@@ -33,3 +47,40 @@ class TestRegistry(unittest.TestCase):
         registry = Registry()
         self.assertRaises(Exception, registry.lookup_factory,
             entry_point_type, 'AlwaysHealthy', Check, "mandelbrot > " + versionstring())
+
+    def test_match_pinned_requirement_without_packaging(self):
+        "requirement_matcher() should match a pinned requirement without packaging or pkg_resources"
+        with unittest.mock.patch('mandelbrot.registry.Requirement', None), \
+                unittest.mock.patch.dict('sys.modules', {'pkg_resources': None}):
+            matches = requirement_matcher("Mandelbrot_Agent == 1.2.0")
+        self.assertTrue(matches('mandelbrot-agent', '1.2.0'))
+        self.assertFalse(matches('mandelbrot-agent', '1.2.1'))
+        self.assertFalse(matches('mandelbrot', '1.2.0'))
+
+    def test_memoize_factory(self):
+        "A Registry should load each factory only once"
+        registry = Registry()
+        factory = registry.lookup_factory(entry_point_type, 'AlwaysHealthy', Check)
+        self.assertIs(registry.factories[(entry_point_type, 'AlwaysHealthy', require_mandelbrot)], factory)
+        registry.index = {'entry_points': {}}
+        self.assertIs(registry.lookup_factory(entry_point_type, 'AlwaysHealthy', Check), factory)
+
+    def test_lookup_check_using_index(self):
+        "A Registry should write the entry point index and load it until sys.path changes"
+        index_path = pathlib.Path(self.tmp_path, 'registry.index')
+        registry = Registry(index_path)
+        factory = registry.lookup_factory(entry_point_type, 'AlwaysHealthy', Check)
+        self.assertIs(factory, AlwaysHealthy)
+        self.assertTrue(index_path.exists())
+        with index_path.open('r') as f:
+            index = json.load(f)
+        # an index which is still valid is loaded instead of scanning the distributions
+        index['entry_points'][entry_point_type]['Stale'] = index['entry_points'][entry_point_type]['AlwaysHealthy']
+        with index_path.open('w') as f:
+            json.dump(index, f)
+        self.assertIs(Registry(index_path).lookup_factory(entry_point_type, 'Stale', Check), AlwaysHealthy)
+        # an index is invalid once a directory on sys.path is modified
+        index['mtimes'] = {}
+        with index_path.open('w') as f:
+            json.dump(index, f)
+        self.assertRaises(KeyError, Registry(index_path).lookup_factory, entry_point_type, 'Stale', Check)
@@ -0,0 +1,130 @@
+import bootstrap
+
+import unittest
+import asyncio
+import ast
+import urllib.parse
+import concurrent.futures
+import requests
+import requests_mock
+
+from mandelbrot.transport.codec import Codec, CodecNegotiator, json_codec, make_codecs, parse_codecs
+from mandelbrot.transport.codec import MsgpackCodec, CborCodec, msgpack, cbor2
+from mandelbrot.transport.http import HttpTransport
+from mandelbrot.transport import UnsupportedMediaType
+
+class LiteralCodec(Codec):
+    name = 'literal'
+    content_type = 'application/x-literal'
+    def encode(self, entity):
+        return repr(entity).encode('utf-8')
+    def decode(self, body):
+        return ast.literal_eval(body.decode('utf-8'))
+
+class TestCodecNegotiator(unittest.TestCase):
+
+    def test_accept_codecs_in_order_of_preference(self):
+        "A CodecNegotiator should accept every codec, most preferred first"
+        negotiator = CodecNegotiator([LiteralCodec()])
+        self.assertEqual(negotiator.accept, "application/x-literal, application/json;q=0.9")
+        self.assertEqual(negotiator.encode({'foo': 1}), ('application/json', b'{"foo": 1}'))
+
+    def test_switch_request_codec(self):
+        "A CodecNegotiator should encode requests with a preferred codec once the server uses it"
+        negotiator = CodecNegotiator([LiteralCodec()])
+        entity = negotiator.decode('application/x-literal; charset=utf-8', b"{'foo': 1}")
+        self.assertEqual(entity, {'foo': 1})
+        self.assertEqual(negotiator.encode({'foo': 1}), ('application/x-literal', b"{'foo': 1}"))
+        self.assertTrue(negotiator.reject())
+        self.assertIs(negotiator.request_codec, json_codec)
+        self.assertFalse(negotiator.reject())
+
+    def test_decode_without_content_type(self):
+        "A CodecNegotiator should decode a response without a content type as JSON"
+        negotiator = CodecNegotiator([LiteralCodec()])
+        self.assertEqual(negotiator.decode(None, b'{"foo": 1}'), {'foo': 1})
+        self.assertRaises(ValueError, negotiator.decode, None, b'')
+        self.assertRaises(ValueError, negotiator.decode, 'text/html', b'<html/>')
+
+    def test_make_codecs(self):
+        "make_codecs() should skip unavailable codecs and always include JSON"
+        self.assertListEqual(make_codecs(['nonexistent']), [json_codec])
+
+    def test_parse_codecs(self):
+        "parse_codecs() should return None for auto, otherwise the named codecs"
+        self.assertIsNone(parse_codecs('auto'))
+        self.assertListEqual(parse_codecs('json'), [json_codec])
+        self.assertListEqual(parse_codecs('nonexistent, json'), [json_codec])
+
+    @unittest.skipUnless(msgpack is not None, "msgpack is not installed")
+    def test_msgpack_round_trip(self):
+        "A MsgpackCodec should decode the entity it encodes"
+        codec = MsgpackCodec()
+        entity = {'checkId': 'load', 'metrics': [1, 2.5, None], 'summary': 'ok'}
+        self.assertEqual(codec.decode(codec.encode(entity)), entity)
+        self.assertRaises(ValueError, codec.decode, b'\xc1')
+        self.assertListEqual([c.name for c in parse_codecs('msgpack')], ['msgpack', 'json'])
+
+    @unittest.skipUnless(cbor2 is not None, "cbor2 is not installed")
+    def test_cbor_round_trip(self):
+        "A CborCodec should decode the entity it encodes"
+        codec = CborCodec()
+        entity = {'checkId': 'load', 'metrics': [1, 2.5, None], 'summary': 'ok'}
+        self.assertEqual(codec.decode(codec.encode(entity)), entity)
+        self.assertRaises(ValueError, codec.decode, b'\xa1')
+        self.assertListEqual([c.name for c in parse_codecs('cbor')], ['cbor', 'json'])
+
+class TestHttpTransportCodec(unittest.TestCase):
+
+    url = urllib.parse.urlparse("mock://localhost")
+
+    def test_negotiate_codec(self):
+        "An HttpTransport should encode requests with the codec the server responds with"
+        event_loop = asyncio.new_event_loop()
+        mock = requests_mock.Adapter()
+        mock.register_uri('GET', '/v2/agents', status_code=200, content=b"{'agents': []}",
+            headers={'content-type': 'application/x-literal'})
+        mock.register_uri('POST', '/v2/agents', status_code=200, content=b"{'agentId': 'foo'}",
+            headers={'content-type': 'application/x-literal'})
+        session = requests.Session()
+        session.mount('mock', mock)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = HttpTransport(self.url, event_loop, executor, session=session, codecs=[LiteralCodec()])
+        entity = event_loop.run_until_complete(asyncio.wait_for(
+            transport.get_collection('v2/agents', {}, None, None), 5.0, loop=event_loop))
+        self.assertEqual(entity, {'agents': []})
+        self.assertEqual(mock.last_request.headers['accept'], "application/x-literal, application/json;q=0.9")
+        entity = event_loop.run_until_complete(asyncio.wait_for(
+            transport.create_item('v2/agents', {'agentId': 'foo'}), 5.0, loop=event_loop))
+        self.assertEqual(entity, {'agentId': 'foo'})
+        self.assertEqual(mock.last_request.headers['content-type'], 'application/x-literal')
+        self.assertEqual(mock.last_request.body, b"{'agentId': 'foo'}")
+        event_loop.close()
+
+    def test_fall_back_to_json(self):
+        "An HttpTransport should send the request again as JSON if the server rejects the codec"
+        event_loop = asyncio.new_event_loop()
+        mock = requests_mock.Adapter()
+        def respond(request, context):
+            if request.headers['content-type'] != 'application/json':
+                context.status_code = 415
+                return b''
+            context.status_code = 200
+            context.headers['content-type'] = 'application/json'
+            return b'{"accepted": true}'
+        mock.register_uri('POST', '/v2/agents', content=respond)
+        session = requests.Session()
+        session.mount('mock', mock)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = HttpTransport(self.url, event_loop, executor, session=session, codecs=[LiteralCodec()])
+        transport.negotiator.request_codec = transport.negotiator.codecs[0]
+        entity = event_loop.run_until_complete(asyncio.wait_for(
+            transport.create_item('v2/agents', {'agentId': 'foo'}), 5.0, loop=event_loop))
+        self.assertEqual(entity, {'accepted': True})
+        self.assertEqual(mock.call_count, 2)
+        self.assertIs(transport.negotiator.request_codec, json_codec)
+        mock.register_uri('POST', '/v2/agents', status_code=415)
+        with self.assertRaises(UnsupportedMediaType):
+            event_loop.run_until_complete(asyncio.wait_for(
+                transport.create_item('v2/agents', {'agentId': 'foo'}), 5.0, loop=event_loop))
+        event_loop.close()
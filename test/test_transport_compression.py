@@ -0,0 +1,87 @@
+import bootstrap
+
+import unittest
+import asyncio
+import gzip
+import json
+import urllib.parse
+import concurrent.futures
+import requests
+import requests_mock
+
+from mandelbrot.transport.compression import Compressor, make_compressor
+from mandelbrot.transport.http import HttpTransport
+from mandelbrot.stats import get_stats
+
+class TestCompressor(unittest.TestCase):
+
+    def test_compress_above_threshold(self):
+        "A Compressor should compress bodies which are at least the threshold size"
+        stats = get_stats('mandelbrot.transport.compression')
+        stats.clear()
+        compressor = Compressor('gzip', threshold=100)
+        encoding, body = compressor.compress(b'x' * 10)
+        self.assertIsNone(encoding)
+        self.assertEqual(body, b'x' * 10)
+        encoding, body = compressor.compress(b'x' * 1000)
+        self.assertEqual(encoding, 'gzip')
+        self.assertEqual(gzip.decompress(body), b'x' * 1000)
+        self.assertEqual(stats.get_counter('compressed requests'), 1)
+        self.assertEqual(stats.get_counter('uncompressed requests'), 1)
+        self.assertEqual(stats.get_counter('original bytes'), 1000)
+        self.assertEqual(stats.get_counter('compressed bytes'), len(body))
+
+    def test_reject_disables_compression(self):
+        "A Compressor should stop compressing once the server rejects the encoding"
+        compressor = Compressor('gzip', threshold=0)
+        self.assertTrue(compressor.reject())
+        self.assertFalse(compressor.reject())
+        self.assertEqual(compressor.compress(b'x' * 1000), (None, b'x' * 1000))
+
+    def test_make_compressor(self):
+        "make_compressor() should return None if compression is disabled"
+        self.assertIsNone(make_compressor(None))
+        self.assertIsNone(make_compressor('none'))
+        self.assertRaises(ValueError, make_compressor, 'lzw')
+
+class TestHttpTransportCompression(unittest.TestCase):
+
+    url = urllib.parse.urlparse("mock://localhost")
+
+    def test_compress_request(self):
+        "An HttpTransport should compress request bodies when compression is enabled"
+        event_loop = asyncio.new_event_loop()
+        mock = requests_mock.Adapter()
+        mock.register_uri('POST', '/v2/agents', status_code=200)
+        session = requests.Session()
+        session.mount('mock', mock)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = HttpTransport(self.url, event_loop, executor, session=session,
+            compression='gzip', compression_threshold=10)
+        item = {'summary': 'x' * 100}
+        event_loop.run_until_complete(asyncio.wait_for(
+            transport.create_item('v2/agents', item), 5.0, loop=event_loop))
+        self.assertEqual(mock.last_request.headers['content-encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(mock.last_request.body).decode('utf-8')), item)
+        event_loop.close()
+
+    def test_send_uncompressed_when_rejected(self):
+        "An HttpTransport should send the request uncompressed if the server rejects the encoding"
+        event_loop = asyncio.new_event_loop()
+        mock = requests_mock.Adapter()
+        def respond(request, context):
+            context.status_code = 415 if 'content-encoding' in request.headers else 200
+            return b''
+        mock.register_uri('POST', '/v2/agents', content=respond)
+        session = requests.Session()
+        session.mount('mock', mock)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = HttpTransport(self.url, event_loop, executor, session=session,
+            compression='gzip', compression_threshold=10)
+        item = {'summary': 'x' * 100}
+        event_loop.run_until_complete(asyncio.wait_for(
+            transport.create_item('v2/agents', item), 5.0, loop=event_loop))
+        self.assertEqual(mock.call_count, 2)
+        self.assertNotIn('content-encoding', mock.last_request.headers)
+        self.assertFalse(transport.compressor.enabled)
+        event_loop.close()
@@ -13,7 +13,9 @@ from mandelbrot.agent.endpoint import Endpoint
 from mandelbrot.model import construct
 from mandelbrot.model.agent_metadata import AgentMetadata
 from mandelbrot.model.registration import Registration
+from mandelbrot.model.evaluation import Evaluation
 from mandelbrot.model.timestamp import Timestamp, now
+from mandelbrot.transport import BadRequest, RetryLater
 
 class TestHttpTransport(unittest.TestCase):
 
@@ -65,3 +67,68 @@ class TestHttpTransport(unittest.TestCase):
         response = event_loop.run_until_complete(future)
         self.assertIsInstance(response, AgentMetadata)
         self.assertDictEqual(response.destructure(), agent_metadata.destructure())
+
+    def test_submit_evaluations(self):
+        "An HttpTransport should report the result of each evaluation in a batch"
+        event_loop = asyncio.new_event_loop()
+        mock = requests_mock.Adapter()
+        agent_id = cifparser.make_path('foo.local')
+        mock.register_uri('POST', '/v2/agents/' + str(agent_id) + '/evaluations', status_code=200,
+            json=[{'status': 200}, {'status': 400, 'description': 'bad evaluation'}])
+        session = requests.Session()
+        session.mount('mock', mock)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = HttpTransport(self.url, event_loop, executor, session=session)
+        endpoint = Endpoint(transport)
+        evaluations = [(cifparser.make_path('check1'), Evaluation()),
+                       (cifparser.make_path('check2'), Evaluation())]
+        future = asyncio.wait_for(endpoint.submit_evaluations(agent_id, evaluations), 5.0, loop=event_loop)
+        results = event_loop.run_until_complete(future)
+        self.assertEqual(results[0], (cifparser.make_path('check1'), None))
+        self.assertEqual(results[1][0], cifparser.make_path('check2'))
+        self.assertIsInstance(results[1][1], BadRequest)
+        self.assertEqual(mock.last_request.json(), [{'checkId': 'check1'}, {'checkId': 'check2'}])
+
+    def test_patch_item(self):
+        "An HttpTransport should send the fields of a patch as the entity and the constraints as parameters"
+        event_loop = asyncio.new_event_loop()
+        mock = requests_mock.Adapter()
+        mock.register_uri('PATCH', '/v2/agents/foo.local', status_code=200, json={'generation': 3})
+        session = requests.Session()
+        # requests only encodes parameters into http urls
+        session.mount('http://', mock)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = HttpTransport(urllib.parse.urlparse("http://localhost"),
+            event_loop, executor, session=session)
+        future = asyncio.wait_for(transport.patch_item('v2/agents/foo.local',
+            {'checks/load': None}, {'generation': 2}), 5.0, loop=event_loop)
+        entity = event_loop.run_until_complete(future)
+        self.assertDictEqual(entity, {'generation': 3})
+        self.assertEqual(mock.last_request.qs, {'generation': ['2']})
+        self.assertDictEqual(mock.last_request.json(), {'checks/load': None})
+        event_loop.close()
+
+    def test_connection_error_is_retryable(self):
+        "An HttpTransport should raise RetryLater when the request fails to connect"
+        event_loop = asyncio.new_event_loop()
+        mock = requests_mock.Adapter()
+        mock.register_uri('GET', '/v2/agents/foo.local', exc=requests.ConnectionError)
+        session = requests.Session()
+        session.mount('mock', mock)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        transport = HttpTransport(self.url, event_loop, executor, session=session)
+        future = asyncio.wait_for(transport.get_item('v2/agents/foo.local', {}), 5.0, loop=event_loop)
+        with self.assertRaises(RetryLater):
+            event_loop.run_until_complete(future)
+        event_loop.close()
+
+    def test_capacity_is_number_of_workers(self):
+        "An HttpTransport should report the number of transport workers as its capacity"
+        event_loop = asyncio.new_event_loop()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        transport = HttpTransport(self.url, event_loop, executor, workers=4)
+        self.assertEqual(transport.get_capacity(), 4)
+        transport = HttpTransport(self.url, event_loop, executor)
+        self.assertIsNone(transport.get_capacity())
+        executor.shutdown()
+        event_loop.close()
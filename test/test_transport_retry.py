@@ -0,0 +1,135 @@
+import bootstrap
+
+import unittest
+import asyncio
+import urllib.parse
+
+from mandelbrot.transport import Transport, RetryLater, BadRequest, CircuitOpen
+from mandelbrot.transport.retry import RetryPolicy, RetryBudget, CircuitBreaker, RetryingTransport
+from mandelbrot.stats import get_stats
+
+class FailingTransport(Transport):
+    "a transport which raises the queued results in order"
+    def __init__(self, event_loop, results):
+        super().__init__(urllib.parse.urlparse('mock://'), event_loop, None)
+        self.results = list(results)
+        self.calls = 0
+
+    @asyncio.coroutine
+    def get_item(self, path, filters):
+        self.calls += 1
+        result = self.results.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+class TestRetryingTransport(unittest.TestCase):
+
+    def setUp(self):
+        get_stats('mandelbrot.transport.retry').clear()
+
+    def make_policy(self, **kwargs):
+        return RetryPolicy(min_delay=0.01, max_delay=0.05, **kwargs)
+
+    def test_retry_until_success(self):
+        "A RetryingTransport should retry a request which fails with a retryable error"
+        event_loop = asyncio.new_event_loop()
+        transport = FailingTransport(event_loop, [RetryLater(), RetryLater(), 'ok'])
+        retrying = RetryingTransport(transport, self.make_policy(max_attempts=3))
+        coro = retrying.get_item('path', {})
+        result = event_loop.run_until_complete(asyncio.wait_for(coro, 5.0, loop=event_loop))
+        self.assertEqual(result, 'ok')
+        self.assertEqual(transport.calls, 3)
+        stats = get_stats('mandelbrot.transport.retry')
+        self.assertEqual(stats.get_counter('retries'), 2)
+        self.assertEqual(stats.get_gauge('breaker state'), CircuitBreaker.CLOSED)
+        event_loop.close()
+
+    def test_no_retry_on_non_retryable_error(self):
+        "A RetryingTransport should not retry a request which the server rejects"
+        event_loop = asyncio.new_event_loop()
+        transport = FailingTransport(event_loop, [BadRequest(), 'ok'])
+        retrying = RetryingTransport(transport, self.make_policy(max_attempts=3))
+        coro = retrying.get_item('path', {})
+        with self.assertRaises(BadRequest):
+            event_loop.run_until_complete(asyncio.wait_for(coro, 5.0, loop=event_loop))
+        self.assertEqual(transport.calls, 1)
+        event_loop.close()
+
+    def test_give_up_after_max_attempts(self):
+        "A RetryingTransport should raise the last error after max_attempts"
+        event_loop = asyncio.new_event_loop()
+        transport = FailingTransport(event_loop, [RetryLater()] * 5)
+        retrying = RetryingTransport(transport, self.make_policy(max_attempts=2))
+        coro = retrying.get_item('path', {})
+        with self.assertRaises(RetryLater):
+            event_loop.run_until_complete(asyncio.wait_for(coro, 5.0, loop=event_loop))
+        self.assertEqual(transport.calls, 2)
+        event_loop.close()
+
+    def test_circuit_breaker_opens(self):
+        "A RetryingTransport should reject requests while the circuit breaker is open"
+        event_loop = asyncio.new_event_loop()
+        transport = FailingTransport(event_loop, [RetryLater()] * 2 + ['ok'])
+        policy = self.make_policy(max_attempts=1, failure_threshold=2, reset_timeout=60.0)
+        retrying = RetryingTransport(transport, policy)
+        for _ in range(2):
+            with self.assertRaises(RetryLater):
+                event_loop.run_until_complete(retrying.get_item('path', {}))
+        with self.assertRaises(CircuitOpen):
+            event_loop.run_until_complete(retrying.get_item('path', {}))
+        self.assertEqual(transport.calls, 2)
+        stats = get_stats('mandelbrot.transport.retry')
+        self.assertEqual(stats.get_gauge('breaker state'), CircuitBreaker.OPEN)
+        self.assertEqual(stats.get_counter('rejected requests'), 1)
+        event_loop.close()
+
+    def test_circuit_breaker_trial_released_after_local_error(self):
+        "A RetryingTransport should allow another trial request after a trial fails with a local error"
+        event_loop = asyncio.new_event_loop()
+        transport = FailingTransport(event_loop, [RetryLater(), ValueError(), 'ok'])
+        policy = self.make_policy(max_attempts=1, failure_threshold=1, reset_timeout=0.01)
+        retrying = RetryingTransport(transport, policy)
+        with self.assertRaises(RetryLater):
+            event_loop.run_until_complete(retrying.get_item('path', {}))
+        event_loop.run_until_complete(asyncio.sleep(0.02, loop=event_loop))
+        with self.assertRaises(ValueError):
+            event_loop.run_until_complete(retrying.get_item('path', {}))
+        self.assertEqual(retrying.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(retrying.breaker.trial_pending)
+        result = event_loop.run_until_complete(retrying.get_item('path', {}))
+        self.assertEqual(result, 'ok')
+        self.assertEqual(retrying.breaker.state, CircuitBreaker.CLOSED)
+        event_loop.close()
+
+    def test_local_errors_do_not_open_circuit_breaker(self):
+        "A RetryingTransport should not count local errors or cancellation as breaker failures"
+        event_loop = asyncio.new_event_loop()
+        transport = FailingTransport(event_loop, [NotImplementedError(), asyncio.CancelledError()])
+        policy = self.make_policy(max_attempts=1, failure_threshold=1, reset_timeout=60.0)
+        retrying = RetryingTransport(transport, policy)
+        with self.assertRaises(NotImplementedError):
+            event_loop.run_until_complete(retrying.get_item('path', {}))
+        with self.assertRaises(asyncio.CancelledError):
+            event_loop.run_until_complete(retrying.get_item('path', {}))
+        self.assertEqual(retrying.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(retrying.breaker.failures, 0)
+        event_loop.close()
+
+    def test_retry_budget(self):
+        "A RetryBudget should limit retries to a fraction of requests"
+        budget = RetryBudget(0.5, 1.0)
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def test_delay_is_bounded(self):
+        "A RetryPolicy should never delay longer than max_delay"
+        policy = RetryPolicy(min_delay=1.0, max_delay=4.0)
+        for retry in range(10):
+            delay = policy.get_delay(retry)
+            self.assertGreaterEqual(delay, 0.0)
+            self.assertLessEqual(delay, 4.0)
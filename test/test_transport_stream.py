@@ -0,0 +1,183 @@
+import bootstrap
+
+import unittest
+import unittest.mock
+import asyncio
+import json
+import urllib.parse
+import cifparser
+
+from mandelbrot.transport import Conflict, RetryLater
+from mandelbrot.transport.stream import StreamTransport, HttpConnection, read_response
+from mandelbrot.agent.endpoint import Endpoint
+from mandelbrot.model import construct
+from mandelbrot.model.agent_metadata import AgentMetadata
+from mandelbrot.model.registration import Registration
+from mandelbrot.model.timestamp import Timestamp
+
+class MockServer(object):
+    """
+    Serves the canned response for each request, reading requests from
+    each connection in order so pipelined requests are supported.  If
+    status is None, then requests are read but never answered.
+    """
+    def __init__(self, event_loop, status, entity):
+        self.event_loop = event_loop
+        self.status = status
+        self.entity = json.dumps(entity).encode('utf-8')
+        self.connections = 0
+        self.requests = []
+        self.handlers = []
+
+    @asyncio.coroutine
+    def handle(self, reader, writer):
+        handler = asyncio.Future(loop=self.event_loop)
+        self.handlers.append(handler)
+        try:
+            yield from self.serve(reader, writer)
+        finally:
+            handler.set_result(None)
+
+    @asyncio.coroutine
+    def wait_closed(self):
+        if len(self.handlers) > 0:
+            yield from asyncio.wait(self.handlers, loop=self.event_loop)
+
+    @asyncio.coroutine
+    def serve(self, reader, writer):
+        self.connections += 1
+        while True:
+            request_line = yield from reader.readline()
+            if request_line == b'':
+                break
+            headers = {}
+            while True:
+                line = yield from reader.readline()
+                if line == b'\r\n':
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = yield from reader.readexactly(int(headers.get('content-length', '0')))
+            self.requests.append((request_line.decode('latin-1').split(' ')[:2], body))
+            if self.status is None:
+                continue
+            writer.write("HTTP/1.1 {} Status\r\nContent-Length: {}\r\n\r\n".format(
+                self.status, len(self.entity)).encode('latin-1') + self.entity)
+        writer.close()
+
+class TestStreamTransport(unittest.TestCase):
+
+    def make_server(self, event_loop, status, entity):
+        server = MockServer(event_loop, status, entity)
+        coro = asyncio.start_server(server.handle, '127.0.0.1', 0, loop=event_loop)
+        listener = event_loop.run_until_complete(coro)
+        port = listener.sockets[0].getsockname()[1]
+        url = urllib.parse.urlparse("http+stream://127.0.0.1:{}".format(port))
+        return server, listener, url
+
+    def shutdown(self, event_loop, transport, server, listener):
+        "close the transport and the server, and wait for their tasks to finish"
+        transport.close()
+        event_loop.run_until_complete(asyncio.wait_for(transport.wait_closed(), 5.0, loop=event_loop))
+        listener.close()
+        event_loop.run_until_complete(asyncio.wait_for(listener.wait_closed(), 5.0, loop=event_loop))
+        event_loop.run_until_complete(asyncio.wait_for(server.wait_closed(), 5.0, loop=event_loop))
+        event_loop.close()
+
+    def record_outstanding(self):
+        "patch HttpConnection.send to record the requests outstanding on the connection"
+        outstanding = []
+        send = HttpConnection.send
+        def record(connection, request, timeout=None):
+            outstanding.append(connection.num_requests)
+            return send(connection, request, timeout)
+        return outstanding, unittest.mock.patch.object(HttpConnection, 'send', record)
+
+    def make_agent_metadata(self):
+        agent_metadata = AgentMetadata()
+        agent_metadata.set_agent_id(cifparser.make_path('foo.local'))
+        timestamp = construct(Timestamp, 0)
+        agent_metadata.set_joined_on(timestamp)
+        agent_metadata.set_last_update(timestamp)
+        agent_metadata.set_generation(1)
+        return agent_metadata
+
+    def test_register_agent(self):
+        "A StreamTransport should support registering an Agent"
+        event_loop = asyncio.new_event_loop()
+        agent_metadata = self.make_agent_metadata()
+        server, listener, url = self.make_server(event_loop, 200, agent_metadata.destructure())
+        transport = StreamTransport(url, event_loop, None)
+        endpoint = Endpoint(transport)
+        registration = Registration()
+        future = asyncio.wait_for(endpoint.register_agent(registration), 5.0, loop=event_loop)
+        response = event_loop.run_until_complete(future)
+        self.assertIsInstance(response, AgentMetadata)
+        self.assertDictEqual(response.destructure(), agent_metadata.destructure())
+        self.assertEqual(server.requests[0][0], ['POST', '/v2/agents'])
+        self.shutdown(event_loop, transport, server, listener)
+
+    def test_raise_transport_exception(self):
+        "A StreamTransport should raise the TransportException matching the response status"
+        event_loop = asyncio.new_event_loop()
+        server, listener, url = self.make_server(event_loop, 409, {})
+        transport = StreamTransport(url, event_loop, None)
+        future = asyncio.wait_for(transport.create_item('v2/agents', {}), 5.0, loop=event_loop)
+        self.assertRaises(Conflict, event_loop.run_until_complete, future)
+        self.shutdown(event_loop, transport, server, listener)
+
+    def test_pipeline_requests(self):
+        "A StreamTransport should pipeline concurrent idempotent requests on a single connection"
+        event_loop = asyncio.new_event_loop()
+        server, listener, url = self.make_server(event_loop, 200, {'ok': True})
+        transport = StreamTransport(url, event_loop, None, max_connections=1, pipeline_depth=4)
+        outstanding, patch = self.record_outstanding()
+        with patch:
+            requests = [transport.replace_item('v2/items/{}'.format(n), {'n': n}) for n in range(8)]
+            future = asyncio.wait_for(asyncio.gather(*requests, loop=event_loop), 5.0, loop=event_loop)
+            responses = event_loop.run_until_complete(future)
+        self.assertListEqual(responses, [{'ok': True}] * 8)
+        self.assertEqual(server.connections, 1)
+        self.assertGreater(max(outstanding), 0)
+        self.assertListEqual(sorted(json.loads(body.decode('utf-8'))['n'] for _,body in server.requests),
+            list(range(8)))
+        self.shutdown(event_loop, transport, server, listener)
+
+    def test_do_not_pipeline_non_idempotent_requests(self):
+        "A StreamTransport should send each non-idempotent request on an idle connection"
+        event_loop = asyncio.new_event_loop()
+        server, listener, url = self.make_server(event_loop, 200, {'ok': True})
+        transport = StreamTransport(url, event_loop, None, max_connections=2, pipeline_depth=4)
+        outstanding, patch = self.record_outstanding()
+        with patch:
+            requests = [transport.create_item('v2/items', {'n': n}) for n in range(8)]
+            future = asyncio.wait_for(asyncio.gather(*requests, loop=event_loop), 5.0, loop=event_loop)
+            responses = event_loop.run_until_complete(future)
+        self.assertListEqual(responses, [{'ok': True}] * 8)
+        self.assertEqual(server.connections, 2)
+        self.assertListEqual(outstanding, [0] * 8)
+        self.assertListEqual(sorted(json.loads(body.decode('utf-8'))['n'] for _,body in server.requests),
+            list(range(8)))
+        self.shutdown(event_loop, transport, server, listener)
+
+    def test_request_timeout(self):
+        "A StreamTransport should raise RetryLater when the response is not received in time"
+        event_loop = asyncio.new_event_loop()
+        server, listener, url = self.make_server(event_loop, None, {})
+        transport = StreamTransport(url, event_loop, None, request_timeout=0.2)
+        future = asyncio.wait_for(transport.get_item('v2/items/1', {}), 5.0, loop=event_loop)
+        self.assertRaises(RetryLater, event_loop.run_until_complete, future)
+        self.assertTrue(all(connection.closed for connection in transport.connections))
+        self.shutdown(event_loop, transport, server, listener)
+
+    def test_read_chunked_response(self):
+        "read_response() should decode a chunked response body"
+        event_loop = asyncio.new_event_loop()
+        reader = asyncio.StreamReader(loop=event_loop)
+        reader.feed_data(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                         b"3\r\nfoo\r\n3\r\nbar\r\n0\r\n\r\n")
+        reader.feed_eof()
+        response = event_loop.run_until_complete(read_response(reader))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, b'foobar')
+        event_loop.close()